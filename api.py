@@ -1,47 +1,340 @@
 import requests
+import threading
 import time
+from requests.adapters import HTTPAdapter
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
 from urllib.parse import urljoin, urlencode
+from balancer import EndpointBalancer, parse_api_urls
+from metrics import metrics, progress
+from ratelimit import TokenBucket, AdaptiveConcurrencyLimiter, backoff_delay, parse_retry_after
 
 MAX_RETRIES = 3
-RETRY_DELAY = 2  # seconds
+RETRY_DELAY = 2  # seconds, 指数退避的基础等待时间
+MAX_RETRY_DELAY = 60  # seconds, 单次重试的最长等待时间
 
-def get_request_with_retry(url, params=None):
+DEFAULT_POOL_CONNECTIONS = 4   # 缓存连接池的主机数量
+DEFAULT_POOL_MAXSIZE = 16      # 每个主机保持的最大连接数
+RESPONSE_CHUNK_SIZE = 64 * 1024   # 流式读取响应体时每次读取的字节数
+MAX_PREALLOCATE_SIZE = 256 * 1024 * 1024   # 按 Content-Length 预分配响应缓冲区的上限
+
+# --- 连接复用统计 ---
+_connection_stats_lock = threading.Lock()
+_connection_stats = {'new': 0, 'reused': 0}
+
+
+def _record_connection(kind):
+    with _connection_stats_lock:
+        _connection_stats[kind] += 1
+
+
+def get_connection_stats():
+    """
+    获取连接统计信息
+    :return: {'new': 新建连接数, 'reused': 复用连接数}
+    """
+    with _connection_stats_lock:
+        return dict(_connection_stats)
+
+
+class _CountingPoolMixin:
+    """
+    在 urllib3 连接池取出连接时记录该连接是复用的还是需要新建的
+    """
+    def _get_conn(self, timeout=None):
+        conn = super()._get_conn(timeout=timeout)
+        # 仍持有已建立的 socket 即为复用; 新建或已被服务端断开的连接需要重新握手
+        if getattr(conn, 'sock', None) is not None:
+            _record_connection('reused')
+        else:
+            _record_connection('new')
+        return conn
+
+
+class _CountingHTTPConnectionPool(_CountingPoolMixin, HTTPConnectionPool):
+    pass
+
+
+class _CountingHTTPSConnectionPool(_CountingPoolMixin, HTTPSConnectionPool):
+    pass
+
+
+class _CountingHTTPAdapter(HTTPAdapter):
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {
+            'http': _CountingHTTPConnectionPool,
+            'https': _CountingHTTPSConnectionPool,
+        }
+
+
+_rate_limiter = TokenBucket()
+_concurrency_limiter = AdaptiveConcurrencyLimiter(DEFAULT_POOL_MAXSIZE)
+
+_balancers = {}
+_balancers_lock = threading.Lock()
+
+_session = None
+_session_lock = threading.Lock()
+_session_config = {
+    'pool_connections': DEFAULT_POOL_CONNECTIONS,
+    'pool_maxsize': DEFAULT_POOL_MAXSIZE,
+    'keep_alive': True,
+    'post_text': False,
+}
+
+
+def configure_session(pool_connections=None, pool_maxsize=None, keep_alive=None, post_text=None):
+    """
+    配置共享HTTP会话的连接池参数, 会丢弃已有会话, 下次请求时按新配置重建
+    :param pool_connections: 缓存连接池的主机数量
+    :param pool_maxsize: 每个主机的最大连接数 (超出时请求会等待空闲连接, 不会额外建连)
+    :param keep_alive: 是否保持长连接
+    :param post_text: 是否以POST请求体 (表单编码) 发送合成文本, 而不是放在URL查询参数中
+    """
+    global _session
+    with _session_lock:
+        if pool_connections is not None:
+            _session_config['pool_connections'] = pool_connections
+        if pool_maxsize is not None:
+            _session_config['pool_maxsize'] = pool_maxsize
+        if keep_alive is not None:
+            _session_config['keep_alive'] = keep_alive
+        if post_text is not None:
+            _session_config['post_text'] = post_text
+        if _session is not None:
+            _session.close()
+            _session = None
+
+
+def get_session():
+    """
+    获取进程内共享的HTTP会话 (线程安全, 懒加载)
+    """
+    global _session
+    with _session_lock:
+        if _session is None:
+            session = requests.Session()
+            adapter = _CountingHTTPAdapter(
+                pool_connections=_session_config['pool_connections'],
+                pool_maxsize=_session_config['pool_maxsize'],
+                pool_block=True,
+            )
+            session.mount('http://', adapter)
+            session.mount('https://', adapter)
+            if not _session_config['keep_alive']:
+                session.headers['Connection'] = 'close'
+            _session = session
+        return _session
+
+def configure_rate_limits(rate=None, burst=None, max_concurrency=None, max_retries=None):
+    """
+    配置客户端限速、自适应并发与重试次数
+    :param rate: 每秒最多发起的请求数 (None 表示不限速)
+    :param burst: 允许的瞬时突发请求数 (默认与 rate 相同)
+    :param max_concurrency: 自适应并发控制器的上限 (通常等于并发线程数)
+    :param max_retries: 每个请求的最大尝试次数
+    """
+    global _rate_limiter, _concurrency_limiter, MAX_RETRIES
+    _rate_limiter = TokenBucket(rate, burst)
+    if max_concurrency is not None:
+        _concurrency_limiter = AdaptiveConcurrencyLimiter(max_concurrency)
+    if max_retries is not None:
+        MAX_RETRIES = max_retries
+
+
+def _is_overload_status(status_code):
+    return status_code == 429 or status_code >= 500
+
+
+def _is_endpoint_failure(error):
     """
-    发起带重试逻辑的GET请求
-    :param url: 请求的完整URL
-    :param params: URL查询参数
-    :return: 成功时返回 Response 对象
-    :raises: ConnectionError 如果重试3次后仍然失败
+    判断一次失败是否应计入后端的失败次数: 只有过载状态码 (429/5xx)、超时与连接错误说明后端本身有问题,
+    4xx 等客户端错误 (如声音ID无效) 与后端健康无关
+    """
+    if isinstance(error, requests.exceptions.HTTPError):
+        return error.response is not None and _is_overload_status(error.response.status_code)
+    return isinstance(error, (requests.exceptions.Timeout, requests.exceptions.ConnectionError,
+                              requests.exceptions.ChunkedEncodingError))
+
+
+def get_balancer(api_url):
+    """
+    获取 --api 参数对应的负载均衡器, 只有一个地址时返回 None
+    """
+    urls = parse_api_urls(api_url)
+    if len(urls) <= 1:
+        return None
+    with _balancers_lock:
+        balancer = _balancers.get(api_url)
+        if balancer is None:
+            balancer = EndpointBalancer(urls, health_check=_health_check)
+            _balancers[api_url] = balancer
+        return balancer
+
+
+def _health_check(url):
+    response = get_session().get(url, timeout=10)
+    return response.ok
+
+
+def get_endpoint_stats(api_url):
+    """
+    获取多后端模式下各后端的请求统计, 单后端时返回空列表
+    """
+    balancer = get_balancer(api_url)
+    return balancer.stats() if balancer else []
+
+
+class ResponseBuffer:
+    """
+    流式接收响应体的缓冲区
+    - 响应带有 Content-Length 时按该长度一次性预分配, 分块读取的数据直接写入, 不再先收集分块再拼接
+    - 重试时调用 reset() 丢弃上一次尝试已接收的部分
+    """
+
+    def __init__(self):
+        self.data = bytearray()
+        self.size = 0
+
+    def reset(self, expected_size=None):
+        self.data = bytearray(expected_size or 0)
+        self.size = 0
+
+    def write(self, chunk):
+        end = self.size + len(chunk)
+        if end <= len(self.data):
+            self.data[self.size:end] = chunk
+        else:
+            del self.data[self.size:]
+            self.data += chunk
+        self.size = end
+
+    def getvalue(self):
+        """
+        :return: 已接收的数据 (bytearray), 长度与实际接收的字节数一致
+        """
+        if self.size < len(self.data):
+            del self.data[self.size:]
+        return self.data
+
+
+def _read_response_body(response, sink):
+    try:
+        expected_size = int(response.headers.get('Content-Length') or 0)
+    except ValueError:
+        expected_size = 0
+    # 声明的长度只用于预分配, 不可信的超大值不预先占用内存
+    sink.reset(expected_size if 0 < expected_size <= MAX_PREALLOCATE_SIZE else None)
+    for chunk in response.iter_content(RESPONSE_CHUNK_SIZE):
+        sink.write(chunk)
+    return sink.size
+
+
+def api_get(api_url, path, params=None):
+    """
+    向 API 的指定路径发起带重试的GET请求, 多后端时由负载均衡器为每次尝试选择后端
+    """
+    return api_request(api_url, path, params=params)
+
+
+def api_request(api_url, path, params=None, post=False, sink=None):
+    """
+    向 API 的指定路径发起带重试的请求, 多后端时由负载均衡器为每次尝试选择后端
+    - post 为 True 时参数以表单编码放在POST请求体中
+    - 提供 sink (ResponseBuffer) 时流式读取响应体到 sink 中
+    """
+    balancer = get_balancer(api_url)
+    if balancer is None:
+        return request_with_retry(urljoin(api_url, path), params=params, post=post, sink=sink)
+    return request_with_retry(path, params=params, balancer=balancer, post=post, sink=sink)
+
+
+def request_with_retry(url, params=None, balancer=None, post=False, sink=None):
+    """
+    发起带重试逻辑的HTTP请求
+    - 每次尝试前经过令牌桶限速与自适应并发控制
+    - 失败后按指数退避加随机抖动等待, 服务端返回 Retry-After 时以其为准 (并让其它请求一同暂停)
+    - 提供 sink 时以流式方式读取响应体并写入 sink, 读取中途断开同样按失败重试
+    :param url: 请求的完整URL; 提供 balancer 时为请求路径 (如 /forward)
+    :param params: 请求参数, GET请求放在URL查询参数中, POST请求放在请求体中
+    :param balancer: EndpointBalancer, 每次尝试 (包括重试) 都重新选择后端
+    :param post: 是否使用POST请求
+    :param sink: ResponseBuffer, 接收响应体
+    :return: 成功时返回 Response 对象 (提供 sink 时响应体已读入 sink)
+    :raises: ConnectionError 如果重试 MAX_RETRIES 次后仍然失败
     """
     last_error_message = ""
     
     # --- 优化点 2 START ---
     # 为了在日志中清晰地展示完整的请求URL
     full_url = url
-    if params:
+    if params and not post:
         full_url += "?" + urlencode(params)
     # --- 优化点 2 END ---
 
     for attempt in range(MAX_RETRIES):
+        retry_after = None
+        _rate_limiter.acquire()
+        limiter = _concurrency_limiter
+        limiter.acquire()
+        endpoint = balancer.acquire() if balancer else None
+        request_url = urljoin(endpoint.url, url) if endpoint else url
+        started = time.monotonic()
         try:
-            response = requests.get(url, params=params, timeout=60)
-            response.raise_for_status()  # 如果状态码是 4xx 或 5xx, 抛出 HTTPError
+            try:
+                if post:
+                    response = get_session().post(request_url, data=params, timeout=60, stream=sink is not None)
+                else:
+                    response = get_session().get(request_url, params=params, timeout=60, stream=sink is not None)
+                try:
+                    response.raise_for_status()  # 如果状态码是 4xx 或 5xx, 抛出 HTTPError
+                    received = _read_response_body(response, sink) if sink is not None else len(response.content)
+                finally:
+                    if sink is not None:
+                        response.close()
+            except BaseException as e:
+                if endpoint:
+                    balancer.release(endpoint, success=not _is_endpoint_failure(e))
+                raise
+            latency = time.monotonic() - started
+            metrics.observe('http_request_duration_seconds', latency)
+            metrics.add_stage_time('http', latency)
+            metrics.inc('http_requests')
+            metrics.inc('http_bytes_received', received)
+            limiter.release(latency=latency)
+            if endpoint:
+                balancer.release(endpoint, success=True, latency=latency)
             return response
         # --- 优化点 2 START ---
         # 捕获更具体的HTTP错误以获取状态码
         except requests.exceptions.HTTPError as e:
             status_code = e.response.status_code
             request_url = e.response.url
+            metrics.inc('http_errors')
+            limiter.release(overloaded=_is_overload_status(status_code))
+            retry_after = parse_retry_after(e.response.headers.get('Retry-After'))
             last_error_message = f"API返回错误状态码 {status_code} (URL: {request_url})"
             print(f"警告: 请求失败 (尝试 {attempt + 1}/{MAX_RETRIES}): {last_error_message}")
         # 捕获其他所有请求相关的错误 (如超时、DNS问题等)
         except requests.exceptions.RequestException as e:
+            metrics.inc('http_errors')
+            # 超时与连接失败同样视为服务端过载的信号
+            limiter.release(overloaded=isinstance(e, (requests.exceptions.Timeout, requests.exceptions.ConnectionError)))
             last_error_message = f"请求时发生网络错误: {e}"
             print(f"警告: 请求失败 (尝试 {attempt + 1}/{MAX_RETRIES}): {last_error_message}")
         # --- 优化点 2 END ---
+        except BaseException:
+            limiter.release()
+            raise
             
         if attempt < MAX_RETRIES - 1:
-            time.sleep(RETRY_DELAY)
+            metrics.inc('http_retries')
+            if retry_after is not None:
+                delay = min(retry_after, MAX_RETRY_DELAY)
+                _rate_limiter.defer(delay)
+            else:
+                delay = backoff_delay(attempt, RETRY_DELAY, MAX_RETRY_DELAY)
+            time.sleep(delay)
         else:
             # --- 优化点 2 START ---
             # 在最终的异常信息中包含更详细的错误
@@ -54,29 +347,30 @@ def get_voices(api_url):
     :param api_url: API基础地址
     :return: 声音列表的JSON数据
     """
-    voices_url = urljoin(api_url, "/voices")
-    print(f"正在从 {voices_url} 获取声音列表...")
-    response = get_request_with_retry(voices_url)
+    print(f"正在从 {api_url} 获取声音列表...")
+    response = api_get(api_url, "/voices")
     return response.json()
 
 
 def text_to_speech(api_url, text, voice_params):
     """
     调用文本转语音接口
-    :param api_url: API基础地址
+    :param api_url: API基础地址 (多个地址以逗号分隔时自动负载均衡)
     :param text: 要转换的文本
     :param voice_params: 声音相关参数 (voice, volume, speed, pitch)
-    :return: WAV音频二进制数据
+    :return: WAV音频二进制数据 (bytearray)
     """
-    forward_url = urljoin(api_url, "/forward")
-    
     # 过滤掉值为None的参数
     params = {k: v for k, v in voice_params.items() if v is not None}
     params['text'] = text
 
-    # 为了日志清晰, 只显示部分文本
-    log_text = (text[:30] + '...') if len(text) > 30 else text
-    print(f"正在合成文本: \"{log_text.strip()}\"")
-    
-    response = get_request_with_retry(forward_url, params=params)
-    return response.content
+    # 为了日志清晰, 只显示部分文本 (--quiet / --progress 模式下不逐行打印)
+    if progress.line_logging:
+        log_text = (text[:30] + '...') if len(text) > 30 else text
+        print(f"正在合成文本: \"{log_text.strip()}\"")
+    metrics.inc('http_text_bytes_sent', len(text.encode('utf-8')))
+
+    # 响应体流式读入预分配的缓冲区, 之后由 parse_wav 以 memoryview 引用, 不再产生整段拷贝
+    buffer = ResponseBuffer()
+    api_request(api_url, "/forward", params=params, post=_session_config['post_text'], sink=buffer)
+    return buffer.getvalue()
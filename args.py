@@ -1,5 +1,14 @@
 import argparse
+import re
 import sys
+from cache import parse_size, DEFAULT_DEDUP_MEMORY
+from encoders import OUTPUT_ENCODERS, OUTPUT_FORMAT_WAV, check_output_format
+from lrc import LRC_TIMING_WEIGHTED, LRC_TIMING_SILENCE
+from metrics import METRICS_FORMAT_JSONL, METRICS_FORMAT_PROMETHEUS
+from segment import parse_duration
+from server import parse_server_address, is_loopback_host
+from process import STREAM_FORMAT_WAV, STREAM_FORMAT_PCM
+from tts import DEFAULT_MAX_REQUEST_CHARS
 
 def parse_and_validate_args():
     """
@@ -14,13 +23,21 @@ def parse_and_validate_args():
     )
 
     # API 和通用参数
-    parser.add_argument('--api', type=str, required=True, help='指定调用的API地址 (必须提供)')
+    parser.add_argument('--api', type=str, required=True, help='指定调用的API地址 (必须提供), 多个后端地址以逗号分隔时自动负载均衡')
 
     # 功能分支参数
     group = parser.add_mutually_exclusive_group()
     group.add_argument('-l', '--list', action='store_true', help='获取并显示支持的声音列表')
     group.add_argument('-f', '--file', type=str, help='指定需要转换的单个文本文件')
     group.add_argument('-d', '--dir', type=str, help='指定需要批量处理的文件夹')
+    group.add_argument('--stream', action='store_true', help='流式模式: 从标准输入逐行读取文本, 合成后立即将音频写到标准输出')
+    group.add_argument('--serve', type=str, metavar='[HOST:]PORT', help='常驻服务模式: 在指定地址提供任务提交接口 (默认只监听 127.0.0.1)')
+
+    # list 分支的筛选参数
+    parser.add_argument('--locale', type=str, help='与 --list 一起使用, 只显示指定语言的声音 (如 zh-CN, 或 zh 匹配所有中文声音)')
+    parser.add_argument('--gender', type=str, help='与 --list 一起使用, 只显示指定性别的声音 (如 Female, Male)')
+    parser.add_argument('--refresh-voices', action='store_true', help='与 --list 一起使用, 忽略本地缓存重新获取声音列表')
+    parser.add_argument('--voice-cache-ttl', type=int, help='声音列表本地缓存的有效期 (秒, 默认为 86400, 0 表示每次都重新获取)')
 
     # file 和 dir 分支的附加参数
     parser.add_argument('-o', '--out', type=str, default='.', help='指定输出文件夹 (默认为当前目录)')
@@ -41,7 +58,129 @@ def parse_and_validate_args():
         help='为处理的文件生成LRC歌词文件。可选择提供每句最大字符数 (10-100)，若不提供数字则默认为 15。'
     )
     
+    parser.add_argument(
+        '--lrc-timing',
+        choices=[LRC_TIMING_WEIGHTED, LRC_TIMING_SILENCE],
+        default=None,
+        help='LRC时间轴计算方式: weighted 按可朗读字符数加权分配 (默认); silence 额外检测音频中的停顿来校正分句时间'
+    )
+    parser.add_argument(
+        '--format',
+        choices=list(OUTPUT_ENCODERS),
+        default=None,
+        help='输出音频格式: wav (默认); flac 无损压缩 (内置编码器); mp3/opus 有损压缩 (需要安装 ffmpeg)。边合成边编码, 不生成中间WAV文件'
+    )
+    parser.add_argument('--split-chapter', type=str, help='按章节分段输出: 匹配该正则的行作为新分段的开头 (如 "^第.+章")')
+    parser.add_argument('--split-duration', type=str, help='按时长分段输出, 每个分段不超过该时长 (如 30m, 1h, 默认单位为秒)')
+    parser.add_argument('--split-size', type=str, help='按大小分段输出, 每个分段的音频数据不超过该大小 (如 500M)')
+    parser.add_argument(
+        '--stream-format',
+        choices=[STREAM_FORMAT_WAV, STREAM_FORMAT_PCM],
+        default=None,
+        help='流式模式的输出格式: wav 输出带流式文件头的WAV (默认); pcm 只输出原始PCM数据'
+    )
     parser.add_argument('-b', '--blacklist', type=str, help='指定不参与处理的黑名单字/词 (支持正则, 可为文件、URL或字符串)')
+    parser.add_argument(
+        '-w', '--workers',
+        type=int,
+        default=None,
+        choices=range(1, 65),
+        metavar="[1-64]",
+        help='指定并发合成的线程数 (1-64, 默认为 1 即逐行串行合成)'
+    )
+    parser.add_argument(
+        '--file-workers',
+        type=int,
+        default=None,
+        choices=range(1, 65),
+        metavar="[1-64]",
+        help='批量处理时同时处理的文件数 (1-64, 默认为 1), 所有文件共用 --workers 指定的并发额度'
+    )
+    parser.add_argument(
+        '--batch-chars',
+        type=int,
+        default=None,
+        metavar="[0-5000]",
+        help='将连续的短行合并为一次请求, 每次请求的总字符数不超过该值 (0-5000, 默认为 0 即不合并)'
+    )
+    parser.add_argument(
+        '--max-request-chars',
+        type=int,
+        default=None,
+        metavar="[0-5000]",
+        help='单次请求的最大字符数, 超过该长度的行按句拆分为多个请求后拼接音频 (0-5000, 默认为 500, 0 表示不拆分)'
+    )
+    parser.add_argument(
+        '--max-silence',
+        type=int,
+        default=None,
+        metavar="[0-10000]",
+        help='将每行音频首尾的静音分别截短到不超过该时长 (毫秒, 0 表示完全去除), 行首行尾的 [[PAUSE:n]] 停顿会保留'
+    )
+    parser.add_argument(
+        '--normalize',
+        type=float,
+        default=None,
+        metavar="DBFS",
+        help='将每行音频的响度 (有声部分的RMS电平) 统一调整到该值 (-60 到 0 dBFS, 如 -20), 增益不会导致削波。'
+             '未安装 numpy 时约为实时速度的 70-200 倍, 安装后约快 10 倍'
+    )
+    parser.add_argument(
+        '--sample-rate',
+        type=int,
+        default=None,
+        metavar="[8000-192000]",
+        help='将输出音频重采样到该采样率 (Hz, 线性插值)。未安装 numpy 时较慢, 约为实时速度的 15-60 倍, 安装后约快 10 倍'
+    )
+    parser.add_argument(
+        '--pool-maxsize',
+        type=int,
+        default=None,
+        choices=range(1, 257),
+        metavar="[1-256]",
+        help='指定每个API主机保持的最大HTTP连接数 (默认为 16 与并发线程数中的较大值)'
+    )
+    parser.add_argument('--cache-dir', type=str, help='指定合成缓存目录, 相同文本与声音参数的行将直接复用缓存音频')
+    parser.add_argument('--cache-max-size', type=str, help='指定合成缓存的最大容量, 超出时淘汰最久未使用的条目 (如 500M, 2G, 默认不限制)')
+    parser.add_argument('--dedup-memory', type=str, help='重复行去重时在内存中保留的音频总量 (如 128M, 默认 128M, 0 表示不去重), 文件内及批量处理的多个文件之间的重复行只合成一次')
+    parser.add_argument('--resume', action='store_true', help='从上次中断的位置继续合成, 批量处理时跳过输出已是最新的文件')
+    parser.add_argument('--incremental', action='store_true', help='增量更新: 保存行级映射表, 修改文本后再次运行时只合成新增或修改的行 (仅支持WAV格式)')
+    parser.add_argument('--auto-convert', action='store_true', help='遇到非UTF-8编码的文件时不再询问, 按检测到的编码自动转换为UTF-8 (会覆盖原文件, 检测可信度过低的文件不转换)')
+    parser.add_argument('--rate-limit', type=float, help='限制每秒最多发起的API请求数 (默认不限制)')
+    parser.add_argument('--rate-burst', type=int, help='限速时允许的瞬时突发请求数 (默认与 --rate-limit 相同)')
+    parser.add_argument(
+        '--max-retries',
+        type=int,
+        default=None,
+        choices=range(1, 21),
+        metavar="[1-20]",
+        help='每个API请求的最大尝试次数 (1-20, 默认为 3), 重试间隔按指数退避并遵循服务端的 Retry-After'
+    )
+    parser.add_argument('-q', '--quiet', action='store_true', help='不逐行打印合成日志, 只显示警告与结果')
+    parser.add_argument('--progress', action='store_true', help='不逐行打印合成日志, 改为在标准错误上显示进度条')
+    parser.add_argument('--metrics-file', type=str, help='运行结束后将各阶段耗时、请求延迟分布、重试次数等统计写入该文件')
+    parser.add_argument(
+        '--metrics-format',
+        choices=[METRICS_FORMAT_JSONL, METRICS_FORMAT_PROMETHEUS],
+        default=None,
+        help='统计文件格式: jsonl 每次运行追加一行JSON (默认); prometheus 覆盖写入 Prometheus textfile 格式'
+    )
+    parser.add_argument(
+        '--max-jobs',
+        type=int,
+        default=None,
+        choices=range(1, 33),
+        metavar="[1-32]",
+        help='常驻服务模式下同时执行的任务数 (1-32, 默认为 2), 所有任务共用 --workers 指定的并发额度'
+    )
+    parser.add_argument('--job-ttl', type=int,
+                        help='常驻服务模式下已结束的任务保留的秒数 (默认为 3600), 超时后查询该任务返回 404')
+    parser.add_argument('--job-history', type=int,
+                        help='常驻服务模式下最多保留的已结束任务数 (默认为 100), 超出时先移除最早结束的任务')
+    parser.add_argument('--no-keep-alive', action='store_true', help='禁用HTTP长连接, 每次请求后关闭连接')
+    parser.add_argument('--allow-remote', action='store_true',
+                        help='允许 --serve 监听非本机回环地址。服务没有身份验证, 能访问该地址的任何人都可以读取和覆盖本机文件')
+    parser.add_argument('--post', action='store_true', help='以POST请求体发送合成文本 (需要后端支持), 不受URL长度限制')
 
     args = parser.parse_args()
 
@@ -50,23 +189,57 @@ def parse_and_validate_args():
 
     # list 分支检查
     if args.list:
-        allowed_args = ['api', 'list']
+        allowed_args = ['api', 'list', 'locale', 'gender', 'refresh_voices', 'voice_cache_ttl']
         for arg, value in vars(args).items():
             # 检查 args.sub 是否为默认值 None
             if arg == 'sub' and value is None:
                 continue
             if arg not in allowed_args and value is not None and value is not False and value != '.':
-                 parser.error("使用 --list 参数时, 只允许提供 --api 参数")
+                 parser.error("使用 --list 参数时, 只允许提供 --api 参数及 --locale、--gender、--refresh-voices、--voice-cache-ttl")
 
     # file 或 dir 分支检查
     if args.file or args.dir:
-        allowed_args = ['api', 'file', 'dir', 'out', 'voice', 'volume', 'speed', 'pitch', 'sub', 'blacklist']
+        allowed_args = ['api', 'file', 'dir', 'out', 'voice', 'volume', 'speed', 'pitch', 'sub', 'blacklist', 'workers', 'pool_maxsize', 'no_keep_alive', 'post', 'cache_dir', 'cache_max_size', 'resume', 'file_workers', 'lrc_timing', 'batch_chars', 'format', 'split_chapter', 'split_duration', 'split_size', 'incremental', 'rate_limit', 'rate_burst', 'max_retries',
+                        'quiet', 'progress', 'metrics_file', 'metrics_format', 'auto_convert', 'voice_cache_ttl',
+                        'dedup_memory', 'max_request_chars', 'max_silence', 'normalize', 'sample_rate']
         for arg, value in vars(args).items():
              if arg not in allowed_args and value is not None and value is not False and value != '.':
                 parser.error(f"使用 --file 或 --dir 时, 不允许使用 --{arg} 参数")
     
+    # stream 分支检查
+    if args.stream:
+        allowed_args = ['api', 'stream', 'stream_format', 'voice', 'volume', 'speed', 'pitch', 'blacklist',
+                        'workers', 'pool_maxsize', 'no_keep_alive', 'post', 'cache_dir', 'cache_max_size',
+                        'rate_limit', 'rate_burst', 'max_retries', 'quiet', 'metrics_file', 'metrics_format',
+                        'max_request_chars', 'max_silence', 'normalize', 'sample_rate']
+        for arg, value in vars(args).items():
+             if arg not in allowed_args and value is not None and value is not False and value != '.':
+                parser.error(f"使用 --stream 时, 不允许使用 --{arg} 参数")
+    elif args.stream_format is not None:
+        parser.error("--stream-format 只能与 --stream 一起使用")
+
+    # serve 分支检查
+    if args.serve:
+        allowed_args = ['api', 'serve', 'max_jobs', 'workers', 'pool_maxsize', 'no_keep_alive', 'post', 'cache_dir',
+                        'cache_max_size', 'rate_limit', 'rate_burst', 'max_retries', 'metrics_file', 'metrics_format',
+                        'voice_cache_ttl', 'allow_remote', 'job_ttl', 'job_history']
+        for arg, value in vars(args).items():
+             if arg not in allowed_args and value is not None and value is not False and value != '.':
+                parser.error(f"使用 --serve 时, 不允许使用 --{arg} 参数")
+        try:
+            args.serve = parse_server_address(args.serve)
+        except ValueError as e:
+            parser.error(str(e))
+        if not is_loopback_host(args.serve[0]) and not args.allow_remote:
+            parser.error(f"--serve 监听地址 {args.serve[0]} 不是本机回环地址。服务没有身份验证, "
+                         f"任务可以读取和覆盖本机任意文件; 确需对外提供服务时请加上 --allow-remote")
+    elif args.max_jobs is not None:
+        parser.error("--max-jobs 只能与 --serve 一起使用")
+    elif args.job_ttl is not None or args.job_history is not None:
+        parser.error("--job-ttl 与 --job-history 只能与 --serve 一起使用")
+
     # 检查是否指定了操作
-    if not args.list and not args.file and not args.dir:
+    if not args.list and not args.file and not args.dir and not args.stream and not args.serve:
         # 如果除了 --api 之外还有其他参数, 则视为错误
         other_args_present = any(
             val is not None and val is not False
@@ -75,5 +248,92 @@ def parse_and_validate_args():
         if other_args_present:
              parser.error("提供了无效的参数组合 (使用 -h 获取帮助)")
 
+    if args.cache_max_size is not None:
+        if not args.cache_dir:
+            parser.error("使用 --cache-max-size 时必须同时提供 --cache-dir")
+        try:
+            args.cache_max_size = parse_size(args.cache_max_size)
+        except ValueError as e:
+            parser.error(str(e))
+
+    if args.dedup_memory is not None:
+        try:
+            args.dedup_memory = parse_size(args.dedup_memory)
+        except ValueError as e:
+            parser.error(str(e))
+    else:
+        args.dedup_memory = DEFAULT_DEDUP_MEMORY
+
+    if args.split_chapter is not None:
+        try:
+            re.compile(args.split_chapter)
+        except re.error as e:
+            parser.error(f"--split-chapter 不是有效的正则表达式: {e}")
+    try:
+        if args.split_duration is not None:
+            args.split_duration = parse_duration(args.split_duration)
+        if args.split_size is not None:
+            args.split_size = parse_size(args.split_size)
+    except ValueError as e:
+        parser.error(str(e))
+
+    if args.incremental and (args.format not in (None, OUTPUT_FORMAT_WAV) or args.split_chapter or args.split_duration or args.split_size):
+        parser.error("--incremental 仅支持WAV格式, 且不能与分段输出同时使用")
+
+    if args.quiet and args.progress:
+        parser.error("--quiet 与 --progress 不能同时使用")
+    if args.metrics_format is not None and not args.metrics_file:
+        parser.error("--metrics-format 需要与 --metrics-file 一起使用")
+    if args.metrics_format is None:
+        args.metrics_format = METRICS_FORMAT_JSONL
+
+    if args.voice_cache_ttl is not None and args.voice_cache_ttl < 0:
+        parser.error("--voice-cache-ttl 不能小于 0")
+    if args.job_ttl is not None and args.job_ttl < 0:
+        parser.error("--job-ttl 不能小于 0")
+    if args.job_history is not None and args.job_history < 0:
+        parser.error("--job-history 不能小于 0")
+
+    if args.file_workers is not None and not args.dir:
+        parser.error("--file-workers 只能与 --dir 一起使用")
+
+    if args.lrc_timing is not None and args.sub is None:
+        parser.error("--lrc-timing 需要与 -s/--sub 一起使用")
+
+    if args.format is None:
+        args.format = OUTPUT_FORMAT_WAV
+    try:
+        check_output_format(args.format)
+    except ValueError as e:
+        parser.error(str(e))
+
+    if args.lrc_timing is None:
+        args.lrc_timing = LRC_TIMING_WEIGHTED
+    if args.stream_format is None:
+        args.stream_format = STREAM_FORMAT_WAV
+    if args.rate_limit is not None and args.rate_limit <= 0:
+        parser.error("--rate-limit 必须大于 0")
+    if args.rate_burst is not None and (args.rate_limit is None or args.rate_burst < 1):
+        parser.error("--rate-burst 需要与 --rate-limit 一起使用, 且必须大于等于 1")
+    if args.batch_chars is not None and not 0 <= args.batch_chars <= 5000:
+        parser.error("--batch-chars 必须在 0 到 5000 之间")
+    if args.max_request_chars is not None and not 0 <= args.max_request_chars <= 5000:
+        parser.error("--max-request-chars 必须在 0 到 5000 之间")
+    if args.normalize is not None and not -60 <= args.normalize <= 0:
+        parser.error("--normalize 必须在 -60 到 0 (dBFS) 之间")
+    if args.max_silence is not None and not 0 <= args.max_silence <= 10000:
+        parser.error("--max-silence 必须在 0 到 10000 (毫秒) 之间")
+    if args.sample_rate is not None and not 8000 <= args.sample_rate <= 192000:
+        parser.error("--sample-rate 必须在 8000 到 192000 (Hz) 之间")
+
+    if args.batch_chars is None:
+        args.batch_chars = 0
+    if args.max_request_chars is None:
+        args.max_request_chars = DEFAULT_MAX_REQUEST_CHARS
+    if args.workers is None:
+        args.workers = 1
+    if args.file_workers is None:
+        args.file_workers = 1
+
 
     return args
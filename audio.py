@@ -0,0 +1,267 @@
+import os
+import sys
+import struct
+from array import array
+
+# 静音检测参数
+SILENCE_WINDOW_MS = 10          # 分析窗口长度
+SILENCE_THRESHOLD_RATIO = 0.05  # 窗口峰值低于该行最大峰值的此比例视为静音
+SILENCE_MIN_DURATION_MS = 80    # 连续静音达到此时长才视为停顿
+
+# 流式输出时无法预知总长度, 按惯例将长度字段写为最大值
+STREAMING_DATA_SIZE = 0xFFFFFFFF
+
+WAV_MAX_DATA_SIZE = 0xFFFFFFFF - 4096   # RIFF 长度字段为32位, 为文件头预留空间后单个WAV文件可容纳的最大数据量
+
+_SAMPLE_TYPECODES = {1: 'b', 2: 'h', 4: 'i'}
+_UNSIGNED_TO_SIGNED_8BIT = bytes((value - 128) & 0xFF for value in range(256))   # 8位无符号采样 -> 有符号字节
+
+
+class WavFormatError(ValueError):
+    """
+    WAV数据无法解析时抛出
+    """
+
+
+class WavChunk:
+    """
+    从一段完整WAV二进制数据中解析出的格式信息与PCM数据
+    - fmt_body: 原始 fmt 块内容 (写入输出文件时原样复制)
+    - frames: data 块内容的 memoryview, 直接引用原始响应数据, 不产生拷贝
+    """
+    __slots__ = ('fmt_body', 'channels', 'sample_rate', 'block_align', 'bits_per_sample', 'frames')
+
+    def __init__(self, fmt_body, frames):
+        if len(fmt_body) < 16:
+            raise WavFormatError("fmt 块长度不足")
+        (_, self.channels, self.sample_rate, _,
+         self.block_align, self.bits_per_sample) = struct.unpack_from('<HHIIHH', fmt_body)
+        if self.sample_rate == 0 or self.block_align == 0:
+            raise WavFormatError("fmt 块参数无效")
+        self.fmt_body = bytes(fmt_body)
+        # 丢弃末尾不足一帧的残余字节
+        usable = len(frames) - len(frames) % self.block_align
+        self.frames = frames[:usable]
+
+    @property
+    def frame_count(self):
+        return len(self.frames) // self.block_align
+
+    @property
+    def duration_ms(self):
+        return int(self.frame_count / self.sample_rate * 1000)
+
+
+def parse_wav(data):
+    """
+    解析WAV二进制数据, 返回 WavChunk
+    :param data: bytes / bytearray / memoryview
+    :raises: WavFormatError 如果数据不是有效的WAV
+    """
+    view = memoryview(data)
+    if len(view) < 12 or view[0:4] != b'RIFF' or view[8:12] != b'WAVE':
+        raise WavFormatError("不是有效的 RIFF/WAVE 数据")
+
+    fmt_body = None
+    pos = 12
+    while pos + 8 <= len(view):
+        chunk_id = bytes(view[pos:pos + 4])
+        chunk_size, = struct.unpack_from('<I', view, pos + 4)
+        body_start = pos + 8
+        if chunk_id == b'fmt ':
+            fmt_body = view[body_start:body_start + chunk_size]
+        elif chunk_id == b'data':
+            if fmt_body is None:
+                raise WavFormatError("data 块出现在 fmt 块之前")
+            # 流式返回的WAV可能把长度写成 0 或 0xFFFFFFFF, 此时以实际数据为准
+            body_end = len(view) if chunk_size in (0, STREAMING_DATA_SIZE) else min(body_start + chunk_size, len(view))
+            return WavChunk(fmt_body, view[body_start:body_end])
+        pos = body_start + chunk_size + (chunk_size & 1)
+
+    raise WavFormatError("缺少 fmt 或 data 块")
+
+
+def pcm_samples(chunk):
+    """
+    将 WavChunk 的PCM数据转换为整数采样数组 (多声道交错排列)
+    :return: array, 不支持的采样位宽返回 None
+    """
+    sample_width = chunk.block_align // max(chunk.channels, 1)
+    typecode = _SAMPLE_TYPECODES.get(sample_width)
+    if typecode is None or array(typecode).itemsize != sample_width:
+        return None
+    if sample_width == 1:
+        # 8位WAV为无符号采样, 查表转换为以 0 为中心 (translate 在C层完成)
+        return array('b', bytes(chunk.frames).translate(_UNSIGNED_TO_SIGNED_8BIT))
+    samples = array(typecode)
+    samples.frombytes(chunk.frames)
+    if sys.byteorder == 'big':
+        samples.byteswap()
+    return samples
+
+
+def find_silent_spans(chunk, threshold_ratio=SILENCE_THRESHOLD_RATIO,
+                      min_duration_ms=SILENCE_MIN_DURATION_MS, window_ms=SILENCE_WINDOW_MS):
+    """
+    检测一段音频中的静音区间
+    按固定窗口计算峰值 (切片上的 max/min 在C层完成, Python层只按窗口循环),
+    峰值低于整段最大峰值一定比例的连续窗口合并为静音区间。
+    :return: [(开始毫秒, 结束毫秒), ...], 相对于该段音频开头
+    """
+    samples = pcm_samples(chunk)
+    if not samples:
+        return []
+    window = max(1, chunk.sample_rate * window_ms // 1000) * chunk.channels
+    peaks = []
+    for start in range(0, len(samples), window):
+        segment = samples[start:start + window]
+        peaks.append(max(max(segment), -min(segment)))
+    threshold = max(peaks) * threshold_ratio
+    if threshold <= 0:
+        return []
+
+    spans = []
+    run_start = None
+    for index, peak in enumerate(peaks + [threshold]):
+        if peak < threshold:
+            if run_start is None:
+                run_start = index
+        elif run_start is not None:
+            if (index - run_start) * window_ms >= min_duration_ms:
+                spans.append((run_start * window_ms, min(index * window_ms, chunk.duration_ms)))
+            run_start = None
+    return spans
+
+
+def build_wav_header(fmt_body, data_size):
+    """
+    构造包含 fmt 块与 data 块头的WAV文件头
+    """
+    fmt_padded = fmt_body + (b'\x00' if len(fmt_body) & 1 else b'')
+    riff_size = 4 + 8 + len(fmt_padded) + 8 + data_size + (data_size & 1)
+    return (b'RIFF' + struct.pack('<I', min(riff_size, 0xFFFFFFFF)) + b'WAVE'
+            + b'fmt ' + struct.pack('<I', len(fmt_body)) + fmt_padded
+            + b'data' + struct.pack('<I', min(data_size, 0xFFFFFFFF)))
+
+
+class WavStreamWriter:
+    """
+    流式WAV写入器: 按顺序追加各音频块的PCM数据, 关闭时回填 RIFF/data 长度字段
+    - 以第一个有效音频块的格式作为输出格式, 格式不一致的块会被跳过
+    - 写入过程中输出到 <path>.part, 成功关闭后原子重命名为目标文件
+    - keep_partial 为 True 时, 出错退出不会删除 .part 文件, 以便断点续传
+    """
+    supports_resume = True
+
+    def __init__(self, output_path, keep_partial=False):
+        self.output_path = output_path
+        self.partial_path = output_path + '.part'
+        self.keep_partial = keep_partial
+        self.fmt_body = None
+        self.sample_rate = None
+        self.block_align = None
+        self.data_size = 0
+        self._file = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+        elif self.keep_partial:
+            self.flush()
+            self._file_close()
+        else:
+            self.abort()
+        return False
+
+    @property
+    def frame_count(self):
+        return self.data_size // self.block_align if self.block_align else 0
+
+    @property
+    def duration_ms(self):
+        return int(self.frame_count / self.sample_rate * 1000) if self.sample_rate else 0
+
+    def _open(self, chunk):
+        self.fmt_body = chunk.fmt_body
+        self.sample_rate = chunk.sample_rate
+        self.block_align = chunk.block_align
+        self._file = open(self.partial_path, 'wb')
+        self._file.write(build_wav_header(self.fmt_body, 0))
+
+    def resume(self, data_size):
+        """
+        在已有的 .part 文件基础上继续写入, 截断到 data 块的 data_size 字节处
+        :return: True 表示续写成功, False 表示 .part 文件不存在或不完整
+        """
+        if data_size == 0:
+            return True
+        try:
+            f = open(self.partial_path, 'r+b')
+        except OSError:
+            return False
+        try:
+            chunk = parse_wav(f.read(4096))
+            header_size = len(build_wav_header(chunk.fmt_body, 0))
+            if os.fstat(f.fileno()).st_size < header_size + data_size:
+                f.close()
+                return False
+        except WavFormatError:
+            f.close()
+            return False
+        f.truncate(header_size + data_size)
+        f.seek(0, os.SEEK_END)
+        self.fmt_body = chunk.fmt_body
+        self.sample_rate = chunk.sample_rate
+        self.block_align = chunk.block_align
+        self.data_size = data_size
+        self._file = f
+        return True
+
+    def flush(self):
+        if self._file is not None:
+            self._file.flush()
+
+    def _file_close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def append(self, chunk):
+        """
+        追加一个 WavChunk 的PCM数据
+        :return: True 表示已写入, False 表示因格式不一致被跳过
+        """
+        if self._file is None:
+            self._open(chunk)
+        elif chunk.fmt_body[:16] != self.fmt_body[:16]:
+            return False
+        self._file.write(chunk.frames)
+        self.data_size += len(chunk.frames)
+        return True
+
+    def close(self):
+        """
+        回填文件头中的长度字段并生成最终文件
+        :return: True 表示已生成文件, False 表示没有写入任何音频
+        """
+        if self._file is None:
+            return False
+        if self.data_size & 1:
+            self._file.write(b'\x00')
+        self._file.seek(0)
+        self._file.write(build_wav_header(self.fmt_body, self.data_size))
+        self._file.close()
+        self._file = None
+        os.replace(self.partial_path, self.output_path)
+        return True
+
+    def abort(self):
+        """
+        放弃写入并删除未完成的文件
+        """
+        self._file_close()
+        if os.path.exists(self.partial_path):
+            os.remove(self.partial_path)
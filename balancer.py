@@ -0,0 +1,135 @@
+import threading
+import time
+from urllib.parse import urljoin
+
+HEALTH_CHECK_PATH = "/voices"
+EJECT_AFTER_FAILURES = 3     # 连续失败达到该次数后暂时移出轮转
+MIN_EJECT_SECONDS = 5        # 首次移出后等待多久开始健康检查
+MAX_EJECT_SECONDS = 300      # 反复失败时的最长等待时间
+LATENCY_EWMA_ALPHA = 0.2     # 延迟滑动平均的权重
+
+
+def parse_api_urls(api_url):
+    """
+    解析 --api 参数, 多个地址以逗号分隔
+    :return: 去重后的地址列表
+    """
+    urls = []
+    for part in api_url.split(','):
+        part = part.strip()
+        if part and part not in urls:
+            urls.append(part)
+    return urls
+
+
+class Endpoint:
+    __slots__ = ('url', 'outstanding', 'latency', 'requests', 'failures',
+                 'consecutive_failures', 'ejected_until', 'eject_seconds', 'probing')
+
+    def __init__(self, url):
+        self.url = url
+        self.outstanding = 0
+        self.latency = None
+        self.requests = 0
+        self.failures = 0
+        self.consecutive_failures = 0
+        self.ejected_until = None
+        self.eject_seconds = MIN_EJECT_SECONDS
+        self.probing = False
+
+    @property
+    def healthy(self):
+        return self.ejected_until is None
+
+    def score(self):
+        # 在途请求越少、平均延迟越低的后端得分越低, 优先被选中
+        return (self.outstanding + 1) * (self.latency or 0.001)
+
+
+class EndpointBalancer:
+    """
+    多后端负载均衡器 (线程安全)
+    - 在健康的后端中选择 (在途请求数 + 1) × 平均延迟 最小的一个
+    - 连续失败的后端被移出轮转, 由后台线程定期请求 /voices 做健康检查, 恢复后重新加入
+    """
+
+    def __init__(self, urls, health_check=None):
+        self.endpoints = [Endpoint(url) for url in urls]
+        self._health_check = health_check
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """
+        选择一个后端并计入在途请求
+        """
+        with self._lock:
+            candidates = [e for e in self.endpoints if e.healthy]
+            if not candidates:
+                # 所有后端都被移出时, 选择最早可以重试的一个, 而不是让任务停滞
+                candidates = [min(self.endpoints, key=lambda e: e.ejected_until)]
+            endpoint = min(candidates, key=Endpoint.score)
+            endpoint.outstanding += 1
+            endpoint.requests += 1
+            return endpoint
+
+    def release(self, endpoint, success, latency=None):
+        """
+        归还后端并记录本次请求结果
+        """
+        start_probe = False
+        with self._lock:
+            endpoint.outstanding -= 1
+            if success:
+                endpoint.consecutive_failures = 0
+                if latency is not None:
+                    if endpoint.latency is None:
+                        endpoint.latency = latency
+                    else:
+                        endpoint.latency += LATENCY_EWMA_ALPHA * (latency - endpoint.latency)
+                return
+            endpoint.failures += 1
+            endpoint.consecutive_failures += 1
+            if endpoint.healthy and endpoint.consecutive_failures >= EJECT_AFTER_FAILURES and len(self.endpoints) > 1:
+                endpoint.ejected_until = time.monotonic() + endpoint.eject_seconds
+                print(f"警告: 后端 {endpoint.url} 连续失败 {endpoint.consecutive_failures} 次, "
+                      f"暂时移出轮转 ({endpoint.eject_seconds} 秒后开始健康检查)。")
+                if not endpoint.probing and self._health_check is not None:
+                    endpoint.probing = True
+                    start_probe = True
+        if start_probe:
+            threading.Thread(target=self._probe_loop, args=(endpoint,), name="tts_health_check", daemon=True).start()
+
+    def _probe_loop(self, endpoint):
+        while True:
+            with self._lock:
+                wait = endpoint.ejected_until - time.monotonic()
+            if wait > 0:
+                time.sleep(wait)
+            healthy = False
+            try:
+                healthy = self._health_check(urljoin(endpoint.url, HEALTH_CHECK_PATH))
+            except Exception:
+                healthy = False
+            with self._lock:
+                if healthy:
+                    endpoint.ejected_until = None
+                    endpoint.consecutive_failures = 0
+                    endpoint.eject_seconds = MIN_EJECT_SECONDS
+                    endpoint.probing = False
+                    print(f"后端 {endpoint.url} 健康检查通过, 已重新加入轮转。")
+                    return
+                endpoint.eject_seconds = min(MAX_EJECT_SECONDS, endpoint.eject_seconds * 2)
+                endpoint.ejected_until = time.monotonic() + endpoint.eject_seconds
+
+    def stats(self):
+        with self._lock:
+            return [
+                {
+                    'url': e.url,
+                    'requests': e.requests,
+                    'failures': e.failures,
+                    'healthy': e.healthy,
+                    'latency_ms': e.latency * 1000 if e.latency is not None else None,
+                }
+                for e in self.endpoints
+            ]
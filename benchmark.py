@@ -0,0 +1,305 @@
+#!/usr/bin/env python3
+"""
+离线基准测试: 使用本地模拟 TTS 服务测量各处理阶段的吞吐量与资源占用
+- process_file: 端到端合成 (行/秒, 请求延迟 p50/p95, 峰值内存, 磁盘写入量)
+- combine_wav_files / split_text_for_lrc / apply_blacklist: 单独测量
+每个用例在独立子进程中运行, 峰值内存互不影响。
+"""
+
+import argparse
+import contextlib
+import io
+import json
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+from mock_server import MockTTSServer, synthesize_wav
+
+CORPUS_SIZES = {'small': 100, 'medium': 1000, 'large': 5000}
+CORPUS_CHARS = "的一是在不了有和人这中大为上个国我以要他时来用们生到作地于出就分对成会可主发年动同工也能下过子说产种面而方后多定行学法所民得经十三之进着等部度家电力里如水化高自二理起小物现实加量都两体制机当使点从业本去把性好应开它合还因由其些然前外天政四日那社义事平形相全表间样与关各重新线内数正心反你明看原又么利比或但质气第向道命此变条只没结解问意建月公无系军很情者最立代想已通并提直题党程展五果料象员革位入常文总次品式活设及管特件长求老头基资边流路级少图山统接知较将组见计别她手角期根论运农指几九区强放决西被干做必战先回则任取据处队南给色光门即保治北造百规热领七海口东导器压志世金增争济阶油思术极交受联什认六共权收证改清己美再采转更单风切打白教速花带安场身车例真务具万每目至达走积示议声报斗完类八离华名确才科张信马节话米整空元况今集温传土许步群广石记需段研界拉林律叫且究观越织装影算低持音众书布复容儿须际商非验连断深难近矿千周委素技备半办青省列习响约支般史感劳便团往酸历市克何除消构府称太准精值号率族维划选标写存候毛亲快效斯院查江型眼王按格养易置派层片始却专状育厂京识适属圆包火住调满县局照参红细引听该铁价严"
+CORPUS_PUNCTUATION = "，。！？；：、"
+BLACKLIST_REGEXES = [r"\d{3,}", r"第[一二三四五六七八九十]+章"]
+
+
+def generate_corpus(line_count, seed=0, min_len=4, max_len=120):
+    """
+    生成可复现的测试文本, 约一成为重复行, 混有标点与空行
+    """
+    rng = random.Random(seed)
+    lines = []
+    for _ in range(line_count):
+        if lines and rng.random() < 0.1:
+            lines.append(rng.choice(lines))
+            continue
+        length = rng.randint(min_len, max_len)
+        chars = []
+        for _ in range(length):
+            chars.append(rng.choice(CORPUS_PUNCTUATION) if rng.random() < 0.08 else rng.choice(CORPUS_CHARS))
+        lines.append("".join(chars))
+    return lines
+
+
+def generate_blacklist(word_count, seed=0):
+    rng = random.Random(seed + 1)
+    words = {"".join(rng.choice(CORPUS_CHARS) for _ in range(rng.randint(2, 4))) for _ in range(word_count)}
+    return sorted(words) + BLACKLIST_REGEXES
+
+
+def _percentile(values, fraction):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def _peak_rss_mb():
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux 以 KB 为单位, macOS 以字节为单位
+    return peak / 1024 / 1024 if sys.platform == 'darwin' else peak / 1024
+
+
+def _written_bytes():
+    """
+    读取本进程累计写入的字节数 (仅 Linux), 不可用时返回 None
+    """
+    try:
+        with open('/proc/self/io', 'r') as f:
+            for line in f:
+                if line.startswith('wchar:'):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return None
+
+
+def _dir_size(path):
+    total = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            total += os.path.getsize(os.path.join(root, name))
+    return total
+
+
+@contextlib.contextmanager
+def _measure(result):
+    """
+    记录耗时、峰值内存与磁盘写入量, 并屏蔽被测代码的标准输出
+    """
+    written_before = _written_bytes()
+    started = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        yield
+    result['seconds'] = time.perf_counter() - started
+    written_after = _written_bytes()
+    if written_before is not None and written_after is not None:
+        result['disk_bytes_written'] = written_after - written_before
+    result['peak_rss_mb'] = _peak_rss_mb()
+
+
+def bench_process_file(api_url, line_count, workers, seed):
+    import tts
+    from process import process_file
+
+    work_dir = tempfile.mkdtemp(prefix="tts_bench_")
+    try:
+        input_path = os.path.join(work_dir, "corpus.txt")
+        with open(input_path, 'w', encoding='utf-8') as f:
+            f.write("\n".join(generate_corpus(line_count, seed)))
+
+        # 包装 API 调用以记录每个请求的延迟
+        latencies = []
+        original = tts.text_to_speech
+
+        def timed_text_to_speech(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return original(*args, **kwargs)
+            finally:
+                latencies.append((time.perf_counter() - started) * 1000)
+
+        tts.text_to_speech = timed_text_to_speech
+        result = {}
+        output_dir = os.path.join(work_dir, "out")
+        with _measure(result):
+            process_file(api_url, input_path, output_dir, {}, 15, None, workers=workers)
+        tts.text_to_speech = original
+
+        result.setdefault('disk_bytes_written', _dir_size(output_dir))
+        result['items'] = line_count
+        result['throughput'] = line_count / result['seconds']
+        result['unit'] = 'lines/s'
+        result['latency_p50_ms'] = _percentile(latencies, 0.5)
+        result['latency_p95_ms'] = _percentile(latencies, 0.95)
+        return result
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+def bench_combine_wav_files(chunk_count, seed):
+    from tts import combine_wav_files
+
+    work_dir = tempfile.mkdtemp(prefix="tts_bench_")
+    try:
+        paths = []
+        for i, line in enumerate(generate_corpus(chunk_count, seed)):
+            path = os.path.join(work_dir, f"chunk_{i}.wav")
+            with open(path, 'wb') as f:
+                f.write(synthesize_wav(line))
+            paths.append(path)
+        output_path = os.path.join(work_dir, "combined.wav")
+        input_bytes = _dir_size(work_dir)
+
+        result = {}
+        with _measure(result):
+            combine_wav_files(paths, output_path)
+        result.setdefault('disk_bytes_written', os.path.getsize(output_path))
+        result['items'] = chunk_count
+        result['throughput'] = input_bytes / 1024 / 1024 / result['seconds']
+        result['unit'] = 'MB/s'
+        return result
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+def bench_split_text_for_lrc(line_count, seed):
+    from utils import split_text_for_lrc
+
+    lines = generate_corpus(line_count, seed)
+    result = {}
+    with _measure(result):
+        for line in lines:
+            split_text_for_lrc(line, 15)
+    result['items'] = line_count
+    result['throughput'] = line_count / result['seconds']
+    result['unit'] = 'lines/s'
+    return result
+
+
+def bench_apply_blacklist(line_count, word_count, seed):
+    from utils import BlacklistMatcher, apply_blacklist
+
+    lines = generate_corpus(line_count, seed)
+    result = {}
+    with _measure(result):
+        matcher = BlacklistMatcher(generate_blacklist(word_count, seed))
+        for line in lines:
+            apply_blacklist(line, matcher)
+    result['items'] = line_count
+    result['throughput'] = line_count / result['seconds']
+    result['unit'] = 'lines/s'
+    return result
+
+
+def run_in_subprocess(func, *args):
+    """
+    在全新的子进程中运行用例, 使峰值内存统计只反映该用例
+    """
+    with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context('spawn')) as executor:
+        return executor.submit(func, *args).result()
+
+
+def run_benchmarks(sizes, workers, latency_ms, jitter_ms, error_rate, seed, blacklist_words):
+    results = {}
+    with MockTTSServer(latency_ms=latency_ms, jitter_ms=jitter_ms, error_rate=error_rate, seed=seed) as server:
+        for size in sizes:
+            line_count = CORPUS_SIZES[size]
+            cases = [
+                (f"process_file[{size},w={workers}]", bench_process_file, (server.url, line_count, workers, seed)),
+                (f"combine_wav_files[{size}]", bench_combine_wav_files, (line_count, seed)),
+                (f"split_text_for_lrc[{size}]", bench_split_text_for_lrc, (line_count * 10, seed)),
+                (f"apply_blacklist[{size},{blacklist_words}词]", bench_apply_blacklist, (line_count * 10, blacklist_words, seed)),
+            ]
+            for name, func, args in cases:
+                print(f"正在运行: {name} ...", file=sys.stderr)
+                results[name] = run_in_subprocess(func, *args)
+    return results
+
+
+def print_report(results):
+    separator = "=" * 110
+    print(separator)
+    print(f"{'用例':<40}{'吞吐量':>18}{'p50(ms)':>10}{'p95(ms)':>10}{'峰值内存(MB)':>14}{'写入(MB)':>12}")
+    print(separator)
+    for name, r in results.items():
+        p50 = f"{r['latency_p50_ms']:.1f}" if 'latency_p50_ms' in r else '-'
+        p95 = f"{r['latency_p95_ms']:.1f}" if 'latency_p95_ms' in r else '-'
+        rss = f"{r['peak_rss_mb']:.1f}" if r.get('peak_rss_mb') is not None else '-'
+        written = f"{r['disk_bytes_written'] / 1024 / 1024:.1f}" if 'disk_bytes_written' in r else '-'
+        throughput = f"{r['throughput']:.1f} {r['unit']}"
+        print(f"{name:<40}{throughput:>18}{p50:>10}{p95:>10}{rss:>14}{written:>12}")
+    print(separator)
+
+
+def compare_with_baseline(results, baseline, max_regression):
+    """
+    与基线结果比较吞吐量
+    :return: 退化超过阈值的用例列表 [(用例, 基线吞吐量, 当前吞吐量)]
+    """
+    regressions = []
+    for name, r in results.items():
+        base = baseline.get(name)
+        if not base:
+            continue
+        if r['throughput'] < base['throughput'] * (1 - max_regression):
+            regressions.append((name, base['throughput'], r['throughput']))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="BaiTTS CLI 离线基准测试")
+    parser.add_argument('--sizes', default='small,medium',
+                        help=f"测试语料规模, 逗号分隔 (可选: {', '.join(CORPUS_SIZES)}; 默认 small,medium)")
+    parser.add_argument('--workers', type=int, default=4, help='process_file 用例的并发线程数 (默认 4)')
+    parser.add_argument('--latency', type=float, default=20, help='模拟服务的请求延迟 (毫秒, 默认 20)')
+    parser.add_argument('--jitter', type=float, default=5, help='模拟服务的延迟抖动 (毫秒, 默认 5)')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='模拟服务返回错误的概率 (0-1)')
+    parser.add_argument('--blacklist-words', type=int, default=2000, help='apply_blacklist 用例的黑名单词数 (默认 2000)')
+    parser.add_argument('--seed', type=int, default=0, help='语料与模拟服务的随机数种子 (默认 0)')
+    parser.add_argument('--json', type=str, help='将结果以JSON格式保存到指定文件')
+    parser.add_argument('--baseline', type=str, help='与指定的基线JSON结果比较吞吐量')
+    parser.add_argument('--max-regression', type=float, default=0.2,
+                        help='允许的最大吞吐量退化比例, 超出时以非零状态退出 (默认 0.2)')
+    args = parser.parse_args()
+
+    sizes = [s.strip() for s in args.sizes.split(',') if s.strip()]
+    unknown = [s for s in sizes if s not in CORPUS_SIZES]
+    if unknown:
+        parser.error(f"未知的语料规模: {', '.join(unknown)}")
+
+    results = run_benchmarks(sizes, args.workers, args.latency, args.jitter, args.error_rate,
+                             args.seed, args.blacklist_words)
+    print_report(results)
+
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+        print(f"结果已保存: {args.json}")
+
+    if args.baseline:
+        with open(args.baseline, 'r', encoding='utf-8') as f:
+            baseline = json.load(f)
+        regressions = compare_with_baseline(results, baseline, args.max_regression)
+        if regressions:
+            print("\n检测到性能退化:", file=sys.stderr)
+            for name, base, current in regressions:
+                print(f" - {name}: {base:.1f} -> {current:.1f}", file=sys.stderr)
+            sys.exit(1)
+        print("\n与基线相比未检测到性能退化。")
+
+
+if __name__ == "__main__":
+    main()
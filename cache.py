@@ -0,0 +1,251 @@
+import os
+import re
+import hashlib
+import json
+import threading
+import time
+import unicodedata
+import tempfile
+from collections import OrderedDict
+from metrics import metrics
+
+CACHE_KEY_VERSION = 1
+DEFAULT_DEDUP_MEMORY = 128 * 1024 * 1024   # 去重时在内存中保留的音频总量上限
+STALE_TMP_SECONDS = 3600                   # 超过该时间的临时文件视为中断写入的残留
+
+def parse_size(value):
+    """
+    将 "500M"、"2G"、"1048576" 形式的字符串解析为字节数
+    :param value: 大小字符串
+    :return: 字节数
+    :raises: ValueError 如果格式不正确
+    """
+    match = re.fullmatch(r'\s*(\d+(?:\.\d+)?)\s*([KMGT]?)I?B?\s*', str(value), re.IGNORECASE)
+    if not match:
+        raise ValueError(f"无法解析大小: {value} (示例: 500M, 2G)")
+    number, unit = match.groups()
+    multiplier = 1024 ** " KMGT".index(unit.upper() or " ")
+    return int(float(number) * multiplier)
+
+
+def normalize_text(text):
+    """
+    规范化文本, 使仅有空白或Unicode表示差异的行命中同一缓存
+    """
+    text = unicodedata.normalize('NFC', text)
+    return re.sub(r'\s+', ' ', text).strip()
+
+
+def make_cache_key(api_url, text, voice_params):
+    """
+    根据 (规范化文本, 声音参数, API地址) 计算缓存键
+    """
+    payload = {
+        'v': CACHE_KEY_VERSION,
+        'api': api_url.rstrip('/'),
+        'text': normalize_text(text),
+        'voice': voice_params.get('voice'),
+        'volume': voice_params.get('volume'),
+        'speed': voice_params.get('speed'),
+        'pitch': voice_params.get('pitch'),
+    }
+    raw = json.dumps(payload, ensure_ascii=False, sort_keys=True).encode('utf-8')
+    return hashlib.sha256(raw).hexdigest()
+
+
+class SynthesisCache:
+    """
+    基于内容寻址的磁盘合成缓存, 按总大小进行LRU淘汰
+    - 每条音频保存为 <cache_dir>/<键前两位>/<键>.wav
+    - 以文件修改时间记录最近使用时间, 命中时刷新; 内存索引按最近使用顺序排列, 淘汰时无需排序
+    - 启动时清理中断写入残留的临时文件
+    """
+
+    def __init__(self, cache_dir, max_size=None):
+        self.cache_dir = cache_dir
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        os.makedirs(cache_dir, exist_ok=True)
+        self._entries = self._scan()
+        self._total_size = sum(self._entries.values())
+
+    def _scan(self):
+        found = []
+        stale_before = time.time() - STALE_TMP_SECONDS
+        for root, _, files in os.walk(self.cache_dir):
+            for name in files:
+                path = os.path.join(root, name)
+                try:
+                    st = os.stat(path)
+                    # 写入中途崩溃留下的临时文件; 只删除较旧的, 避免误删其它进程正在写入的文件
+                    if name.endswith('.tmp') and st.st_mtime < stale_before:
+                        os.remove(path)
+                except OSError:
+                    continue
+                if name.endswith('.wav'):
+                    found.append((st.st_mtime, name[:-4], st.st_size))
+        found.sort()
+        return OrderedDict((key, size) for _, key, size in found)
+
+    def _path_for(self, key):
+        return os.path.join(self.cache_dir, key[:2], f"{key}.wav")
+
+    def get(self, key):
+        """
+        读取缓存的音频, 未命中时返回 None
+        """
+        path = self._path_for(key)
+        try:
+            with open(path, 'rb') as f:
+                data = f.read()
+        except OSError:
+            with self._lock:
+                self.misses += 1
+                # 文件可能已被外部删除, 同步内存索引
+                if key in self._entries:
+                    self._total_size -= self._entries.pop(key)
+            return None
+
+        now = time.time()
+        try:
+            os.utime(path, (now, now))
+        except OSError:
+            pass
+        with self._lock:
+            self.hits += 1
+            self._total_size += len(data) - self._entries.get(key, 0)
+            self._entries[key] = len(data)
+            self._entries.move_to_end(key)
+        return data
+
+    def fetch(self, key, produce):
+        """
+        读取缓存的音频, 未命中时调用 produce() 合成并写回缓存
+        """
+        data = self.get(key)
+        if data is not None:
+            metrics.inc('cache_hits')
+            return data
+        metrics.inc('cache_misses')
+        data = produce()
+        self.put(key, data)
+        return data
+
+    def put(self, key, data):
+        """
+        写入音频到缓存 (原子替换), 并在超出容量时淘汰最久未使用的条目
+        """
+        path = self._path_for(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            print(f"警告: 写入合成缓存失败: {e}")
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            return
+
+        with self._lock:
+            self._total_size += len(data) - self._entries.get(key, 0)
+            self._entries[key] = len(data)
+            self._entries.move_to_end(key)
+            self._evict_locked()
+
+    def _evict_locked(self):
+        if self.max_size is None:
+            return
+        while self._total_size > self.max_size and self._entries:
+            key, size = self._entries.popitem(last=False)
+            try:
+                os.remove(self._path_for(key))
+            except OSError:
+                pass
+            self._total_size -= size
+
+    def stats(self):
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'entries': len(self._entries),
+                'size': self._total_size,
+            }
+
+
+class DedupCache:
+    """
+    单次运行内的重复行去重 (同一文件内, 以及同一批量任务的多个文件之间)
+    - 相同 (规范化文本, 声音参数) 的请求只合成一次, 音频保存在内存中, 之后的重复行直接复用同一份数据
+    - 内存中的音频按总字节数做LRU淘汰, 占用不超过 max_bytes
+    - 同一个键正在合成时, 其它线程等待其结果而不是重复请求
+    - 提供 backing (SynthesisCache) 时叠加在磁盘缓存之前, 内存未命中再查询磁盘缓存
+    """
+
+    def __init__(self, backing=None, max_bytes=DEFAULT_DEDUP_MEMORY):
+        self.backing = backing
+        self.max_bytes = max_bytes
+        self.requests = 0
+        self.reused = 0
+        self.bytes_saved = 0
+        self._entries = OrderedDict()
+        self._size = 0
+        self._in_flight = {}
+        self._lock = threading.Lock()
+
+    def fetch(self, key, produce):
+        """
+        获取键对应的音频: 内存命中时直接复用, 否则由第一个请求的线程合成 (或读取磁盘缓存)
+        """
+        with self._lock:
+            self.requests += 1
+        while True:
+            with self._lock:
+                data = self._entries.get(key)
+                if data is not None:
+                    self._entries.move_to_end(key)
+                    self.reused += 1
+                    self.bytes_saved += len(data)
+                    metrics.inc('dedup_reused')
+                    return data
+                event = self._in_flight.get(key)
+                if event is None:
+                    event = self._in_flight[key] = threading.Event()
+                    break
+            # 等待正在合成的线程; 它失败或结果未能保留时再由本线程合成
+            event.wait()
+
+        try:
+            if self.backing is not None:
+                data = self.backing.fetch(key, produce)
+            else:
+                data = produce()
+            self._store(key, data)
+            return data
+        finally:
+            with self._lock:
+                del self._in_flight[key]
+            event.set()
+
+    def _store(self, key, data):
+        if len(data) > self.max_bytes:
+            return
+        with self._lock:
+            self._entries[key] = data
+            self._size += len(data)
+            while self._size > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self._size -= len(evicted)
+
+    def report(self):
+        """
+        输出去重节省的合成请求数与音频数据量
+        """
+        if not self.requests:
+            return
+        print(f"重复行去重: 共 {self.requests} 次合成请求, 其中 {self.reused} 次复用已合成的音频 "
+              f"(节省 {self.reused / self.requests:.1%}, 约 {self.bytes_saved / 1024 / 1024:.1f} MB)")
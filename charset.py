@@ -0,0 +1,215 @@
+import codecs
+import json
+import locale
+import os
+import re
+from concurrent.futures import ProcessPoolExecutor
+
+UTF8 = 'utf-8'
+# 备选编码: 系统默认编码之后是中文场景常用编码 (gb18030 兼容 gbk)
+FALLBACK_ENCODINGS = ['gb18030', 'big5']
+SCAN_BLOCK_SIZE = 1024 * 1024
+SCORE_SAMPLE_CHARS = 64 * 1024      # 每个候选编码只取解码后的前 64K 字符计算可信度
+MIN_AUTO_CONVERT_CONFIDENCE = 0.9   # 自动转换要求的最低可信度
+PARALLEL_SCAN_THRESHOLD = 16        # 文件数少于该值时不启动进程池
+SCAN_CACHE_FILENAME = '.baitts_encoding_cache.json'
+
+_BOMS = [
+    (codecs.BOM_UTF8, 'utf-8-sig'),
+    (codecs.BOM_UTF16_LE, 'utf-16'),
+    (codecs.BOM_UTF16_BE, 'utf-16'),
+]
+# 中文文本中常见的字符: ASCII可见字符与空白、常用标点、CJK统一汉字、全角字符
+_COMMON_CHARS = re.compile('[\t\n\r\x20-\x7e‐-⁯　-〿一-鿿＀-￯]')
+
+
+def _candidate_encodings():
+    candidates = [UTF8]
+    preferred = codecs.lookup(locale.getpreferredencoding(False)).name
+    for encoding in [preferred] + FALLBACK_ENCODINGS:
+        name = codecs.lookup(encoding).name
+        if name not in candidates:
+            candidates.append(name)
+    return candidates
+
+
+def _score(text):
+    if not text:
+        return 1.0
+    return len(_COMMON_CHARS.findall(text)) / len(text)
+
+
+def detect_file_encoding(file_path):
+    """
+    流式读取整个文件, 检测其编码
+    - 有BOM时直接按BOM确定编码
+    - 否则所有候选编码同时增量解码, 解码出错的候选被淘汰, UTF-8 通过完整校验即视为确定
+    - 多个候选都能完整解码时, 按解码结果中常见字符的比例作为可信度, 取可信度最高者
+    :return: (编码名称, 可信度 0-1), 无法用任何候选编码解码时编码为 None
+    """
+    with open(file_path, 'rb') as f:
+        block = f.read(SCAN_BLOCK_SIZE)
+        for bom, encoding in _BOMS:
+            if block.startswith(bom):
+                decoder = codecs.getincrementaldecoder(encoding)()
+                try:
+                    while block:
+                        decoder.decode(block)
+                        block = f.read(SCAN_BLOCK_SIZE)
+                    decoder.decode(b'', final=True)
+                except UnicodeDecodeError:
+                    return None, 0.0
+                return encoding, 1.0
+
+        decoders = {encoding: codecs.getincrementaldecoder(encoding)() for encoding in _candidate_encodings()}
+        samples = {encoding: [] for encoding in decoders}
+        sampled = {encoding: 0 for encoding in decoders}
+        final = False
+        while decoders:
+            for encoding in list(decoders):
+                try:
+                    text = decoders[encoding].decode(block, final=final)
+                except UnicodeDecodeError:
+                    del decoders[encoding]
+                    continue
+                if sampled[encoding] < SCORE_SAMPLE_CHARS and text:
+                    samples[encoding].append(text[:SCORE_SAMPLE_CHARS - sampled[encoding]])
+                    sampled[encoding] += len(samples[encoding][-1])
+            if final:
+                break
+            block = f.read(SCAN_BLOCK_SIZE)
+            final = not block
+
+    if not decoders:
+        return None, 0.0
+    if UTF8 in decoders:
+        return UTF8, 1.0
+    scores = {encoding: _score(''.join(samples[encoding])) for encoding in decoders}
+    best = max(decoders, key=lambda encoding: scores[encoding])
+    return best, scores[best]
+
+
+def validate_utf8_file(file_path):
+    """
+    流式校验整个文件是否为合法的UTF-8编码 (不把文件载入内存)
+    :raises: UnicodeDecodeError 如果文件中存在非UTF-8字节
+    """
+    decoder = codecs.getincrementaldecoder(UTF8)()
+    with open(file_path, 'rb') as f:
+        while True:
+            block = f.read(SCAN_BLOCK_SIZE)
+            decoder.decode(block, final=not block)
+            if not block:
+                return
+
+
+def _detect_entry(file_path):
+    try:
+        encoding, confidence = detect_file_encoding(file_path)
+    except OSError:
+        encoding, confidence = None, 0.0
+    return file_path, encoding, confidence
+
+
+def is_utf8(encoding):
+    return encoding in (UTF8, 'utf-8-sig')
+
+
+class EncodingScanCache:
+    """
+    编码检测结果缓存 (JSON), 以文件的修改时间与大小判断是否需要重新检测
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.entries = {}
+        self._dirty = False
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                self.entries = json.load(f)
+        except (OSError, ValueError):
+            self.entries = {}
+
+    @staticmethod
+    def _signature(file_path):
+        stat = os.stat(file_path)
+        return [stat.st_mtime_ns, stat.st_size]
+
+    def get(self, file_path):
+        entry = self.entries.get(os.path.abspath(file_path))
+        try:
+            if entry and entry[:2] == self._signature(file_path):
+                return entry[2], entry[3]
+        except OSError:
+            pass
+        return None
+
+    def put(self, file_path, encoding, confidence):
+        try:
+            self.entries[os.path.abspath(file_path)] = self._signature(file_path) + [encoding, confidence]
+            self._dirty = True
+        except OSError:
+            pass
+
+    def save(self):
+        if not self._dirty:
+            return
+        temp_path = self.path + '.part'
+        try:
+            with open(temp_path, 'w', encoding='utf-8') as f:
+                json.dump(self.entries, f)
+            os.replace(temp_path, self.path)
+            self._dirty = False
+        except OSError as e:
+            print(f"警告: 保存编码检测缓存失败: {e}")
+
+
+def scan_file_encodings(file_paths, cache=None, max_workers=None):
+    """
+    批量检测文件编码, 文件较多时使用多进程并行检测
+    - 提供 cache (EncodingScanCache) 时, 修改时间与大小未变的文件直接使用缓存结果
+    :return: {文件路径: (编码, 可信度)}
+    """
+    results = {}
+    pending = []
+    for file_path in file_paths:
+        cached = cache.get(file_path) if cache is not None else None
+        if cached is not None:
+            results[file_path] = cached
+        else:
+            pending.append(file_path)
+
+    if len(pending) < PARALLEL_SCAN_THRESHOLD:
+        detected = map(_detect_entry, pending)
+    else:
+        workers = max_workers or os.cpu_count() or 1
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            detected = list(pool.map(_detect_entry, pending, chunksize=max(1, len(pending) // (workers * 4))))
+
+    for file_path, encoding, confidence in detected:
+        results[file_path] = (encoding, confidence)
+        if cache is not None and encoding is not None:
+            cache.put(file_path, encoding, confidence)
+    if cache is not None:
+        cache.save()
+    return results
+
+
+def convert_file_encoding(file_path, encoding):
+    """
+    将文件从指定编码流式转换为UTF-8 (先写入临时文件, 完成后替换原文件)
+    """
+    temp_path = file_path + '.utf8.part'
+    try:
+        with open(file_path, 'r', encoding=encoding, newline='') as src, \
+                open(temp_path, 'w', encoding=UTF8, newline='') as dst:
+            while True:
+                text = src.read(SCAN_BLOCK_SIZE)
+                if not text:
+                    break
+                dst.write(text)
+        os.replace(temp_path, file_path)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
@@ -0,0 +1,204 @@
+import os
+import json
+import hashlib
+
+CHECKPOINT_VERSION = 1
+
+
+def compute_job_fingerprint(api_url, lines, voice_params, lrc_max_len=None, postprocessor=None):
+    """
+    计算任务指纹, 输入文本或参数变化后旧的断点记录将失效
+    - 提供 postprocessor (PcmPostProcessor) 时其处理参数也计入指纹
+    """
+    h = hashlib.sha256()
+    header = {
+        'v': CHECKPOINT_VERSION,
+        'api': api_url,
+        'voice_params': voice_params,
+        'lrc_max_len': lrc_max_len,
+    }
+    if postprocessor is not None:
+        header['postprocess'] = postprocessor.describe()
+    h.update(json.dumps(header, sort_keys=True).encode('utf-8'))
+    for line in lines:
+        h.update(b'\n')
+        h.update(line.encode('utf-8'))
+    return h.hexdigest()
+
+
+class JobCheckpoint:
+    """
+    断点续传记录 (<输出文件>.ckpt, JSON Lines 格式)
+    - 首行记录任务指纹
+    - 之后每完成一行追加一条记录: 行号、该行音频在 .part 文件 data 块中的结束位置、开始时间与时长
+    音频数据本身保存在 WavStreamWriter 的 .part 文件中, 记录只在对应音频写入后才追加,
+    因此续传时把 .part 截断到最后一条记录的位置即可得到一致的状态。
+    记录只保存在文件中, 内存中仅保留已完成行数与数据结束位置, 需要时通过 iter_records() 逐条读取。
+    """
+
+    def __init__(self, output_path, fingerprint):
+        self.path = output_path + '.ckpt'
+        self.fingerprint = fingerprint
+        self.completed_lines = 0
+        self.data_size = 0
+        self._valid_bytes = 0
+        self._file = None
+
+    def load(self):
+        """
+        读取已有的断点记录, 只校验并统计有效记录
+        :return: True 表示记录存在且与当前任务匹配
+        """
+        if not os.path.exists(self.path):
+            return False
+        count = 0
+        data_size = 0
+        try:
+            with open(self.path, 'rb') as f:
+                raw = f.readline()
+                header = json.loads(raw)
+                if header.get('v') != CHECKPOINT_VERSION or header.get('fingerprint') != self.fingerprint:
+                    return False
+                valid_bytes = len(raw)
+                for raw in f:
+                    # 崩溃时可能留下写了一半的最后一行
+                    if not raw.endswith(b'\n'):
+                        break
+                    try:
+                        record = json.loads(raw)
+                    except json.JSONDecodeError:
+                        break
+                    if record.get('i') != count:
+                        break
+                    count += 1
+                    data_size = record['end']
+                    valid_bytes += len(raw)
+        except (OSError, ValueError):
+            return False
+        self.completed_lines = count
+        self.data_size = data_size
+        self._valid_bytes = valid_bytes
+        return True
+
+    def iter_records(self):
+        """
+        按顺序逐条读取 load() 校验过的记录
+        """
+        with open(self.path, 'r', encoding='utf-8') as f:
+            f.readline()
+            for _ in range(self.completed_lines):
+                yield json.loads(f.readline())
+
+    def reset(self):
+        """
+        丢弃已加载的记录, 从头开始
+        """
+        self.completed_lines = 0
+        self.data_size = 0
+        self._valid_bytes = 0
+
+    def start(self):
+        """
+        开始写入断点记录, 已加载的有效记录会被保留 (截掉其后的残缺内容后继续追加)
+        """
+        if self.completed_lines:
+            with open(self.path, 'r+b') as f:
+                f.truncate(self._valid_bytes)
+            self._file = open(self.path, 'a', encoding='utf-8')
+            return
+        self._file = open(self.path, 'w', encoding='utf-8')
+        self._file.write(json.dumps({'v': CHECKPOINT_VERSION, 'fingerprint': self.fingerprint}) + '\n')
+        self._file.flush()
+
+    def record(self, index, data_end, start_ms, duration_ms, silent_spans=None):
+        """
+        记录一行已完成 (调用前需确保对应音频已写入并刷新到 .part 文件)
+        - silent_spans: 该行的静音检测结果, 续传时用于重建LRC时间轴
+        """
+        record = {'i': index, 'end': data_end, 'start': start_ms, 'ms': duration_ms}
+        if silent_spans:
+            record['sil'] = silent_spans
+        self._file.write(json.dumps(record) + '\n')
+        self._file.flush()
+        self.completed_lines += 1
+        self.data_size = data_end
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def remove(self):
+        """
+        任务成功完成后删除断点记录
+        """
+        self.close()
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+
+def hash_line(line):
+    return hashlib.sha256(line.encode('utf-8')).hexdigest()[:16]
+
+
+class LineMap:
+    """
+    增量更新使用的行级映射表 (<输出文件>.map, JSON Lines 格式)
+    - 首行记录任务参数指纹 (不含文本内容), 参数变化后映射表失效
+    - 之后每行对应输出文件中的一行文本: 文本哈希、音频数据字节数、时长与静音检测结果
+    各行音频在 data 块中首尾相接, 偏移量由前面各行的字节数累加得到。
+    """
+
+    def __init__(self, output_path, fingerprint):
+        self.path = output_path + '.map'
+        self.fingerprint = fingerprint
+        self.entries = []
+        self._file = None
+
+    def load(self):
+        """
+        读取映射表
+        :return: True 表示映射表存在且与当前任务参数匹配
+        """
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                header = json.loads(f.readline())
+                if header.get('v') != CHECKPOINT_VERSION or header.get('fingerprint') != self.fingerprint:
+                    return False
+                self.entries = [json.loads(raw) for raw in f]
+        except (OSError, ValueError):
+            return False
+        return True
+
+    @property
+    def data_size(self):
+        return sum(entry['len'] for entry in self.entries)
+
+    def start(self):
+        """
+        开始写出新的映射表 (先写入 <映射表>.part, commit() 后替换旧映射表)
+        """
+        self._file = open(self.path + '.part', 'w', encoding='utf-8')
+        self._file.write(json.dumps({'v': CHECKPOINT_VERSION, 'fingerprint': self.fingerprint}) + '\n')
+
+    def record(self, line, length, duration_ms, silent_spans=None):
+        """
+        按顺序追加一行的映射记录
+        :param length: 该行音频数据的字节数
+        """
+        # 未生成音频的行 (解析失败等) 不记录哈希, 下次更新时重新合成
+        entry = {'h': hash_line(line) if length else None, 'len': length, 'ms': duration_ms}
+        if silent_spans:
+            entry['sil'] = silent_spans
+        self._file.write(json.dumps(entry) + '\n')
+
+    def commit(self):
+        self._file.close()
+        self._file = None
+        os.replace(self.path + '.part', self.path)
+
+    def discard(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+            os.remove(self.path + '.part')
@@ -0,0 +1,412 @@
+import os
+import sys
+import time
+import struct
+import hashlib
+import shutil
+import subprocess
+from array import array
+
+from audio import pcm_samples, WavStreamWriter, WavFormatError
+
+OUTPUT_FORMAT_WAV = 'wav'
+OUTPUT_FORMAT_FLAC = 'flac'
+OUTPUT_FORMAT_MP3 = 'mp3'
+OUTPUT_FORMAT_OPUS = 'opus'
+
+
+class EncodedStreamWriter:
+    """
+    压缩格式流式写入器的基类, 接口与 WavStreamWriter 相同
+    - 每追加一段PCM就立即编码写出, 不需要先生成WAV再二次转换
+    - 写入过程中输出到 <path>.part, 成功关闭后原子重命名为目标文件
+    - 压缩格式无法从中途续写, 出错时总是删除未完成的文件
+    """
+    supports_resume = False
+
+    def __init__(self, output_path, keep_partial=False):
+        self.output_path = output_path
+        self.partial_path = output_path + '.part'
+        self.fmt_body = None
+        self.sample_rate = None
+        self.block_align = None
+        self.channels = None
+        self.bits_per_sample = None
+        self.data_size = 0
+        self.encode_seconds = 0.0
+        self._opened = False
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+        return False
+
+    @property
+    def frame_count(self):
+        return self.data_size // self.block_align if self.block_align else 0
+
+    @property
+    def duration_ms(self):
+        return int(self.frame_count / self.sample_rate * 1000) if self.sample_rate else 0
+
+    def resume(self, data_size):
+        return data_size == 0
+
+    def flush(self):
+        pass
+
+    def append(self, chunk):
+        """
+        追加一个 WavChunk 的PCM数据并编码
+        :return: True 表示已写入, False 表示因格式不一致被跳过
+        """
+        if not self._opened:
+            self.fmt_body = chunk.fmt_body
+            self.sample_rate = chunk.sample_rate
+            self.block_align = chunk.block_align
+            self.channels = chunk.channels
+            self.bits_per_sample = chunk.bits_per_sample
+            self._open(chunk)
+            self._opened = True
+        elif chunk.fmt_body[:16] != self.fmt_body[:16]:
+            return False
+        started = time.perf_counter()
+        self._encode(chunk)
+        self.encode_seconds += time.perf_counter() - started
+        self.data_size += len(chunk.frames)
+        return True
+
+    def close(self):
+        """
+        结束编码并生成最终文件
+        :return: True 表示已生成文件, False 表示没有写入任何音频
+        """
+        if not self._opened:
+            return False
+        started = time.perf_counter()
+        self._finish()
+        self.encode_seconds += time.perf_counter() - started
+        self._opened = False
+        os.replace(self.partial_path, self.output_path)
+        return True
+
+    def abort(self):
+        """
+        放弃写入并删除未完成的文件
+        """
+        if self._opened:
+            self._discard()
+            self._opened = False
+        if os.path.exists(self.partial_path):
+            os.remove(self.partial_path)
+
+    def _open(self, chunk):
+        raise NotImplementedError
+
+    def _encode(self, chunk):
+        raise NotImplementedError
+
+    def _finish(self):
+        raise NotImplementedError
+
+    def _discard(self):
+        raise NotImplementedError
+
+
+# --- FLAC (纯 Python 实现) ---
+
+FLAC_BLOCK_SIZE = 4096
+FLAC_MAX_FIXED_ORDER = 4
+FLAC_MAX_RICE_PARAMETER = 14
+
+
+def _make_crc8_table():
+    table = []
+    for byte in range(256):
+        crc = byte
+        for _ in range(8):
+            crc = ((crc << 1) ^ 0x07) & 0xFF if crc & 0x80 else (crc << 1) & 0xFF
+        table.append(crc)
+    return table
+
+
+def _make_crc16_table():
+    table = []
+    for byte in range(256):
+        crc = byte << 8
+        for _ in range(8):
+            crc = ((crc << 1) ^ 0x8005) & 0xFFFF if crc & 0x8000 else (crc << 1) & 0xFFFF
+        table.append(crc)
+    return table
+
+
+_CRC8_TABLE = _make_crc8_table()
+_CRC16_TABLE = _make_crc16_table()
+
+
+def _crc8(data):
+    crc = 0
+    for byte in data:
+        crc = _CRC8_TABLE[crc ^ byte]
+    return crc
+
+
+def _crc16(data):
+    crc = 0
+    table = _CRC16_TABLE
+    for byte in data:
+        crc = ((crc << 8) & 0xFFFF) ^ table[(crc >> 8) ^ byte]
+    return crc
+
+
+def _utf8_encode_number(value):
+    """
+    FLAC 帧头中的帧序号使用类 UTF-8 的变长编码
+    """
+    if value < 0x80:
+        return bytes([value])
+    length = 2
+    while value >= 1 << (5 * length + 1):
+        length += 1
+    out = []
+    for _ in range(length - 1):
+        out.append(0x80 | (value & 0x3F))
+        value >>= 6
+    first = ((0xFF << (8 - length)) & 0xFF) | value
+    return bytes([first] + out[::-1])
+
+
+def _signed_bits(value, width):
+    return format(value & ((1 << width) - 1), f'0{width}b')
+
+
+def _rice_bits(residuals, parameter):
+    """
+    将残差编码为 Rice 码的比特串 (一元商 + parameter 位余数)
+    """
+    if parameter == 0:
+        return ''.join(['0' * (u) + '1' for u in ((r << 1) if r >= 0 else ((-r << 1) - 1) for r in residuals)])
+    mask = (1 << parameter) - 1
+    width = f'0{parameter}b'
+    return ''.join([
+        '0' * (u >> parameter) + '1' + format(u & mask, width)
+        for u in ((r << 1) if r >= 0 else ((-r << 1) - 1) for r in residuals)
+    ])
+
+
+def _best_rice_parameter(residuals):
+    if not residuals:
+        return 0
+    mean = sum(r if r >= 0 else -r for r in residuals) / len(residuals)
+    parameter = max(0, int(mean).bit_length() - 1)
+    return min(parameter, FLAC_MAX_RICE_PARAMETER)
+
+
+def _encode_subframe(samples, bits_per_sample):
+    """
+    编码一个声道的子帧, 在 CONSTANT 与 FIXED (0-4 阶) 预测中选择残差最小的一种
+    :return: 子帧的比特串
+    """
+    first = samples[0]
+    if all(s == first for s in samples):
+        return '0' + '000000' + '0' + _signed_bits(first, bits_per_sample)
+
+    best_order = 0
+    best_cost = None
+    residuals_by_order = []
+    current = list(samples)
+    for order in range(min(FLAC_MAX_FIXED_ORDER, len(samples) - 1) + 1):
+        if order > 0:
+            # 第 order 阶固定预测的残差等于序列的 order 阶差分
+            current = [b - a for a, b in zip(current, current[1:])]
+        cost = sum(r if r >= 0 else -r for r in current)
+        residuals_by_order.append(current)
+        if best_cost is None or cost < best_cost:
+            best_order, best_cost = order, cost
+
+    residuals = residuals_by_order[best_order]
+    parameter = _best_rice_parameter(residuals)
+    header = '0' + format(0b001000 | best_order, '06b') + '0'
+    warmup = ''.join(_signed_bits(s, bits_per_sample) for s in samples[:best_order])
+    # 残差编码方式 00 (4位 Rice 参数), 分区阶数 0 (整个子帧共用一个参数)
+    residual_header = '00' + '0000' + format(parameter, '04b')
+    return header + warmup + residual_header + _rice_bits(residuals, parameter)
+
+
+class FlacStreamWriter(EncodedStreamWriter):
+    """
+    纯 Python 的流式 FLAC 编码器, 无需外部程序
+    - 固定块大小 4096, 每个声道独立编码, 使用 FIXED 预测与 Rice 编码
+    - 关闭时回填 STREAMINFO 中的总采样数、帧大小范围与 MD5
+    """
+
+    def _open(self, chunk):
+        if self.bits_per_sample not in (8, 16) or self.block_align != self.channels * self.bits_per_sample // 8:
+            raise WavFormatError("FLAC 编码仅支持 8/16 位整数PCM")
+        if self.channels > 8:
+            raise WavFormatError("FLAC 最多支持 8 个声道")
+        self._file = open(self.partial_path, 'wb')
+        self._file.write(b'fLaC' + self._streaminfo_block(0, 0, 0, b'\x00' * 16))
+        self._pending = array(pcm_samples(chunk).typecode)
+        self._md5 = hashlib.md5()
+        self._frame_number = 0
+        self._total_samples = 0
+        self._min_frame_size = None
+        self._max_frame_size = 0
+
+    def _streaminfo_block(self, total_samples, min_frame_size, max_frame_size, md5_digest):
+        info = struct.pack('>HH', FLAC_BLOCK_SIZE, FLAC_BLOCK_SIZE)
+        info += min_frame_size.to_bytes(3, 'big') + max_frame_size.to_bytes(3, 'big')
+        packed = (self.sample_rate << 44) | ((self.channels - 1) << 41) | ((self.bits_per_sample - 1) << 36) | total_samples
+        info += packed.to_bytes(8, 'big') + md5_digest
+        # 元数据块头: 最后一个块标志 + 类型 0 (STREAMINFO) + 长度
+        return bytes([0x80]) + len(info).to_bytes(3, 'big') + info
+
+    def _encode(self, chunk):
+        samples = pcm_samples(chunk)
+        self._pending.extend(samples)
+        block_values = FLAC_BLOCK_SIZE * self.channels
+        if len(self._pending) < block_values:
+            return
+        full = len(self._pending) - len(self._pending) % block_values
+        for start in range(0, full, block_values):
+            self._write_frame(self._pending[start:start + block_values])
+        self._pending = self._pending[full:]
+
+    def _write_frame(self, interleaved):
+        channels = self.channels
+        block_size = len(interleaved) // channels
+        sample_bytes = interleaved.tobytes() if sys.byteorder == 'little' else self._little_endian(interleaved)
+        self._md5.update(sample_bytes)
+
+        if block_size == FLAC_BLOCK_SIZE:
+            block_code, block_suffix = 0b1100, b''
+        else:
+            block_code, block_suffix = 0b0111, struct.pack('>H', block_size - 1)
+        header = bytes([0xFF, 0xF8, (block_code << 4) | 0b0000, ((channels - 1) << 4) | 0b0000])
+        header += _utf8_encode_number(self._frame_number) + block_suffix
+        header += bytes([_crc8(header)])
+
+        bits = ''.join(
+            _encode_subframe(interleaved[ch::channels], self.bits_per_sample) for ch in range(channels)
+        )
+        bits += '0' * (-len(bits) % 8)
+        body = int(bits, 2).to_bytes(len(bits) // 8, 'big')
+        frame = header + body
+        frame += struct.pack('>H', _crc16(frame))
+
+        self._file.write(frame)
+        self._frame_number += 1
+        self._total_samples += block_size
+        self._min_frame_size = len(frame) if self._min_frame_size is None else min(self._min_frame_size, len(frame))
+        self._max_frame_size = max(self._max_frame_size, len(frame))
+
+    @staticmethod
+    def _little_endian(samples):
+        swapped = array(samples.typecode, samples)
+        swapped.byteswap()
+        return swapped.tobytes()
+
+    def _finish(self):
+        if len(self._pending):
+            self._write_frame(self._pending)
+            self._pending = array(self._pending.typecode)
+        self._file.seek(4)
+        self._file.write(self._streaminfo_block(self._total_samples, self._min_frame_size or 0,
+                                                self._max_frame_size, self._md5.digest()))
+        self._file.close()
+
+    def _discard(self):
+        self._file.close()
+
+
+# --- MP3 / Opus (通过 ffmpeg 编码) ---
+
+_FFMPEG_PCM_FORMATS = {8: 'u8', 16: 's16le', 24: 's24le', 32: 's32le'}
+
+
+class FfmpegStreamWriter(EncodedStreamWriter):
+    """
+    通过 ffmpeg 子进程流式编码, PCM数据经标准输入实时送入编码器
+    """
+    codec_args = []
+    container = None
+
+    def _open(self, chunk):
+        pcm_format = _FFMPEG_PCM_FORMATS.get(self.bits_per_sample)
+        if pcm_format is None:
+            raise WavFormatError(f"不支持 {self.bits_per_sample} 位PCM")
+        command = [
+            find_ffmpeg(), '-hide_banner', '-loglevel', 'error', '-y',
+            '-f', pcm_format, '-ar', str(self.sample_rate), '-ac', str(self.channels), '-i', 'pipe:0',
+            *self.codec_args, '-f', self.container, self.partial_path,
+        ]
+        self._process = subprocess.Popen(command, stdin=subprocess.PIPE, stderr=subprocess.PIPE)
+
+    def _encode(self, chunk):
+        self._process.stdin.write(chunk.frames)
+
+    def _finish(self):
+        self._process.stdin.close()
+        stderr = self._process.stderr.read()
+        if self._process.wait() != 0:
+            raise RuntimeError(f"ffmpeg 编码失败: {stderr.decode('utf-8', 'replace').strip()}")
+
+    def _discard(self):
+        try:
+            self._process.stdin.close()
+        except OSError:
+            pass
+        self._process.kill()
+        self._process.wait()
+
+
+class Mp3StreamWriter(FfmpegStreamWriter):
+    codec_args = ['-c:a', 'libmp3lame', '-q:a', '4']
+    container = 'mp3'
+
+
+class OpusStreamWriter(FfmpegStreamWriter):
+    codec_args = ['-c:a', 'libopus', '-b:a', '64k']
+    container = 'ogg'
+
+
+# 格式 -> (写入器类, 文件扩展名, 是否需要 ffmpeg)
+OUTPUT_ENCODERS = {
+    OUTPUT_FORMAT_WAV: (WavStreamWriter, 'wav', False),
+    OUTPUT_FORMAT_FLAC: (FlacStreamWriter, 'flac', False),
+    OUTPUT_FORMAT_MP3: (Mp3StreamWriter, 'mp3', True),
+    OUTPUT_FORMAT_OPUS: (OpusStreamWriter, 'opus', True),
+}
+
+
+def find_ffmpeg():
+    return shutil.which('ffmpeg')
+
+
+def check_output_format(output_format):
+    """
+    检查输出格式是否可用
+    :raises: ValueError 如果格式未知或缺少所需的外部程序
+    """
+    if output_format not in OUTPUT_ENCODERS:
+        raise ValueError(f"不支持的输出格式: {output_format}")
+    if OUTPUT_ENCODERS[output_format][2] and find_ffmpeg() is None:
+        raise ValueError(f"输出 {output_format} 格式需要安装 ffmpeg")
+
+
+def get_output_extension(output_format):
+    return OUTPUT_ENCODERS[output_format][1]
+
+
+def create_stream_writer(output_format, output_path, keep_partial=False):
+    """
+    根据输出格式创建流式写入器
+    """
+    writer_class = OUTPUT_ENCODERS[output_format][0]
+    return writer_class(output_path, keep_partial=keep_partial)
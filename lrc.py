@@ -1,4 +1,12 @@
+import os
 import re
+from utils import PUNCTUATION
+
+LRC_TIMING_WEIGHTED = 'weighted'
+LRC_TIMING_SILENCE = 'silence'
+
+MARKER_PATTERN = re.compile(r'\[\[.*?\]\]')
+PAUSE_PATTERN = re.compile(r'\[\[PAUSE:(\d+)\]\]', re.IGNORECASE)
 
 def format_timestamp(milliseconds):
     """
@@ -10,6 +18,27 @@ def format_timestamp(milliseconds):
     seconds = total_seconds % 60
     return f"[{minutes:02}:{seconds:02}.{ms:02}]"
 
+# LRC文件头部的元数据 (可选)
+LRC_HEADER_LINES = [
+    "[ar:Generated by BaiTTS CLI]",
+    "[al:Audio Transcription]",
+    "[ti:Converted Text]",
+    "",
+]
+
+
+def format_lrc_line(timestamp, text):
+    """
+    生成一行LRC歌词, 去除标记后没有文字时返回 None
+    """
+    # 使用正则表达式移除所有 [[...]] 形式的标记, 使歌词更干净
+    # 这会同时处理黑名单标记和 [[PAUSE:1000]] 这样的指令
+    clean_text = MARKER_PATTERN.sub('', text).strip()
+    if not clean_text:
+        return None
+    return f"{format_timestamp(timestamp)}{clean_text}"
+
+
 def generate_lrc_content(timestamps, texts):
     """
     根据时间戳和文本列表生成完整的LRC文件内容
@@ -20,22 +49,93 @@ def generate_lrc_content(timestamps, texts):
     if len(timestamps) != len(texts):
         raise ValueError("时间戳和文本列表的长度不匹配")
 
-    lrc_lines = []
-    # 添加一些元数据 (可选)
-    lrc_lines.append("[ar:Generated by BaiTTS CLI]")
-    lrc_lines.append("[al:Audio Transcription]")
-    lrc_lines.append("[ti:Converted Text]")
-    lrc_lines.append("")
-
+    lrc_lines = list(LRC_HEADER_LINES)
     for ts, txt in zip(timestamps, texts):
-        # --- 优化点 1 START ---
-        # 使用正则表达式移除所有 [[...]] 形式的标记, 使歌词更干净
-        # 这会同时处理黑名单标记和 [[PAUSE:1000]] 这样的指令
-        clean_text = re.sub(r'\[\[.*?\]\]', '', txt).strip()
-        # --- 优化点 1 END ---
-
-        if clean_text:
-            lrc_line = f"{format_timestamp(ts)}{clean_text}"
+        lrc_line = format_lrc_line(ts, txt)
+        if lrc_line is not None:
             lrc_lines.append(lrc_line)
             
     return "\n".join(lrc_lines)
+
+
+class LrcWriter:
+    """
+    边合成边写出LRC文件, 内容与 generate_lrc_content 的结果相同
+    - 先写入 <路径>.part, close() 时替换为正式文件, abort() 时删除
+    - 已写出的歌词不保留在内存中
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.temp_path = path + '.part'
+        self._file = open(self.temp_path, 'w', encoding='utf-8')
+        self._file.write("\n".join(LRC_HEADER_LINES))
+
+    def add(self, timestamp, text):
+        lrc_line = format_lrc_line(timestamp, text)
+        if lrc_line is not None:
+            self._file.write("\n" + lrc_line)
+
+    def close(self):
+        self._file.close()
+        os.replace(self.temp_path, self.path)
+
+    def abort(self):
+        if not self._file.closed:
+            self._file.close()
+        if os.path.exists(self.temp_path):
+            os.remove(self.temp_path)
+
+
+def count_pronounceable_chars(text):
+    """
+    统计需要朗读的字符数 (不含标点、空白与 [[...]] 标记)
+    """
+    text = MARKER_PATTERN.sub('', text)
+    return sum(1 for ch in text if ch not in PUNCTUATION and not ch.isspace())
+
+
+def compute_chunk_offsets(chunks, duration_ms, silent_spans=None):
+    """
+    计算一行内各LRC短句相对于该行开头的开始时间 (毫秒)
+    - 先扣除 [[PAUSE:n]] 标记对应的固定静音时长, 余下时长按各短句的可朗读字符数加权分配
+    - 提供 silent_spans 时, 将每个估算的分界点吸附到附近的静音区间结束处 (即下一句开口的位置)
+    :param chunks: split_text_for_lrc 返回的短句列表
+    :param duration_ms: 该行音频总时长
+    :param silent_spans: find_silent_spans 返回的静音区间 (可选)
+    """
+    if not chunks:
+        return []
+    pauses = [sum(int(ms) for ms in PAUSE_PATTERN.findall(chunk)) for chunk in chunks]
+    weights = [count_pronounceable_chars(chunk) for chunk in chunks]
+    speech_ms = max(0, duration_ms - sum(pauses))
+    total_weight = sum(weights)
+    if total_weight == 0:
+        weights = [1] * len(chunks)
+        total_weight = len(chunks)
+
+    lengths = [speech_ms * w / total_weight + p for w, p in zip(weights, pauses)]
+    offsets = []
+    position = 0.0
+    for length in lengths:
+        offsets.append(position)
+        position += length
+
+    if silent_spans:
+        offsets = _snap_offsets_to_silence(offsets, lengths, silent_spans)
+    return [int(offset) for offset in offsets]
+
+
+def _snap_offsets_to_silence(offsets, lengths, silent_spans):
+    snapped = [offsets[0]]
+    for k in range(1, len(offsets)):
+        estimate = offsets[k]
+        # 只在相邻两句较短者一半的范围内寻找静音, 避免吸附到其它句子的停顿上
+        tolerance = min(lengths[k - 1], lengths[k]) / 2
+        best = None
+        for start, end in silent_spans:
+            distance = abs((start + end) / 2 - estimate)
+            if distance <= tolerance and end > snapped[-1] and (best is None or distance < best[0]):
+                best = (distance, end)
+        snapped.append(best[1] if best else max(estimate, snapped[-1]))
+    return snapped
@@ -2,7 +2,15 @@
 
 import sys
 from args import parse_and_validate_args
-from process import handle_list_voices, process_file, process_directory
+from api import configure_session, configure_rate_limits, get_connection_stats, get_endpoint_stats, DEFAULT_POOL_CONNECTIONS, DEFAULT_POOL_MAXSIZE
+from balancer import parse_api_urls
+from cache import SynthesisCache
+from metrics import metrics, progress, OUTPUT_MODE_QUIET, OUTPUT_MODE_PROGRESS, METRICS_FORMAT_PROMETHEUS
+from postprocess import create_postprocessor
+from segment import SegmentPolicy
+from process import handle_list_voices, process_file, process_directory, process_stream, NON_UTF8_ASK, NON_UTF8_CONVERT
+from server import JobServer, DEFAULT_MAX_JOBS, DEFAULT_JOB_TTL, DEFAULT_JOB_HISTORY
+from voices import configure_voice_catalog
 
 def main():
     """
@@ -12,11 +20,41 @@ def main():
         print("错误：没有指定操作 (使用 -h 获取帮助)")
         sys.exit(1)
         
+    args = None
     try:
         args = parse_and_validate_args()
+        if args.quiet:
+            progress.mode = OUTPUT_MODE_QUIET
+        elif args.progress:
+            progress.mode = OUTPUT_MODE_PROGRESS
+
+        configure_session(
+            pool_connections=max(DEFAULT_POOL_CONNECTIONS, len(parse_api_urls(args.api))),
+            pool_maxsize=args.pool_maxsize or max(DEFAULT_POOL_MAXSIZE, args.workers),
+            keep_alive=not args.no_keep_alive,
+            post_text=args.post
+        )
+        configure_rate_limits(
+            rate=args.rate_limit,
+            burst=args.rate_burst,
+            max_concurrency=args.workers,
+            max_retries=args.max_retries
+        )
+
+        configure_voice_catalog(ttl=args.voice_cache_ttl)
+
+        segment_policy = None
+        if args.split_chapter or args.split_duration or args.split_size:
+            segment_policy = SegmentPolicy(args.split_chapter, args.split_duration, args.split_size)
+
+        postprocessor = create_postprocessor(args.max_silence, args.normalize, args.sample_rate)
+
+        cache = None
+        if args.cache_dir:
+            cache = SynthesisCache(args.cache_dir, args.cache_max_size)
 
         if args.list:
-            handle_list_voices(args.api)
+            handle_list_voices(args.api, locale=args.locale, gender=args.gender, refresh=args.refresh_voices)
         elif args.file:
             process_file(
                 api_url=args.api,
@@ -29,7 +67,19 @@ def main():
                     'pitch': args.pitch
                 },
                 lrc_max_len=args.sub, # 传递 lrc 字符数或 None
-                blacklist_source=args.blacklist
+                blacklist_source=args.blacklist,
+                workers=args.workers,
+                cache=cache,
+                resume=args.resume,
+                lrc_timing=args.lrc_timing,
+                batch_chars=args.batch_chars,
+                output_format=args.format,
+                segment_policy=segment_policy,
+                incremental=args.incremental,
+                non_utf8_policy=NON_UTF8_CONVERT if args.auto_convert else NON_UTF8_ASK,
+                dedup_memory=args.dedup_memory,
+                max_request_chars=args.max_request_chars,
+                postprocessor=postprocessor
             )
         elif args.dir:
             process_directory(
@@ -43,12 +93,66 @@ def main():
                     'pitch': args.pitch
                 },
                 lrc_max_len=args.sub, # 传递 lrc 字符数或 None
-                blacklist_source=args.blacklist
+                blacklist_source=args.blacklist,
+                workers=args.workers,
+                cache=cache,
+                resume=args.resume,
+                file_workers=args.file_workers,
+                lrc_timing=args.lrc_timing,
+                batch_chars=args.batch_chars,
+                output_format=args.format,
+                segment_policy=segment_policy,
+                incremental=args.incremental,
+                non_utf8_policy=NON_UTF8_CONVERT if args.auto_convert else NON_UTF8_ASK,
+                dedup_memory=args.dedup_memory,
+                max_request_chars=args.max_request_chars,
+                postprocessor=postprocessor
+            )
+        elif args.serve:
+            # 常驻服务不逐行打印日志, 任务进度通过接口查询
+            progress.mode = OUTPUT_MODE_QUIET
+            host, port = args.serve
+            JobServer(args.api, host, port, workers=args.workers, max_jobs=args.max_jobs or DEFAULT_MAX_JOBS,
+                      cache=cache,
+                      job_ttl=DEFAULT_JOB_TTL if args.job_ttl is None else args.job_ttl,
+                      job_history=DEFAULT_JOB_HISTORY if args.job_history is None else args.job_history).serve_forever()
+        elif args.stream:
+            process_stream(
+                api_url=args.api,
+                voice_params={
+                    'voice': args.voice,
+                    'volume': args.volume,
+                    'speed': args.speed,
+                    'pitch': args.pitch
+                },
+                blacklist_source=args.blacklist,
+                workers=args.workers,
+                cache=cache,
+                output_format=args.stream_format,
+                max_request_chars=args.max_request_chars,
+                postprocessor=postprocessor
             )
         # 如果没有匹配到任何分支 (由argparse处理，这里作为保险)
         else:
              print("错误：没有指定操作 (使用 -h 获取帮助)")
 
+        progress.finish()
+        if args.file or args.dir:
+            stats = get_connection_stats()
+            print(f"HTTP连接统计: 新建 {stats['new']} 次, 复用 {stats['reused']} 次")
+            for endpoint in get_endpoint_stats(args.api):
+                latency = f"{endpoint['latency_ms']:.0f} ms" if endpoint['latency_ms'] is not None else "N/A"
+                state = "正常" if endpoint['healthy'] else "已移出"
+                print(f"后端 {endpoint['url']}: 请求 {endpoint['requests']} 次, 失败 {endpoint['failures']} 次, "
+                      f"平均延迟 {latency}, 状态 {state}")
+            if postprocessor is not None and postprocessor.max_silence_ms is not None:
+                trimmed_ms = metrics.snapshot()['counters'].get('silence_trimmed_ms', 0)
+                print(f"静音裁剪: 共去除 {trimmed_ms / 1000:.1f} 秒首尾静音")
+            if cache is not None:
+                cache_stats = cache.stats()
+                print(f"合成缓存统计: 命中 {cache_stats['hits']} 次, 未命中 {cache_stats['misses']} 次, "
+                      f"共 {cache_stats['entries']} 条 ({cache_stats['size'] / 1024 / 1024:.1f} MB)")
+
 
     except (ValueError, FileNotFoundError, ConnectionError) as e:
         print(f"程序执行出错: {e}", file=sys.stderr)
@@ -56,6 +160,24 @@ def main():
     except Exception as e:
         print(f"发生未知错误: {e}", file=sys.stderr)
         sys.exit(1)
+    finally:
+        progress.finish()
+        if args is not None and args.metrics_file:
+            write_metrics(args)
+
+
+def write_metrics(args):
+    """
+    将本次运行的统计写入 --metrics-file 指定的文件
+    """
+    try:
+        if args.metrics_format == METRICS_FORMAT_PROMETHEUS:
+            metrics.write_prometheus(args.metrics_file)
+        else:
+            mode = 'list' if args.list else 'file' if args.file else 'dir' if args.dir else 'serve' if args.serve else 'stream'
+            metrics.write_jsonl(args.metrics_file, {'mode': mode, 'workers': args.workers})
+    except OSError as e:
+        print(f"警告: 写入统计文件失败: {e}", file=sys.stderr)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,221 @@
+import os
+import sys
+import json
+import time
+import threading
+from bisect import bisect_left
+from contextlib import contextmanager
+
+OUTPUT_MODE_NORMAL = 'normal'
+OUTPUT_MODE_QUIET = 'quiet'
+OUTPUT_MODE_PROGRESS = 'progress'
+
+METRICS_FORMAT_JSONL = 'jsonl'
+METRICS_FORMAT_PROMETHEUS = 'prometheus'
+
+METRIC_PREFIX = 'baitts'
+# 请求延迟直方图的分桶上界 (秒)
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+PROGRESS_INTERVAL = 0.2   # 进度条最短刷新间隔 (秒)
+PROGRESS_BAR_WIDTH = 30
+
+
+class Histogram:
+    __slots__ = ('buckets', 'counts', 'sum', 'count')
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+class Metrics:
+    """
+    全流程的计数与计时记录 (线程安全)
+    - 计数器: 请求数、重试次数、收发字节数、缓存命中等
+    - 阶段耗时: 各处理阶段的累计耗时与调用次数, 并发执行的阶段按各线程耗时累加
+    - 直方图: HTTP请求延迟分布
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.started = time.time()
+            self.counters = {}
+            self.stages = {}
+            self.histograms = {}
+
+    def inc(self, name, value=1):
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def observe(self, name, value, buckets=LATENCY_BUCKETS):
+        with self._lock:
+            histogram = self.histograms.get(name)
+            if histogram is None:
+                histogram = self.histograms[name] = Histogram(buckets)
+            histogram.observe(value)
+
+    def add_stage_time(self, stage, seconds):
+        with self._lock:
+            total, calls = self.stages.get(stage, (0.0, 0))
+            self.stages[stage] = (total + seconds, calls + 1)
+
+    @contextmanager
+    def timed(self, stage):
+        """
+        记录代码块的耗时, 计入指定阶段
+        """
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_stage_time(stage, time.perf_counter() - started)
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                'timestamp': time.time(),
+                'elapsed_seconds': time.time() - self.started,
+                'counters': dict(self.counters),
+                'stages': {stage: {'seconds': total, 'calls': calls} for stage, (total, calls) in self.stages.items()},
+                'histograms': {
+                    name: {
+                        'buckets': list(h.buckets),
+                        'counts': list(h.counts),
+                        'sum': h.sum,
+                        'count': h.count,
+                    }
+                    for name, h in self.histograms.items()
+                },
+            }
+
+    def write_jsonl(self, path, extra=None):
+        """
+        以 JSON Lines 格式追加一条本次运行的统计记录
+        """
+        record = self.snapshot()
+        if extra:
+            record.update(extra)
+        with open(path, 'a', encoding='utf-8') as f:
+            f.write(json.dumps(record, ensure_ascii=False) + '\n')
+
+    def format_prometheus(self):
+        """
+        以 Prometheus 文本格式输出当前统计
+        """
+        snapshot = self.snapshot()
+        lines = []
+        for name, value in sorted(snapshot['counters'].items()):
+            metric = f"{METRIC_PREFIX}_{name}_total"
+            lines += [f"# TYPE {metric} counter", f"{metric} {value}"]
+        if snapshot['stages']:
+            lines.append(f"# TYPE {METRIC_PREFIX}_stage_seconds_total counter")
+            for stage, data in sorted(snapshot['stages'].items()):
+                lines.append(f'{METRIC_PREFIX}_stage_seconds_total{{stage="{stage}"}} {data["seconds"]:.6f}')
+            lines.append(f"# TYPE {METRIC_PREFIX}_stage_calls_total counter")
+            for stage, data in sorted(snapshot['stages'].items()):
+                lines.append(f'{METRIC_PREFIX}_stage_calls_total{{stage="{stage}"}} {data["calls"]}')
+        for name, data in sorted(snapshot['histograms'].items()):
+            metric = f"{METRIC_PREFIX}_{name}"
+            lines.append(f"# TYPE {metric} histogram")
+            cumulative = 0
+            for bound, count in zip(list(data['buckets']) + ['+Inf'], data['counts']):
+                cumulative += count
+                lines.append(f'{metric}_bucket{{le="{bound}"}} {cumulative}')
+            lines += [f"{metric}_sum {data['sum']:.6f}", f"{metric}_count {data['count']}"]
+        lines.append(f"{METRIC_PREFIX}_run_elapsed_seconds {snapshot['elapsed_seconds']:.3f}")
+        return '\n'.join(lines) + '\n'
+
+    def write_prometheus(self, path):
+        """
+        以 Prometheus textfile 格式写出统计 (原子替换, 供 node_exporter 采集)
+        """
+        temp_path = path + '.part'
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            f.write(self.format_prometheus())
+        os.replace(temp_path, path)
+
+
+class ProgressReporter:
+    """
+    输出模式与进度显示
+    - normal: 保持逐行打印合成日志
+    - quiet: 不打印逐行日志
+    - progress: 不打印逐行日志, 在标准错误上显示限频刷新的进度条
+    通过 bind() 可将当前线程的进度同时计入另一个 ProgressReporter (常驻服务中每个任务各有一个)。
+    """
+
+    def __init__(self):
+        self.mode = OUTPUT_MODE_NORMAL
+        self.total = 0
+        self.done = 0
+        self._started = None
+        self._last_draw = 0.0
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    @property
+    def line_logging(self):
+        return self.mode == OUTPUT_MODE_NORMAL
+
+    def bind(self, tracker):
+        self._local.tracker = tracker
+
+    def add_total(self, count):
+        with self._lock:
+            if self._started is None:
+                self._started = time.monotonic()
+            self.total += count
+        tracker = getattr(self._local, 'tracker', None)
+        if tracker is not None:
+            tracker.add_total(count)
+        self._draw()
+
+    def advance(self, count=1):
+        with self._lock:
+            self.done += count
+        tracker = getattr(self._local, 'tracker', None)
+        if tracker is not None:
+            tracker.advance(count)
+        self._draw()
+
+    def _draw(self, force=False):
+        if self.mode != OUTPUT_MODE_PROGRESS:
+            return
+        with self._lock:
+            now = time.monotonic()
+            if not force and now - self._last_draw < PROGRESS_INTERVAL:
+                return
+            self._last_draw = now
+            total = max(self.total, 1)
+            ratio = min(1.0, self.done / total)
+            filled = int(ratio * PROGRESS_BAR_WIDTH)
+            elapsed = now - (self._started or now)
+            rate = self.done / elapsed if elapsed > 0 else 0.0
+            remaining = (self.total - self.done) / rate if rate > 0 else 0
+            bar = '#' * filled + '.' * (PROGRESS_BAR_WIDTH - filled)
+            text = (f"\r[{bar}] {self.done}/{self.total} 行 {ratio * 100:5.1f}% "
+                    f"{rate:6.1f} 行/秒 剩余 {int(remaining // 60)}:{int(remaining % 60):02d}")
+        sys.stderr.write(text)
+        sys.stderr.flush()
+
+    def finish(self):
+        if self.mode == OUTPUT_MODE_PROGRESS and self.total:
+            self._draw(force=True)
+            sys.stderr.write('\n')
+            sys.stderr.flush()
+            self.total = self.done = 0
+
+
+metrics = Metrics()
+progress = ProgressReporter()
@@ -0,0 +1,180 @@
+#!/usr/bin/env python3
+"""
+本地模拟 TTS 服务, 提供与 MultiTTS API 相同的 /voices 与 /forward 接口 (/forward 同时支持GET与POST),
+返回合成的WAV音频, 可配置延迟、抖动与错误率, 用于离线基准测试。
+"""
+
+import argparse
+import json
+import random
+import struct
+import threading
+import time
+from array import array
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qs
+
+from audio import build_wav_header
+
+SAMPLE_RATE = 16000
+MS_PER_CHAR = 50    # 每个字符对应的音频时长
+TONE_MS = 100       # 模拟音频由交替的 100ms 音调与 100ms 静音组成
+
+MOCK_VOICES = {
+    "success": True,
+    "data": {
+        "catalog": {
+            "mock": [
+                {"id": "mock-female", "name": "Mock Female", "gender": "Female", "locale": "zh-CN", "type": "mock"},
+                {"id": "mock-male", "name": "Mock Male", "gender": "Male", "locale": "zh-CN", "type": "mock"},
+                {"id": "mock-en", "name": "Mock English", "gender": "Female", "locale": "en-US", "type": "mock"},
+            ]
+        }
+    }
+}
+
+
+def _build_pattern():
+    tone_frames = SAMPLE_RATE * TONE_MS // 1000
+    tone = array('h', ((i * 37) % 2000 - 1000 for i in range(tone_frames)))
+    silence = array('h', [0]) * tone_frames
+    return (tone + silence).tobytes()
+
+
+_PATTERN = _build_pattern()
+_FMT_BODY = struct.pack('<HHIIHH', 1, 1, SAMPLE_RATE, SAMPLE_RATE * 2, 2, 16)
+
+
+def synthesize_wav(text):
+    """
+    生成与文本长度成正比的模拟WAV音频
+    """
+    data_size = max(1, len(text)) * SAMPLE_RATE * MS_PER_CHAR // 1000 * 2
+    repeats, remainder = divmod(data_size, len(_PATTERN))
+    return build_wav_header(_FMT_BODY, data_size) + _PATTERN * repeats + _PATTERN[:remainder]
+
+
+class MockTTSServer:
+    """
+    在后台线程中运行的模拟 TTS 服务
+    - latency_ms / jitter_ms: 每次 /forward 请求的基础延迟与随机抖动
+    - error_rate: 以该概率返回 HTTP 500
+    """
+
+    def __init__(self, host='127.0.0.1', port=0, latency_ms=0, jitter_ms=0, error_rate=0.0, seed=None):
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.error_rate = error_rate
+        self.request_count = 0
+        self.error_count = 0
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._httpd = ThreadingHTTPServer((host, port), self._make_handler())
+        self._httpd.daemon_threads = True
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self._httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def _next_delay_and_error(self):
+        with self._lock:
+            self.request_count += 1
+            delay = self.latency_ms + self._random.uniform(-self.jitter_ms, self.jitter_ms)
+            failed = self._random.random() < self.error_rate
+            if failed:
+                self.error_count += 1
+        return max(0.0, delay) / 1000, failed
+
+    def _make_handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def log_message(self, format, *args):
+                pass
+
+            def _send(self, status, body=b'', content_type='application/octet-stream'):
+                self.send_response(status)
+                self.send_header('Content-Type', content_type)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def _forward(self, params):
+                delay, failed = server._next_delay_and_error()
+                if delay:
+                    time.sleep(delay)
+                if failed:
+                    self._send(500, b'mock error', 'text/plain')
+                    return
+                self._send(200, synthesize_wav(params.get('text', [''])[0]), 'audio/wav')
+
+            def do_GET(self):
+                parsed = urlparse(self.path)
+                if parsed.path == '/voices':
+                    self._send(200, json.dumps(MOCK_VOICES).encode('utf-8'), 'application/json')
+                elif parsed.path == '/forward':
+                    self._forward(parse_qs(parsed.query))
+                else:
+                    self._send(404)
+
+            def do_POST(self):
+                # 与 --post 选项对应: 参数以表单编码放在请求体中
+                parsed = urlparse(self.path)
+                body = self.rfile.read(int(self.headers.get('Content-Length') or 0))
+                if parsed.path == '/forward':
+                    self._forward(parse_qs(body.decode('utf-8')))
+                else:
+                    self._send(404)
+
+        return Handler
+
+    def serve_forever(self):
+        """
+        在当前线程中运行服务 (阻塞)
+        """
+        try:
+            self._httpd.serve_forever()
+        finally:
+            self._httpd.server_close()
+
+    def start(self):
+        self._thread = threading.Thread(target=self._httpd.serve_forever, name="mock_tts", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._httpd.shutdown()
+        self._httpd.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc, tb):
+        self.stop()
+        return False
+
+
+def main():
+    parser = argparse.ArgumentParser(description="本地模拟 TTS 服务")
+    parser.add_argument('--host', default='127.0.0.1', help='监听地址 (默认 127.0.0.1)')
+    parser.add_argument('--port', type=int, default=8774, help='监听端口 (默认 8774)')
+    parser.add_argument('--latency', type=float, default=0, help='每次合成请求的基础延迟 (毫秒)')
+    parser.add_argument('--jitter', type=float, default=0, help='延迟的随机抖动范围 (毫秒)')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='返回 HTTP 500 的概率 (0-1)')
+    parser.add_argument('--seed', type=int, default=None, help='随机数种子')
+    args = parser.parse_args()
+
+    server = MockTTSServer(args.host, args.port, args.latency, args.jitter, args.error_rate, args.seed)
+    print(f"模拟 TTS 服务已启动: {server.url} (按 Ctrl+C 退出)")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
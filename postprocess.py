@@ -0,0 +1,252 @@
+import re
+import struct
+import sys
+from array import array
+from math import gcd
+from operator import add, mul
+from audio import WavChunk, pcm_samples, SILENCE_THRESHOLD_RATIO, SILENCE_WINDOW_MS
+from lrc import PAUSE_PATTERN
+from metrics import metrics
+
+try:
+    import numpy
+except ImportError:  # 未安装 numpy 时使用 array 实现
+    numpy = None
+
+MAX_NORMALIZE_GAIN_DB = 20.0    # 响度归一化的最大增益, 避免把近乎静音的行放大成噪声
+MIN_GAIN_CHANGE = 0.01          # 增益与 1 的差距小于该值时不修改采样
+_SUPPORTED_FORMAT_TAGS = (1, 0xFFFE)   # PCM / WAVE_FORMAT_EXTENSIBLE
+_SUPPORTED_SAMPLE_WIDTHS = (2, 4)
+
+_LEADING_MARKERS = re.compile(r'^(?:\s*\[\[[^\]]*\]\])*')
+_TRAILING_MARKERS = re.compile(r'(?:\[\[[^\]]*\]\]\s*)*$')
+
+
+def _pause_ms(text):
+    return sum(int(ms) for ms in PAUSE_PATTERN.findall(text))
+
+
+def edge_pauses(line):
+    """
+    计算行首与行尾 [[PAUSE:n]] 标记要求的停顿时长
+    :return: (行首停顿毫秒, 行尾停顿毫秒)
+    """
+    return _pause_ms(_LEADING_MARKERS.match(line).group(0)), _pause_ms(_TRAILING_MARKERS.search(line).group(0))
+
+
+def _window_peaks(samples, window):
+    """
+    按固定窗口计算峰值 (绝对值的最大值)
+    :return: [峰值, ...], 每个窗口一项
+    """
+    if numpy is not None:
+        values = numpy.frombuffer(samples, dtype=samples.typecode)
+        full = len(values) // window * window
+        blocks = [values[:full].reshape(-1, window)] if full else []
+        if full < len(values):
+            blocks.append(values[full:].reshape(1, -1))
+        return [peak for block in blocks for peak in
+                numpy.maximum(block.max(axis=1).astype(numpy.int64), -block.min(axis=1).astype(numpy.int64)).tolist()]
+    peaks = []
+    for start in range(0, len(samples), window):
+        segment = samples[start:start + window]
+        peaks.append(max(max(segment), -min(segment)))
+    return peaks
+
+
+def _voiced_energy(samples, voiced_windows, window, offset):
+    """
+    统计有声窗口内采样的平方和与采样数
+    :param voiced_windows: 每个窗口是否有声
+    :param offset: samples[0] 在原始音频中的位置 (截掉行首静音后不为 0)
+    :return: (平方和, 采样数)
+    """
+    if numpy is not None:
+        values = numpy.frombuffer(samples, dtype=samples.typecode)
+        mask = numpy.array(voiced_windows)[(numpy.arange(len(values)) + offset) // window]
+        # 16位采样的平方和用整数累加保持精确, 32位改用浮点避免溢出
+        exact = samples.itemsize <= 2
+        voiced = values[mask].astype(numpy.int64 if exact else numpy.float64)
+        energy = numpy.dot(voiced, voiced)
+        return (int(energy) if exact else float(energy)), len(voiced)
+    energy = 0
+    count = 0
+    for index, is_voiced in enumerate(voiced_windows):
+        if is_voiced:
+            segment = samples[max(index * window - offset, 0):max((index + 1) * window - offset, 0)]
+            energy += sum(map(mul, segment, segment))
+            count += len(segment)
+    return energy, count
+
+
+def _scale_samples(samples, gain, peak):
+    """
+    将采样乘以增益并四舍五入 (gain 已受峰值限制, 结果不会溢出)
+    - 安装了 numpy 时整段向量化计算
+    - 否则在取值范围不超过采样数时查表, 每个采样只做一次C层的下标访问; 范围过大 (响亮的32位音频) 时逐个相乘
+    :return: array, 与输入的类型相同
+    """
+    typecode = samples.typecode
+    if numpy is not None:
+        scaled = numpy.rint(numpy.frombuffer(samples, dtype=typecode) * gain)
+        return array(typecode, scaled.astype(typecode).tobytes())
+    if 2 * peak + 1 <= len(samples):
+        # 负的采样值作为下标时从表尾取值, 表的后半段正好存放 -peak..-1 的结果
+        table = [round(gain * value) for value in range(peak + 1)] + [round(gain * value) for value in range(-peak, 0)]
+        return array(typecode, map(table.__getitem__, samples))
+    return array(typecode, map(round, map(gain.__mul__, samples)))
+
+
+def _resample_numpy(samples, channels, up, down, frames_out):
+    typecode = samples.typecode
+    source = numpy.frombuffer(samples, dtype=typecode)[:len(samples) // channels * channels].reshape(-1, channels)
+    source = numpy.concatenate((source, source[-1:]))
+    positions = numpy.arange(frames_out, dtype=numpy.int64) * down
+    start = positions // up
+    weight = ((positions % up) / up)[:, None]
+    resampled = numpy.rint((1 - weight) * source[start] + weight * source[start + 1])
+    return array(typecode, resampled.astype(typecode).tobytes())
+
+
+def resample_samples(samples, channels, src_rate, dst_rate):
+    """
+    以线性插值重采样 (多声道交错排列)
+    安装了 numpy 时整段向量化计算; 否则将输出采样按 上采样倍数 分为若干相位, 同一相位的采样在源数据中等间隔分布
+    且插值系数相同, 因此每个相位只需对源数据做两次步进切片, 插值运算在 map 中完成, Python层只按相位循环。
+    两种实现的结果相同。降采样时不做抗混叠滤波。
+    :return: array, 与输入的类型相同
+    """
+    divisor = gcd(src_rate, dst_rate)
+    up, down = dst_rate // divisor, src_rate // divisor
+    frames_in = len(samples) // channels
+    frames_out = frames_in * up // down
+    typecode = samples.typecode
+    if not frames_out:
+        return array(typecode)
+    if numpy is not None:
+        return _resample_numpy(samples, channels, up, down, frames_out)
+    output = array(typecode, [0]) * (frames_out * channels)
+    for channel in range(channels):
+        source = samples[channel::channels]
+        source.append(source[-1])
+        resampled = array(typecode, [0]) * frames_out
+        for phase in range(min(up, frames_out)):
+            count = len(range(phase, frames_out, up))
+            start, remainder = divmod(phase * down, up)
+            left = source[start:start + count * down:down]
+            if remainder == 0:
+                resampled[phase::up] = left
+                continue
+            weight = remainder / up
+            right = source[start + 1:start + 1 + count * down:down]
+            resampled[phase::up] = array(typecode, map(round, map(add, map((1 - weight).__mul__, left),
+                                                                  map(weight.__mul__, right))))
+        output[channel::channels] = resampled
+    return output
+
+
+class PcmPostProcessor:
+    """
+    逐行的PCM后处理, 在每行音频写入输出文件之前执行, 不需要再次读取整个输出文件
+    - max_silence_ms: 每行首尾的静音分别截短到不超过该时长 (0 表示完全去除);
+      行首、行尾的 [[PAUSE:n]] 标记对应的停顿至少保留 n 毫秒
+    - target_db: 将每行有声部分的RMS电平调整到该值 (dBFS), 增益受峰值限制, 不会削波
+    - sample_rate: 重采样到该采样率 (线性插值)
+    只支持16位与32位整数PCM, 其它格式原样输出。安装了 numpy 时整段向量化计算, 否则使用 array 实现, 两者结果相同
+    (32位音频的响度估计用浮点累加, 增益可能有极小的舍入差异)。
+    LRC时间轴、断点记录与映射表都按处理后的音频计算, 与输出文件一致。
+    """
+
+    def __init__(self, max_silence_ms=None, target_db=None, sample_rate=None):
+        self.max_silence_ms = max_silence_ms
+        self.target_db = target_db
+        self.sample_rate = sample_rate
+        self._warned = False
+
+    def describe(self):
+        """
+        处理参数 (计入断点记录与映射表的任务指纹, 参数变化后旧的中间结果失效)
+        """
+        return {'max_silence_ms': self.max_silence_ms, 'target_db': self.target_db, 'sample_rate': self.sample_rate}
+
+    def _supported(self, chunk):
+        format_tag, = struct.unpack_from('<H', chunk.fmt_body)
+        sample_width = chunk.block_align // max(chunk.channels, 1)
+        if format_tag in _SUPPORTED_FORMAT_TAGS and sample_width in _SUPPORTED_SAMPLE_WIDTHS:
+            return True
+        if not self._warned:
+            self._warned = True
+            print(f"警告: 音频格式不支持后处理 (格式 {format_tag}, {sample_width * 8} 位), 将原样输出。")
+        return False
+
+    def process(self, chunk, line=''):
+        """
+        处理一行音频
+        :param chunk: WavChunk
+        :param line: 该行文本, 用于识别行首行尾的停顿标记
+        :return: 处理后的 WavChunk (无需修改时返回原对象)
+        """
+        if not chunk.frame_count or not self._supported(chunk):
+            return chunk
+        with metrics.timed('postprocess'):
+            return self._process(chunk, line)
+
+    def _process(self, chunk, line):
+        samples = pcm_samples(chunk)
+        channels = chunk.channels
+        window = max(1, chunk.sample_rate * SILENCE_WINDOW_MS // 1000) * channels
+        peaks = _window_peaks(samples, window)
+        peak = max(peaks)
+        threshold = peak * SILENCE_THRESHOLD_RATIO
+        changed = False
+
+        start, end = 0, len(samples)
+        if self.max_silence_ms is not None and threshold > 0:
+            voiced = [index for index, value in enumerate(peaks) if value >= threshold]
+            lead_pause, trail_pause = edge_pauses(line)
+            ms_to_samples = chunk.sample_rate * channels / 1000
+            keep_lead = int(max(self.max_silence_ms, lead_pause) * ms_to_samples) // channels * channels
+            keep_trail = int(max(self.max_silence_ms, trail_pause) * ms_to_samples) // channels * channels
+            start = max(0, voiced[0] * window - keep_lead)
+            end = min(len(samples), (voiced[-1] + 1) * window + keep_trail)
+            if start or end < len(samples):
+                trimmed = len(samples) - (end - start)
+                metrics.inc('silence_trimmed_ms', trimmed * 1000 // (chunk.sample_rate * channels))
+                samples = samples[start:end]
+                changed = True
+
+        if self.target_db is not None and threshold > 0:
+            # 只统计有声窗口的能量, 行内的停顿不会拉低电平估计
+            energy, count = _voiced_energy(samples, [value >= threshold for value in peaks], window, start)
+            full_scale = (1 << (8 * (chunk.block_align // channels) - 1)) - 1
+            if energy and count:
+                rms = (energy / count) ** 0.5
+                gain = min(full_scale * 10 ** (self.target_db / 20) / rms,
+                           full_scale / peak,
+                           10 ** (MAX_NORMALIZE_GAIN_DB / 20))
+                if abs(gain - 1) >= MIN_GAIN_CHANGE:
+                    samples = _scale_samples(samples, gain, peak)
+                    changed = True
+
+        fmt_body = chunk.fmt_body
+        if self.sample_rate and self.sample_rate != chunk.sample_rate:
+            samples = resample_samples(samples, channels, chunk.sample_rate, self.sample_rate)
+            fmt_body = bytearray(fmt_body)
+            struct.pack_into('<II', fmt_body, 4, self.sample_rate, self.sample_rate * chunk.block_align)
+            fmt_body = bytes(fmt_body)
+            changed = True
+
+        if not changed:
+            return chunk
+        if sys.byteorder == 'big':
+            samples.byteswap()
+        return WavChunk(fmt_body, memoryview(samples.tobytes()))
+
+
+def create_postprocessor(max_silence_ms=None, target_db=None, sample_rate=None):
+    """
+    根据命令行/任务参数创建后处理器, 未启用任何处理时返回 None
+    """
+    if max_silence_ms is None and target_db is None and sample_rate is None:
+        return None
+    return PcmPostProcessor(max_silence_ms, target_db, sample_rate)
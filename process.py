@@ -1,164 +1,466 @@
 import os
+import io
 import glob
 import sys
-from api import get_voices, text_to_speech
-from tts import convert_text_to_audio_file
-from utils import load_blacklist_patterns, apply_blacklist, convert_file_to_utf8
+import contextlib
+import time
+from concurrent.futures import ThreadPoolExecutor
+from api import text_to_speech
+from audio import parse_wav, build_wav_header, WavFormatError, STREAMING_DATA_SIZE
+from encoders import OUTPUT_FORMAT_WAV, get_output_extension
+from lrc import LRC_TIMING_WEIGHTED
+from metrics import metrics
+from charset import EncodingScanCache, MIN_AUTO_CONVERT_CONFIDENCE, SCAN_CACHE_FILENAME, UTF8, detect_file_encoding, is_utf8, scan_file_encodings, validate_utf8_file
+from cache import DedupCache, DEFAULT_DEDUP_MEMORY
+from checkpoint import LineMap, compute_job_fingerprint
+from tts import DEFAULT_MAX_REQUEST_CHARS, convert_text_to_audio_file, convert_text_to_segmented_files, update_audio_file_incrementally, synthesize_lines_in_order
+from utils import BlacklistMatcher, load_blacklist_patterns, apply_blacklist, convert_file_to_utf8
+from voices import load_voice_catalog, validate_voice
 
-def handle_list_voices(api_url):
+END_PAUSE_MS = 1000
+END_PAUSE_MARKER = f"[[PAUSE:{END_PAUSE_MS}]]"
+
+FILE_STATUS_OK = 'ok'
+FILE_STATUS_SKIPPED = 'skipped'
+FILE_STATUS_FAILED = 'failed'
+
+# 遇到非UTF-8编码文件时的处理策略: 询问用户 / 自动转换 / 直接报错 (无人值守时不能等待输入)
+NON_UTF8_ASK = 'ask'
+NON_UTF8_CONVERT = 'convert'
+NON_UTF8_FAIL = 'fail'
+
+STREAM_FORMAT_WAV = 'wav'
+STREAM_FORMAT_PCM = 'pcm'
+
+def handle_list_voices(api_url, locale=None, gender=None, refresh=False):
     """
-    处理 --list 分支, 获取并格式化显示声音列表
+    处理 --list 分支, 获取 (优先使用本地缓存) 并格式化显示声音列表
+    - 提供 locale / gender 时只显示符合条件的声音
     """
-    try:
-        data = get_voices(api_url)
-        if not data.get("success") or 'data' not in data or 'catalog' not in data['data']:
-            raise ValueError("API返回的声音列表格式不正确")
-
-        all_voices = []
-        for key in data['data']['catalog']:
-            all_voices.extend(data['data']['catalog'][key])
-        
-        if not all_voices:
+    catalog = load_voice_catalog(api_url, refresh=refresh)
+    all_voices = catalog.query(locale=locale, gender=gender)
+    if not all_voices:
+        if len(catalog):
+            print(f"没有符合条件的声音 (共 {len(catalog)} 个可用声音)。")
+        else:
             print("未找到可用的声音。")
-            return
-
-        print("\n可用的声音列表：")
-        separator = "=" * 50
-        for voice in all_voices:
-            print(separator)
-            print(f"ID: {voice.get('id', 'N/A')},")
-            print(f"名称: {voice.get('name', 'N/A')},")
-            print(f"性别: {voice.get('gender', 'N/A')},")
-            print(f"语言: {voice.get('locale', 'N/A')},")
-            print(f"类型: {voice.get('type', 'N/A')}")
+        return
+
+    print(f"\n可用的声音列表 ({len(all_voices)}/{len(catalog)})：")
+    separator = "=" * 50
+    for voice in all_voices:
         print(separator)
+        print(f"ID: {voice.get('id', 'N/A')},")
+        print(f"名称: {voice.get('name', 'N/A')},")
+        print(f"性别: {voice.get('gender', 'N/A')},")
+        print(f"语言: {voice.get('locale', 'N/A')},")
+        print(f"类型: {voice.get('type', 'N/A')}")
+    print(separator)
+
+
+def confirm_utf8_conversion(prompt, policy):
+    """
+    根据策略决定是否将非UTF-8文件转换为UTF-8, 策略为 'ask' 时询问用户
+    """
+    if policy == NON_UTF8_ASK:
+        return input(prompt).lower() in ['y', 'yes']
+    return policy == NON_UTF8_CONVERT
+
+
+def preprocess_lines(lines, blacklist_matcher):
+    """
+    逐行预处理文本: 去除首尾空白、忽略空行并应用黑名单
+    """
+    for line in lines:
+        stripped_line = line.strip()
+        if stripped_line: # 忽略空行
+            with metrics.timed('blacklist'):
+                stripped_line = apply_blacklist(stripped_line, blacklist_matcher)
+            yield stripped_line
+
+
+def append_end_pause(lines):
+    """
+    为最后一行添加静音标记 (只预读一行)
+    """
+    previous = None
+    for line in lines:
+        if previous is not None:
+            yield previous
+        previous = line
+    if previous is not None:
+        yield previous + END_PAUSE_MARKER
+
+
+class TextFileLines:
+    """
+    可重复迭代的预处理文本行: 每次迭代都重新打开文件, 逐行读取 -> 去除空白与空行 -> 黑名单 -> 末行静音标记,
+    整个过程是生成器流水线, 内存占用与文件大小无关
+    - len() 返回预处理后的行数, 尚未完整迭代过时会先读取一遍文件
+    """
+
+    def __init__(self, file_path, blacklist_matcher=None):
+        self.file_path = file_path
+        self.blacklist_matcher = blacklist_matcher
+        self._count = None
+
+    def __iter__(self):
+        count = 0
+        with open(self.file_path, 'r', encoding='utf-8') as f:
+            for line in append_end_pause(preprocess_lines(f, self.blacklist_matcher)):
+                count += 1
+                yield line
+        self._count = count
+
+    def __len__(self):
+        if self._count is None:
+            self._count = sum(1 for _ in self)
+        return self._count
 
-    except Exception as e:
-        raise RuntimeError(f"获取声音列表失败: {e}")
+
+def get_output_paths(file_path, output_dir, lrc_max_len, output_format=OUTPUT_FORMAT_WAV):
+    """
+    根据输入文件计算输出的音频与LRC路径 (不生成LRC时后者为 None)
+    """
+    base_filename = os.path.splitext(os.path.basename(file_path))[0]
+    output_wav_path = os.path.join(output_dir, f"{base_filename}.{get_output_extension(output_format)}")
+    output_lrc_path = os.path.join(output_dir, f"{base_filename}.lrc") if lrc_max_len is not None else None
+    return output_wav_path, output_lrc_path
 
 
-def process_file(api_url, file_path, output_dir, voice_params, lrc_max_len, blacklist_source):
+def get_segment_index_path(file_path, output_dir):
+    """
+    分段输出时播放列表的路径, 播放列表在所有分段完成后才生成
+    """
+    base_filename = os.path.splitext(os.path.basename(file_path))[0]
+    return os.path.join(output_dir, f"{base_filename}.m3u")
+
+
+def is_output_up_to_date(file_path, output_dir, lrc_max_len, output_format=OUTPUT_FORMAT_WAV, segmented=False):
+    """
+    判断输入文件的输出是否已完整生成且不早于输入文件
+    - 存在未完成的断点记录时视为未完成
+    - 分段输出时以播放列表为准
+    """
+    output_wav_path, output_lrc_path = get_output_paths(file_path, output_dir, lrc_max_len, output_format)
+    if segmented:
+        outputs = [get_segment_index_path(file_path, output_dir)]
+    else:
+        outputs = [output_wav_path] + ([output_lrc_path] if output_lrc_path else [])
+    if os.path.exists(output_wav_path + '.ckpt'):
+        return False
+    try:
+        source_mtime = os.path.getmtime(file_path)
+        return all(os.path.getmtime(path) >= source_mtime for path in outputs)
+    except OSError:
+        return False
+
+
+def process_file(api_url, file_path, output_dir, voice_params, lrc_max_len, blacklist_source, workers=1, cache=None, resume=False, executor=None, lrc_timing=LRC_TIMING_WEIGHTED, batch_chars=0, output_format=OUTPUT_FORMAT_WAV, segment_policy=None, incremental=False, non_utf8_policy=NON_UTF8_ASK, dedup_memory=DEFAULT_DEDUP_MEMORY, max_request_chars=DEFAULT_MAX_REQUEST_CHARS, postprocessor=None):
     """
     处理单个文本文件
+    - 提供 segment_policy (SegmentPolicy) 时按章节/时长/大小输出多个分段文件及播放列表
+    - incremental 为 True 时保存行级映射表, 再次运行时只合成新增或修改的行 (仅WAV格式)
+    - non_utf8_policy 决定遇到非UTF-8文件时询问用户、自动转换还是直接报错
+    - max_request_chars 大于 0 时超过该长度的行按句拆分为多个请求, 音频再拼接回该行
+    - 提供 postprocessor (PcmPostProcessor) 时每行音频在写入前裁剪首尾静音、统一响度或重采样
+    - dedup_memory 大于 0 时文件内的重复行只合成一次 (最多在内存中保留该字节数的音频); 传入的 cache 已是 DedupCache 时直接共用
+    :return: True 表示已生成输出, False 表示文件内容为空被跳过
     """
     if not os.path.exists(file_path):
         raise FileNotFoundError(f"输入文件不存在: {file_path}")
+    # 合成开始前检查声音ID, 避免拼写错误在请求API时才暴露
+    validate_voice(api_url, voice_params.get('voice'))
 
     print(f"\n--- 开始处理文件: {os.path.basename(file_path)} ---")
     
     os.makedirs(output_dir, exist_ok=True)
     
-    lines = []
-    # --- 新增：带重试和转换逻辑的文件读取 ---
+    # --- 带重试和转换逻辑的编码校验 (流式读取, 文本在合成时再逐行读入) ---
     while True:
         try:
-            with open(file_path, 'r', encoding='utf-8') as f:
-                lines = f.readlines()
+            with metrics.timed('read'):
+                validate_utf8_file(file_path)
+            metrics.inc('input_bytes_read', os.path.getsize(file_path))
             break # 读取成功，跳出循环
         except UnicodeDecodeError:
             print(f"\n警告: 文件 '{os.path.basename(file_path)}' 不是UTF-8编码。")
+            encoding, confidence = detect_file_encoding(file_path)
+            if encoding is None:
+                raise ValueError(f"文件 {os.path.basename(file_path)} 不是UTF-8编码, 且无法识别其编码，未处理。")
+            print(f"检测到的编码为 '{encoding}' (可信度 {confidence:.0%})")
+            if non_utf8_policy == NON_UTF8_CONVERT and confidence < MIN_AUTO_CONVERT_CONFIDENCE:
+                raise ValueError(f"文件 {os.path.basename(file_path)} 的编码检测可信度过低，未自动转换。")
             prompt = "是否尝试将其转换为UTF-8编码后重试？ (这将覆盖原文件) [y/n]: "
-            user_choice = input(prompt).lower()
             
-            if user_choice in ['y', 'yes']:
+            if confirm_utf8_conversion(prompt, non_utf8_policy):
                 print("正在尝试转换...")
-                if convert_file_to_utf8(file_path):
+                if convert_file_to_utf8(file_path, encoding):
                     print("转换成功，正在重试读取...")
                     continue # 回到循环开头，再次尝试读取
                 else:
                     raise ValueError(f"文件 {os.path.basename(file_path)} 转换失败，任务已终止。")
-            else:
+            elif non_utf8_policy == NON_UTF8_ASK:
                 raise ValueError(f"用户取消操作，文件 {os.path.basename(file_path)} 未处理。")
+            else:
+                raise ValueError(f"文件 {os.path.basename(file_path)} 不是UTF-8编码，未处理。")
         
-    # 加载黑名单
-    blacklist_patterns = load_blacklist_patterns(blacklist_source)
+    # 加载黑名单 (批量处理时由调用方预先编译好匹配器)
+    if isinstance(blacklist_source, BlacklistMatcher):
+        blacklist_matcher = blacklist_source
+    else:
+        blacklist_matcher = load_blacklist_patterns(blacklist_source)
 
-    # 预处理文本行
-    processed_lines = []
-    for line in lines:
-        stripped_line = line.strip()
-        if stripped_line: # 忽略空行
-            blacklisted_line = apply_blacklist(stripped_line, blacklist_patterns)
-            processed_lines.append(blacklisted_line)
-    
-    if not processed_lines:
+    # 预处理文本行, 并为文档最后一行添加静音标记 (逐行读取, 不把整个文件载入内存)
+    processed_lines = TextFileLines(file_path, blacklist_matcher)
+
+    if next(iter(processed_lines), None) is None:
         print(f"文件 {os.path.basename(file_path)} 内容为空或只包含空白行, 已跳过。")
-        return
-        
-    # 为文档最后一行添加静音标记
-    processed_lines[-1] = processed_lines[-1] + "[[PAUSE:1000]]"
+        return False
+
+    dedup = None
+    if dedup_memory and not isinstance(cache, DedupCache):
+        cache = dedup = DedupCache(cache, dedup_memory)
     
-    # 设置输出文件名
-    base_filename = os.path.splitext(os.path.basename(file_path))[0]
-    output_wav_path = os.path.join(output_dir, f"{base_filename}.wav")
-    output_lrc_path = os.path.join(output_dir, f"{base_filename}.lrc") if lrc_max_len is not None else None
+    if segment_policy is not None:
+        convert_text_to_segmented_files(
+            api_url=api_url,
+            lines=processed_lines,
+            voice_params=voice_params,
+            output_dir=output_dir,
+            base_name=os.path.splitext(os.path.basename(file_path))[0],
+            policy=segment_policy,
+            lrc_max_len=lrc_max_len,
+            workers=workers,
+            cache=cache,
+            executor=executor,
+            lrc_timing=lrc_timing,
+            batch_chars=batch_chars,
+            output_format=output_format,
+            max_request_chars=max_request_chars,
+            postprocessor=postprocessor
+        )
+    else:
+        # 设置输出文件名
+        output_wav_path, output_lrc_path = get_output_paths(file_path, output_dir, lrc_max_len, output_format)
+
+        line_map = None
+        if incremental:
+            line_map = LineMap(output_wav_path, compute_job_fingerprint(api_url, [], voice_params, lrc_max_len, postprocessor))
+            if line_map.load() and update_audio_file_incrementally(
+                    api_url, processed_lines, voice_params, output_wav_path, line_map, output_lrc_path,
+                    lrc_max_len, workers, cache, executor, lrc_timing, batch_chars, max_request_chars, postprocessor):
+                if dedup is not None:
+                    dedup.report()
+                print(f"--- 文件处理完成: {os.path.basename(file_path)} ---")
+                return True
+            print("未找到可用的增量映射表, 将完整合成并保存映射表。")
 
-    # 调用核心TTS转换函数
-    convert_text_to_audio_file(
-        api_url=api_url,
-        lines=processed_lines,
-        voice_params=voice_params,
-        output_wav_path=output_wav_path,
-        output_lrc_path=output_lrc_path,
-        lrc_max_len=lrc_max_len
-    )
+        # 调用核心TTS转换函数
+        convert_text_to_audio_file(
+            api_url=api_url,
+            lines=processed_lines,
+            voice_params=voice_params,
+            output_wav_path=output_wav_path,
+            output_lrc_path=output_lrc_path,
+            lrc_max_len=lrc_max_len,
+            workers=workers,
+            cache=cache,
+            resume=resume,
+            executor=executor,
+            lrc_timing=lrc_timing,
+            batch_chars=batch_chars,
+            output_format=output_format,
+            line_map=line_map,
+            max_request_chars=max_request_chars,
+            postprocessor=postprocessor
+        )
+    if dedup is not None:
+        dedup.report()
     print(f"--- 文件处理完成: {os.path.basename(file_path)} ---")
+    return True
 
 
-def process_directory(api_url, input_dir, output_dir, voice_params, lrc_max_len, blacklist_source):
+def process_directory(api_url, input_dir, output_dir, voice_params, lrc_max_len, blacklist_source, workers=1, cache=None, resume=False, file_workers=1, lrc_timing=LRC_TIMING_WEIGHTED, batch_chars=0, output_format=OUTPUT_FORMAT_WAV, segment_policy=None, incremental=False, non_utf8_policy=NON_UTF8_ASK, executor=None, dedup_memory=DEFAULT_DEDUP_MEMORY, max_request_chars=DEFAULT_MAX_REQUEST_CHARS, postprocessor=None):
     """
     处理指定目录下的所有 .txt 文件
+    - file_workers 个文件同时处理, 所有文件共用一个 workers 大小的API请求线程池,
+      各文件按提交顺序轮流获得请求额度, 总并发不会超过 workers。
+    - 提供 executor 时使用该共享线程池发起API请求 (例如常驻服务中多个任务共用)。
+    - dedup_memory 大于 0 时所有文件共用一个去重缓存, 跨文件的重复行也只合成一次。
+    :return: 每个文件的处理结果列表 (文件路径, 状态, 错误信息, 耗时秒数)
     """
     if not os.path.isdir(input_dir):
         raise FileNotFoundError(f"输入目录不存在: {input_dir}")
 
+    # 批量任务开始前检查声音ID, 各文件处理时直接使用已加载的声音列表
+    validate_voice(api_url, voice_params.get('voice'))
+
     txt_files = sorted(glob.glob(os.path.join(input_dir, '*.txt')))
     
     if not txt_files:
         print(f"目录 {input_dir} 中没有找到 .txt 文件。")
-        return
+        return []
     
-    # --- 新增：批量处理前的编码预检查 ---
+    # --- 批量处理前的编码预检查: 完整校验每个文件, 结果按修改时间与大小缓存 ---
     print("正在进行文件编码预检查...")
-    files_to_convert = []
-    for file_path in txt_files:
-        try:
-            # 只尝试打开，不读取内容，以快速检查编码
-            with open(file_path, 'r', encoding='utf-8') as f:
-                f.read(1) 
-        except UnicodeDecodeError:
-            files_to_convert.append(file_path)
+    os.makedirs(output_dir, exist_ok=True)
+    scan_cache = EncodingScanCache(os.path.join(output_dir, SCAN_CACHE_FILENAME))
+    with metrics.timed('encoding_scan'):
+        encodings = scan_file_encodings(txt_files, scan_cache)
+    files_to_convert = [file_path for file_path in txt_files if not is_utf8(encodings[file_path][0])]
     
     if files_to_convert:
         print("\n警告: 检测到以下文件不是UTF-8编码:")
-        for f in files_to_convert:
-            print(f" - {os.path.basename(f)}")
+        undecodable = []
+        for file_path in files_to_convert:
+            encoding, confidence = encodings[file_path]
+            if encoding is None:
+                undecodable.append(file_path)
+                print(f" - {os.path.basename(file_path)} (无法识别编码)")
+            else:
+                print(f" - {os.path.basename(file_path)} (检测为 {encoding}, 可信度 {confidence:.0%})")
+        if undecodable:
+            raise ValueError("部分文件无法识别编码，批量任务未执行。请检查上方列表。")
+        if non_utf8_policy == NON_UTF8_CONVERT:
+            # 无人值守时只自动转换可信度足够高的文件
+            uncertain = [f for f in files_to_convert if encodings[f][1] < MIN_AUTO_CONVERT_CONFIDENCE]
+            if uncertain:
+                raise ValueError(f"{len(uncertain)} 个文件的编码检测可信度低于 {MIN_AUTO_CONVERT_CONFIDENCE:.0%}，"
+                                 f"未自动转换，批量任务未执行。请手动确认: "
+                                 f"{', '.join(os.path.basename(f) for f in uncertain)}")
         
         prompt = "\n是否尝试将以上所有文件转换为UTF-8编码后继续？ (这将覆盖原文件) [y/n]: "
-        user_choice = input(prompt).lower()
         
-        if user_choice in ['y', 'yes']:
+        if confirm_utf8_conversion(prompt, non_utf8_policy):
             print("正在批量转换文件...")
             success_count = 0
             for file_path in files_to_convert:
-                if convert_file_to_utf8(file_path):
+                if convert_file_to_utf8(file_path, encodings[file_path][0]):
                     success_count += 1
+                    scan_cache.put(file_path, UTF8, 1.0)
+            scan_cache.save()
             if success_count != len(files_to_convert):
                 raise ValueError("部分文件转换失败，任务已终止。请检查上方日志。")
             print("所有文件转换完成，继续执行任务。")
-        else:
+        elif non_utf8_policy == NON_UTF8_ASK:
             raise ValueError("用户取消操作，批量任务未执行。")
+        else:
+            raise ValueError("目录中存在非UTF-8编码的文件，批量任务未执行。")
 
     # --- 预检查结束，开始正式处理 ---
     print(f"\n即将处理目录 '{input_dir}' 中的 {len(txt_files)} 个文件...")
 
-    for file_path in txt_files:
+    # 黑名单只加载并编译一次, 所有文件共用
+    blacklist_matcher = load_blacklist_patterns(blacklist_source)
+
+    dedup = None
+    if dedup_memory and not isinstance(cache, DedupCache):
+        cache = dedup = DedupCache(cache, dedup_memory)
+
+    def run_one(file_path):
+        if resume and is_output_up_to_date(file_path, output_dir, lrc_max_len, output_format, segment_policy is not None):
+            print(f"文件 {os.path.basename(file_path)} 的输出已是最新, 已跳过。")
+            return file_path, FILE_STATUS_SKIPPED, None, 0.0
+        started = time.monotonic()
         try:
-            process_file(api_url, file_path, output_dir, voice_params, lrc_max_len, blacklist_source)
+            produced = process_file(api_url, file_path, output_dir, voice_params, lrc_max_len,
+                                    blacklist_matcher, workers, cache, resume, api_executor, lrc_timing,
+                                    batch_chars, output_format, segment_policy, incremental, non_utf8_policy,
+                                    dedup_memory, max_request_chars, postprocessor)
+            status = FILE_STATUS_OK if produced else FILE_STATUS_SKIPPED
+            return file_path, status, None, time.monotonic() - started
         except Exception as e:
-            print(f"处理文件 {os.path.basename(file_path)} 时发生错误: {e}", file=sys.stderr)
-            # 选择继续处理下一个文件
-            continue
-            
-    print("\n所有文件处理完毕。")
+            # 单个文件失败不影响其它文件, 错误汇总到最终报告中
+            return file_path, FILE_STATUS_FAILED, str(e), time.monotonic() - started
+
+    def run_all():
+        if file_workers <= 1:
+            return [run_one(file_path) for file_path in txt_files]
+        with ThreadPoolExecutor(max_workers=file_workers, thread_name_prefix="tts_file") as file_executor:
+            return list(file_executor.map(run_one, txt_files))
+
+    if executor is not None:
+        api_executor = executor
+        results = run_all()
+    else:
+        with ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix="tts_api") as api_executor:
+            results = run_all()
+
+    print_directory_summary(results)
+    if dedup is not None:
+        dedup.report()
+    return results
+
+
+def print_directory_summary(results):
+    """
+    输出批量处理的逐文件结果汇总
+    """
+    status_labels = {FILE_STATUS_OK: "成功", FILE_STATUS_SKIPPED: "跳过", FILE_STATUS_FAILED: "失败"}
+    counts = {status: 0 for status in status_labels}
+    separator = "=" * 50
+
+    print("\n所有文件处理完毕。处理结果汇总:")
+    print(separator)
+    for file_path, status, error, elapsed in results:
+        counts[status] += 1
+        print(f"[{status_labels[status]}] {os.path.basename(file_path)} ({elapsed:.1f} 秒)")
+        if error:
+            print(f"    错误: {error}", file=sys.stderr)
+    print(separator)
+    print(f"成功 {counts[FILE_STATUS_OK]} 个, 跳过 {counts[FILE_STATUS_SKIPPED]} 个, 失败 {counts[FILE_STATUS_FAILED]} 个。")
+
+
+def process_stream(api_url, voice_params, blacklist_source, workers=1, cache=None,
+                   output_format=STREAM_FORMAT_WAV, input_stream=None, output_stream=None,
+                   max_request_chars=DEFAULT_MAX_REQUEST_CHARS, postprocessor=None):
+    """
+    流式处理: 从标准输入逐行读取文本, 每合成一行就立即把音频写到标准输出
+    - output_format 为 'wav' 时先输出长度未知的WAV文件头, 之后只输出PCM数据; 为 'pcm' 时只输出PCM数据
+    - 每行读入后立即合成并输出, 不等待下一行; 输入结束后再补充输出 END_PAUSE_MS 的静音作为结尾停顿
+    - 运行期间所有提示信息改为输出到标准错误, 标准输出只包含音频数据
+    """
+    if input_stream is None:
+        input_stream = io.TextIOWrapper(sys.stdin.buffer, encoding='utf-8', errors='replace')
+    if output_stream is None:
+        output_stream = sys.stdout.buffer
+
+    with contextlib.redirect_stdout(sys.stderr):
+        blacklist_matcher = load_blacklist_patterns(blacklist_source)
+        lines = preprocess_lines(input_stream, blacklist_matcher)
+
+        first_chunk = None
+        line_count = 0
+        try:
+            for i, line, audio_data in synthesize_lines_in_order(api_url, lines, voice_params, workers, cache,
+                                                                 max_request_chars=max_request_chars):
+                try:
+                    chunk = parse_wav(audio_data)
+                    if postprocessor is not None:
+                        chunk = postprocessor.process(chunk, line)
+                except WavFormatError as e:
+                    print(f"警告: 无法解析第 {i+1} 行的音频 ({e}), 已跳过。")
+                    continue
+                if first_chunk is None:
+                    first_chunk = chunk
+                    if output_format == STREAM_FORMAT_WAV:
+                        output_stream.write(build_wav_header(chunk.fmt_body, STREAMING_DATA_SIZE))
+                elif chunk.fmt_body[:16] != first_chunk.fmt_body[:16]:
+                    print(f"警告: 第 {i+1} 行音频格式与首个音频块不一致, 已跳过。")
+                    continue
+                output_stream.write(chunk.frames)
+                output_stream.flush()
+                line_count += 1
+            if first_chunk is not None:
+                # 8位PCM为无符号采样, 静音值为 0x80
+                silence = b'\x80' if first_chunk.bits_per_sample == 8 else b'\x00'
+                output_stream.write(silence * (first_chunk.sample_rate * END_PAUSE_MS // 1000 * first_chunk.block_align))
+                output_stream.flush()
+        except BrokenPipeError:
+            # 下游程序提前退出 (如播放器被关闭), 静默结束
+            print("输出管道已关闭, 停止合成。")
+            return line_count
 
+    print(f"流式合成完成, 共输出 {line_count} 行音频。", file=sys.stderr)
+    return line_count
@@ -0,0 +1,125 @@
+import random
+import threading
+import time
+from email.utils import parsedate_to_datetime
+
+
+class TokenBucket:
+    """
+    令牌桶限速器 (线程安全)
+    - rate 为每秒补充的令牌数, 为 None 时不限速
+    - burst 为桶容量, 允许的瞬时突发请求数
+    - defer() 可让所有请求统一暂停一段时间 (例如服务端返回 Retry-After)
+    """
+
+    def __init__(self, rate=None, burst=None):
+        self.rate = rate
+        self.capacity = max(1.0, float(burst if burst is not None else (rate or 1)))
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """
+        取得一个令牌, 必要时阻塞等待
+        """
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                wait = self._paused_until - now
+                if wait <= 0:
+                    if self.rate is None:
+                        return
+                    self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                    self._updated = now
+                    if self._tokens >= 1:
+                        self._tokens -= 1
+                        return
+                    wait = (1 - self._tokens) / self.rate
+            time.sleep(wait)
+
+    def defer(self, seconds):
+        """
+        让之后的所有请求至少等待 seconds 秒
+        """
+        with self._lock:
+            self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+
+
+class AdaptiveConcurrencyLimiter:
+    """
+    AIMD 自适应并发控制器 (线程安全)
+    - 请求遇到过载信号 (429/5xx/超时) 时, 在途请求上限减半 (每个冷却周期最多一次)
+    - 请求成功且延迟接近历史最低延迟时, 上限缓慢增加 (每个窗口约 +1)
+    """
+
+    LATENCY_TOLERANCE = 2.0   # 延迟不超过最低延迟的该倍数时视为服务端负载正常
+    DECREASE_FACTOR = 0.5
+    MIN_LATENCY_DECAY = 1.01  # 最低延迟基线的缓慢上浮, 以适应服务端性能的长期变化
+
+    def __init__(self, max_limit, initial_limit=None, min_limit=1):
+        self.max_limit = max(min_limit, max_limit)
+        self.min_limit = min_limit
+        self.limit = float(initial_limit if initial_limit is not None else self.max_limit)
+        self.in_flight = 0
+        self._min_latency = None
+        self._last_decrease = 0.0
+        self._condition = threading.Condition()
+
+    def acquire(self):
+        with self._condition:
+            while self.in_flight >= int(self.limit):
+                self._condition.wait()
+            self.in_flight += 1
+
+    def release(self, latency=None, overloaded=False):
+        """
+        归还一个并发额度, 并根据本次请求的结果调整上限
+        :param latency: 请求耗时 (秒), 仅在成功时提供
+        :param overloaded: 本次请求是否遇到过载信号
+        """
+        with self._condition:
+            self.in_flight -= 1
+            now = time.monotonic()
+            if overloaded:
+                # 同一波失败往往同时返回, 冷却期内只减一次, 避免上限直接跌到底
+                cooldown = self._min_latency or 1.0
+                if now - self._last_decrease >= cooldown:
+                    self.limit = max(self.min_limit, self.limit * self.DECREASE_FACTOR)
+                    self._last_decrease = now
+            elif latency is not None:
+                if self._min_latency is None or latency < self._min_latency:
+                    self._min_latency = latency
+                else:
+                    self._min_latency *= self.MIN_LATENCY_DECAY
+                if latency <= self._min_latency * self.LATENCY_TOLERANCE:
+                    self.limit = min(self.max_limit, self.limit + 1 / self.limit)
+            self._condition.notify_all()
+
+
+def backoff_delay(attempt, base_delay, max_delay):
+    """
+    指数退避加随机抖动: 第 attempt 次重试的等待时间在 [delay/2, delay] 之间
+    """
+    delay = min(max_delay, base_delay * (2 ** attempt))
+    return delay / 2 + random.uniform(0, delay / 2)
+
+
+def parse_retry_after(value):
+    """
+    解析 Retry-After 响应头 (秒数或 HTTP 日期)
+    :return: 需要等待的秒数, 无法解析时返回 None
+    """
+    if not value:
+        return None
+    value = value.strip()
+    if value.isdigit():
+        return float(value)
+    try:
+        retry_at = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    if retry_at is None:
+        return None
+    return max(0.0, retry_at.timestamp() - time.time())
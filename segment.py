@@ -0,0 +1,165 @@
+import os
+import re
+
+from audio import WAV_MAX_DATA_SIZE
+from encoders import OUTPUT_FORMAT_WAV, create_stream_writer, get_output_extension
+from lrc import MARKER_PATTERN, LrcWriter
+from metrics import metrics
+
+
+def parse_duration(value):
+    """
+    将 "90s"、"30m"、"1.5h"、"600" (秒) 形式的字符串解析为毫秒数
+    :raises: ValueError 如果格式不正确
+    """
+    match = re.fullmatch(r'\s*(\d+(?:\.\d+)?)\s*([smh]?)\s*', str(value), re.IGNORECASE)
+    if not match:
+        raise ValueError(f"无法解析时长: {value} (示例: 90s, 30m, 1.5h)")
+    number, unit = match.groups()
+    seconds = float(number) * {'': 1, 's': 1, 'm': 60, 'h': 3600}[unit.lower()]
+    if seconds <= 0:
+        raise ValueError(f"时长必须大于 0: {value}")
+    return int(seconds * 1000)
+
+
+class SegmentPolicy:
+    """
+    输出分段规则, 分段总是发生在行与行之间
+    - chapter_pattern: 匹配该正则的行作为新章节的第一行
+    - max_duration_ms: 单个分段的最大时长
+    - max_bytes: 单个分段的最大音频数据量 (压缩格式按编码前的PCM数据计算, 实际文件更小)
+    单行音频本身超过上限时独占一个分段。
+    """
+
+    def __init__(self, chapter_pattern=None, max_duration_ms=None, max_bytes=None):
+        self.chapter_regex = re.compile(chapter_pattern) if chapter_pattern else None
+        self.max_duration_ms = max_duration_ms
+        self.max_bytes = max_bytes
+
+    def is_chapter_heading(self, line):
+        return self.chapter_regex is not None and self.chapter_regex.search(line) is not None
+
+
+class SegmentedOutput:
+    """
+    按 SegmentPolicy 将音频依次写入 <base>_001.<ext>、<base>_002.<ext> ...
+    - 每个分段写满后立即关闭 (重命名为正式文件名), 下游可以提前开始处理
+    - 每个分段单独生成LRC, 时间戳从该分段的起点重新计算
+    - 全部完成后生成 <base>.m3u 播放列表, 并删除上次运行遗留的多余分段
+    """
+
+    def __init__(self, output_dir, base_name, policy, output_format=OUTPUT_FORMAT_WAV, with_lrc=False):
+        self.output_dir = output_dir
+        self.base_name = base_name
+        self.policy = policy
+        self.output_format = output_format
+        self.with_lrc = with_lrc
+        self.extension = get_output_extension(output_format)
+        self.max_bytes = policy.max_bytes
+        if output_format == OUTPUT_FORMAT_WAV:
+            self.max_bytes = min(self.max_bytes or WAV_MAX_DATA_SIZE, WAV_MAX_DATA_SIZE)
+        self.segments = []
+        self.writer = None
+        self.title = None
+        self.lrc_writer = None
+        self.encode_seconds = 0.0
+
+    @property
+    def index_path(self):
+        return os.path.join(self.output_dir, f"{self.base_name}.m3u")
+
+    def segment_paths(self, number):
+        stem = os.path.join(self.output_dir, f"{self.base_name}_{number:03d}")
+        return f"{stem}.{self.extension}", f"{stem}.lrc"
+
+    @property
+    def duration_ms(self):
+        """
+        当前分段已写入的时长, 即下一行在该分段中的起始时间
+        """
+        return self.writer.duration_ms if self.writer is not None else 0
+
+    def prepare_line(self, line, chunk):
+        """
+        写入一行音频前调用, 根据分段规则决定是否先结束当前分段
+        :param chunk: 该行解析后的 WavChunk, 解析失败时为 None
+        """
+        if self.writer is not None and self.writer.data_size > 0:
+            if self.policy.is_chapter_heading(line):
+                self.finish_segment()
+            elif chunk is not None:
+                too_large = self.max_bytes is not None and self.writer.data_size + len(chunk.frames) > self.max_bytes
+                too_long = (self.policy.max_duration_ms is not None
+                            and self.writer.duration_ms + chunk.duration_ms > self.policy.max_duration_ms)
+                if too_large or too_long:
+                    self.finish_segment()
+        if self.writer is None:
+            audio_path, lrc_path = self.segment_paths(len(self.segments) + 1)
+            self.writer = create_stream_writer(self.output_format, audio_path)
+            if self.with_lrc:
+                self.lrc_writer = LrcWriter(lrc_path)
+            if self.policy.is_chapter_heading(line):
+                self.title = MARKER_PATTERN.sub('', line).strip()
+
+    def append(self, chunk):
+        return self.writer.append(chunk)
+
+    def finish_segment(self):
+        """
+        关闭当前分段并写出其LRC文件
+        """
+        writer, self.writer = self.writer, None
+        lrc_writer, self.lrc_writer = self.lrc_writer, None
+        if writer is None:
+            return
+        if not writer.close():
+            if lrc_writer is not None:
+                lrc_writer.abort()
+            return
+        self.encode_seconds += getattr(writer, 'encode_seconds', 0.0)
+        number = len(self.segments) + 1
+        audio_path, _ = self.segment_paths(number)
+        if lrc_writer is not None:
+            with metrics.timed('lrc_write'):
+                lrc_writer.close()
+        title = self.title or f"{self.base_name} ({number})"
+        self.segments.append((audio_path, writer.duration_ms, title))
+        self.title = None
+        print(f"分段已保存: {audio_path} ({writer.duration_ms / 1000:.1f} 秒)")
+
+    def close(self):
+        """
+        结束最后一个分段, 写出播放列表并清理旧分段
+        :return: 生成的分段数
+        """
+        self.finish_segment()
+        if not self.segments:
+            return 0
+        lines = ["#EXTM3U"]
+        for audio_path, duration_ms, title in self.segments:
+            lines.append(f"#EXTINF:{round(duration_ms / 1000)},{title}")
+            lines.append(os.path.basename(audio_path))
+        temp_path = self.index_path + '.part'
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            f.write('\n'.join(lines) + '\n')
+        os.replace(temp_path, self.index_path)
+        self._remove_stale_segments()
+        return len(self.segments)
+
+    def abort(self):
+        if self.writer is not None:
+            self.writer.abort()
+            self.writer = None
+        if self.lrc_writer is not None:
+            self.lrc_writer.abort()
+            self.lrc_writer = None
+
+    def _remove_stale_segments(self):
+        number = len(self.segments) + 1
+        while True:
+            stale = [path for path in self.segment_paths(number) if os.path.exists(path)]
+            if not stale:
+                return
+            for path in stale:
+                os.remove(path)
+            number += 1
@@ -0,0 +1,426 @@
+import ipaddress
+import itertools
+import json
+import queue
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse
+
+from encoders import OUTPUT_ENCODERS, OUTPUT_FORMAT_WAV, check_output_format
+from lrc import LRC_TIMING_WEIGHTED, LRC_TIMING_SILENCE
+from metrics import metrics, progress, ProgressReporter, OUTPUT_MODE_QUIET
+from tts import DEFAULT_MAX_REQUEST_CHARS
+from process import process_file, process_directory, NON_UTF8_CONVERT, NON_UTF8_FAIL, FILE_STATUS_OK, FILE_STATUS_SKIPPED, FILE_STATUS_FAILED
+from postprocess import create_postprocessor
+from utils import load_blacklist_patterns
+from voices import validate_voice
+
+JOB_QUEUED = 'queued'
+JOB_RUNNING = 'running'
+JOB_DONE = 'done'
+JOB_FAILED = 'failed'
+JOB_CANCELLED = 'cancelled'
+JOB_TERMINAL_STATES = (JOB_DONE, JOB_FAILED, JOB_CANCELLED)
+
+DEFAULT_SERVER_HOST = '127.0.0.1'
+DEFAULT_MAX_JOBS = 2
+DEFAULT_JOB_TTL = 3600          # 已结束的任务保留的秒数
+DEFAULT_JOB_HISTORY = 100      # 最多保留的已结束任务数
+MAX_REQUEST_BODY = 1024 * 1024
+
+
+def parse_server_address(value):
+    """
+    解析 --serve 参数, 格式为 [HOST:]PORT
+    :return: (host, port)
+    :raises: ValueError 如果格式不正确
+    """
+    host, _, port = str(value).rpartition(':')
+    if not port.isdigit() or not 0 < int(port) < 65536:
+        raise ValueError(f"无效的服务地址: {value} (示例: 8080, 127.0.0.1:8080)")
+    return host or DEFAULT_SERVER_HOST, int(port)
+
+
+def is_loopback_host(host):
+    """
+    判断监听地址是否只能从本机访问
+    """
+    host = host.strip('[]')
+    if host.lower() == 'localhost':
+        return True
+    try:
+        return ipaddress.ip_address(host).is_loopback
+    except ValueError:
+        return False
+
+
+def _check_int(spec, key, low, high):
+    value = spec.get(key)
+    if value is not None and (not isinstance(value, int) or isinstance(value, bool) or not low <= value <= high):
+        raise ValueError(f"参数 {key} 必须是 {low}-{high} 之间的整数")
+    return value
+
+
+def parse_job_spec(data):
+    """
+    校验任务提交的JSON内容, 规则与命令行参数一致
+    :return: 规范化后的任务参数字典
+    :raises: ValueError 如果参数无效
+    """
+    if not isinstance(data, dict):
+        raise ValueError("任务内容必须是JSON对象")
+    if bool(data.get('file')) == bool(data.get('dir')):
+        raise ValueError("必须且只能提供 file 或 dir 其中之一")
+    for key in ('file', 'dir', 'out', 'voice', 'blacklist'):
+        if data.get(key) is not None and not isinstance(data[key], str):
+            raise ValueError(f"参数 {key} 必须是字符串")
+
+    output_format = data.get('format') or OUTPUT_FORMAT_WAV
+    if output_format not in OUTPUT_ENCODERS:
+        raise ValueError(f"不支持的输出格式: {output_format}")
+    check_output_format(output_format)
+    lrc_timing = data.get('lrc_timing') or LRC_TIMING_WEIGHTED
+    if lrc_timing not in (LRC_TIMING_WEIGHTED, LRC_TIMING_SILENCE):
+        raise ValueError(f"无效的 lrc_timing: {lrc_timing}")
+    non_utf8 = data.get('non_utf8') or NON_UTF8_FAIL
+    if non_utf8 not in (NON_UTF8_CONVERT, NON_UTF8_FAIL):
+        raise ValueError(f"无效的 non_utf8 策略: {non_utf8} (可选 convert, fail)")
+    if data.get('incremental') and output_format != OUTPUT_FORMAT_WAV:
+        raise ValueError("incremental 仅支持WAV格式")
+    priority = data.get('priority', 0)
+    if not isinstance(priority, int) or isinstance(priority, bool):
+        raise ValueError("参数 priority 必须是整数")
+    normalize = data.get('normalize')
+    if normalize is not None and (not isinstance(normalize, (int, float)) or isinstance(normalize, bool)
+                                  or not -60 <= normalize <= 0):
+        raise ValueError("参数 normalize 必须是 -60 到 0 之间的数值 (dBFS)")
+
+    return {
+        'file': data.get('file'),
+        'dir': data.get('dir'),
+        'out': data.get('out') or '.',
+        'voice_params': {
+            'voice': data.get('voice'),
+            'volume': _check_int(data, 'volume', 0, 100),
+            'speed': _check_int(data, 'speed', 0, 100),
+            'pitch': _check_int(data, 'pitch', 0, 100),
+        },
+        'sub': _check_int(data, 'sub', 10, 100),
+        'blacklist': data.get('blacklist'),
+        'format': output_format,
+        'lrc_timing': lrc_timing,
+        'batch_chars': _check_int(data, 'batch_chars', 0, 5000) or 0,
+        'max_request_chars': DEFAULT_MAX_REQUEST_CHARS if data.get('max_request_chars') is None
+        else _check_int(data, 'max_request_chars', 0, 5000),
+        'resume': bool(data.get('resume')),
+        'incremental': bool(data.get('incremental')),
+        'non_utf8': non_utf8,
+        'priority': priority,
+        'max_silence': _check_int(data, 'max_silence', 0, 10000),
+        'normalize': normalize,
+        'sample_rate': _check_int(data, 'sample_rate', 8000, 192000),
+    }
+
+
+class Job:
+    __slots__ = ('id', 'spec', 'state', 'progress', 'error', 'results',
+                 'submitted_at', 'started_at', 'finished_at')
+
+    def __init__(self, job_id, spec):
+        self.id = job_id
+        self.spec = spec
+        self.state = JOB_QUEUED
+        self.progress = ProgressReporter()
+        self.progress.mode = OUTPUT_MODE_QUIET
+        self.error = None
+        self.results = None
+        self.submitted_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'state': self.state,
+            'priority': self.spec['priority'],
+            'input': self.spec['file'] or self.spec['dir'],
+            'out': self.spec['out'],
+            'progress': {'done': self.progress.done, 'total': self.progress.total},
+            'error': self.error,
+            'results': self.results,
+            'submitted_at': self.submitted_at,
+            'started_at': self.started_at,
+            'finished_at': self.finished_at,
+        }
+
+
+class JobServer:
+    """
+    常驻任务服务: 通过本地HTTP接口提交合成任务, 在同一进程内排队执行
+    - 所有任务共用HTTP连接池、合成缓存、已编译的黑名单与一个 workers 大小的API请求线程池
+    - 最多同时执行 max_jobs 个任务, 排队中的任务按优先级 (数值大者优先) 与提交顺序执行
+    - 遇到非UTF-8文件时不再询问, 按任务的 non_utf8 策略自动转换或直接报错
+    - 已结束 (完成、失败或取消) 的任务超过 job_ttl 秒或超过 job_history 个后被移除, 之后查询返回 404;
+      在任务结束或提交新任务时检查
+
+    接口:
+      POST   /jobs        提交任务, 返回任务ID
+      GET    /jobs        查看所有任务
+      GET    /jobs/<id>   查看任务状态与进度
+      DELETE /jobs/<id>   取消排队中的任务
+      GET    /health      服务状态
+      GET    /metrics     Prometheus 格式的统计
+    """
+
+    def __init__(self, api_url, host=DEFAULT_SERVER_HOST, port=0, workers=1, max_jobs=DEFAULT_MAX_JOBS, cache=None,
+                 job_ttl=DEFAULT_JOB_TTL, job_history=DEFAULT_JOB_HISTORY):
+        self.api_url = api_url
+        self.workers = workers
+        self.max_jobs = max_jobs
+        self.cache = cache
+        self.job_ttl = job_ttl
+        self.job_history = job_history
+        self.jobs = {}
+        self._finished = OrderedDict()   # 已结束任务的ID -> 结束时间, 按结束顺序排列
+        self._counts = {JOB_QUEUED: 0, JOB_RUNNING: 0}
+        self._queue = queue.PriorityQueue()
+        self._sequence = itertools.count(1)
+        self._lock = threading.Lock()
+        self._blacklists = {}
+        self._blacklist_lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix="tts_api")
+        self._httpd = ThreadingHTTPServer((host, port), self._make_handler())
+        self._httpd.daemon_threads = True
+        self._job_threads = []
+
+    @property
+    def url(self):
+        host, port = self._httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def _set_state_locked(self, job, state):
+        # 维护排队中/执行中的任务计数, 已结束的任务登记后等待移除
+        if job.state in self._counts:
+            self._counts[job.state] -= 1
+        job.state = state
+        if state in self._counts:
+            self._counts[state] += 1
+        elif state in JOB_TERMINAL_STATES:
+            job.finished_at = time.time()
+            self._finished[job.id] = job.finished_at
+            self._evict_locked()
+
+    def _evict_locked(self):
+        expire_before = time.time() - self.job_ttl
+        while self._finished:
+            job_id, finished_at = next(iter(self._finished.items()))
+            if len(self._finished) <= self.job_history and finished_at > expire_before:
+                break
+            self._finished.popitem(last=False)
+            self.jobs.pop(job_id, None)
+
+    def submit(self, spec):
+        with self._lock:
+            self._evict_locked()
+            job = Job(str(next(self._sequence)), spec)
+            self._counts[JOB_QUEUED] += 1
+            self.jobs[job.id] = job
+        print(f"[任务 {job.id}] 已加入队列: {spec['file'] or spec['dir']} (优先级 {spec['priority']})")
+        self._queue.put((-spec['priority'], int(job.id), job))
+        return job
+
+    def cancel(self, job):
+        with self._lock:
+            if job.state != JOB_QUEUED:
+                return False
+            self._set_state_locked(job, JOB_CANCELLED)
+        return True
+
+    def _get_blacklist(self, source):
+        # 相同来源的黑名单只加载并编译一次, 之后的任务直接复用
+        if not source:
+            return None
+        with self._blacklist_lock:
+            if source not in self._blacklists:
+                self._blacklists[source] = load_blacklist_patterns(source)
+            return self._blacklists[source]
+
+    def _job_loop(self):
+        while True:
+            _, _, job = self._queue.get()
+            if job is None:
+                return
+            with self._lock:
+                if job.state != JOB_QUEUED:
+                    continue
+                self._set_state_locked(job, JOB_RUNNING)
+                job.started_at = time.time()
+            try:
+                self._run_job(job)
+                state, error = JOB_DONE, None
+            except Exception as e:
+                state, error = JOB_FAILED, str(e)
+            with self._lock:
+                job.error = error
+                self._set_state_locked(job, state)
+            print(f"[任务 {job.id}] {'完成' if state == JOB_DONE else '失败: ' + error}")
+
+    def _run_job(self, job):
+        spec = job.spec
+        progress.bind(job.progress)
+        try:
+            common = dict(
+                api_url=self.api_url,
+                output_dir=spec['out'],
+                voice_params=spec['voice_params'],
+                lrc_max_len=spec['sub'],
+                blacklist_source=self._get_blacklist(spec['blacklist']),
+                workers=self.workers,
+                cache=self.cache,
+                resume=spec['resume'],
+                lrc_timing=spec['lrc_timing'],
+                batch_chars=spec['batch_chars'],
+                max_request_chars=spec['max_request_chars'],
+                output_format=spec['format'],
+                incremental=spec['incremental'],
+                non_utf8_policy=spec['non_utf8'],
+                executor=self._executor,
+                postprocessor=create_postprocessor(spec['max_silence'], spec['normalize'], spec['sample_rate']),
+            )
+            if spec['file']:
+                produced = process_file(file_path=spec['file'], **common)
+                job.results = [{'file': spec['file'], 'status': FILE_STATUS_OK if produced else FILE_STATUS_SKIPPED}]
+            else:
+                results = process_directory(input_dir=spec['dir'], **common)
+                job.results = [
+                    {'file': path, 'status': status, 'error': error, 'seconds': round(elapsed, 3)}
+                    for path, status, error, elapsed in results
+                ]
+                failed = sum(1 for _, status, _, _ in results if status == FILE_STATUS_FAILED)
+                if failed:
+                    raise RuntimeError(f"{failed} 个文件处理失败")
+        finally:
+            progress.bind(None)
+
+    def status(self):
+        with self._lock:
+            queued, running = self._counts[JOB_QUEUED], self._counts[JOB_RUNNING]
+        return {
+            'status': 'ok',
+            'queued': queued,
+            'running': running,
+            'max_jobs': self.max_jobs,
+            'workers': self.workers,
+        }
+
+    def _make_handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def log_message(self, format, *args):
+                pass
+
+            def _send_json(self, status, payload):
+                body = json.dumps(payload, ensure_ascii=False).encode('utf-8')
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json; charset=utf-8')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def _find_job(self, path):
+                job = server.jobs.get(path[len('/jobs/'):])
+                if job is None:
+                    self._send_json(404, {'error': '任务不存在'})
+                return job
+
+            def do_GET(self):
+                path = urlparse(self.path).path
+                if path == '/health':
+                    self._send_json(200, server.status())
+                elif path == '/metrics':
+                    body = metrics.format_prometheus().encode('utf-8')
+                    self.send_response(200)
+                    self.send_header('Content-Type', 'text/plain; version=0.0.4')
+                    self.send_header('Content-Length', str(len(body)))
+                    self.end_headers()
+                    self.wfile.write(body)
+                elif path == '/jobs':
+                    self._send_json(200, [job.to_dict() for job in list(server.jobs.values())])
+                elif path.startswith('/jobs/'):
+                    job = self._find_job(path)
+                    if job is not None:
+                        self._send_json(200, job.to_dict())
+                else:
+                    self._send_json(404, {'error': '未知路径'})
+
+            def do_POST(self):
+                if urlparse(self.path).path != '/jobs':
+                    self._send_json(404, {'error': '未知路径'})
+                    return
+                try:
+                    length = int(self.headers.get('Content-Length') or 0)
+                except ValueError:
+                    length = -1
+                if length < 0:
+                    self._send_json(400, {'error': '无效的 Content-Length'})
+                    return
+                if length > MAX_REQUEST_BODY:
+                    self._send_json(413, {'error': '请求内容过大'})
+                    return
+                try:
+                    spec = parse_job_spec(json.loads(self.rfile.read(length) or b'null'))
+                    # 声音ID错误时直接拒绝, 不进入队列
+                    validate_voice(server.api_url, spec['voice_params']['voice'])
+                except ValueError as e:
+                    self._send_json(400, {'error': str(e)})
+                    return
+                job = server.submit(spec)
+                self._send_json(202, job.to_dict())
+
+            def do_DELETE(self):
+                path = urlparse(self.path).path
+                if not path.startswith('/jobs/'):
+                    self._send_json(404, {'error': '未知路径'})
+                    return
+                job = self._find_job(path)
+                if job is None:
+                    return
+                if server.cancel(job):
+                    self._send_json(200, job.to_dict())
+                else:
+                    self._send_json(409, {'error': f"任务状态为 {job.state}, 只能取消排队中的任务"})
+
+        return Handler
+
+    def start(self):
+        for index in range(self.max_jobs):
+            thread = threading.Thread(target=self._job_loop, name=f"tts_job_{index}", daemon=True)
+            thread.start()
+            self._job_threads.append(thread)
+        return self
+
+    def serve_forever(self):
+        """
+        启动任务线程并在当前线程中处理HTTP请求 (阻塞, Ctrl+C 退出)
+        """
+        self.start()
+        print(f"任务服务已启动: {self.url} (最多同时执行 {self.max_jobs} 个任务, 按 Ctrl+C 退出)")
+        try:
+            self._httpd.serve_forever()
+        except KeyboardInterrupt:
+            print("\n正在停止任务服务...")
+        finally:
+            self.stop()
+
+    def stop(self):
+        self._httpd.server_close()
+        for _ in self._job_threads:
+            # 排在所有任务之后的结束标记
+            self._queue.put((float('inf'), next(self._sequence), None))
+        self._executor.shutdown(wait=False, cancel_futures=True)
@@ -1,98 +1,544 @@
 import os
-import wave
-import tempfile
-import shutil
-import time
-import io
+import difflib
+import itertools
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from api import text_to_speech
-from lrc import generate_lrc_content
-from utils import split_text_for_lrc
+from audio import parse_wav, build_wav_header, find_silent_spans, WavChunk, WavStreamWriter, WavFormatError
+from cache import make_cache_key
+from checkpoint import JobCheckpoint, compute_job_fingerprint, hash_line
+from encoders import OUTPUT_FORMAT_WAV, create_stream_writer
+from lrc import LrcWriter, compute_chunk_offsets, PAUSE_PATTERN, LRC_TIMING_WEIGHTED, LRC_TIMING_SILENCE
+from metrics import metrics, progress
+from segment import SegmentedOutput
+from utils import split_text_for_lrc, split_text_for_synthesis
 
-def convert_text_to_audio_file(api_url, lines, voice_params, output_wav_path, output_lrc_path=None, lrc_max_len=None):
+# 合并请求时行与行之间的分隔符, 使服务端在行间产生自然停顿
+BATCH_SEPARATOR = "\n"
+# 单次合成请求的默认最大字符数, 更长的行按句拆分后分别请求 (0 表示不拆分)
+DEFAULT_MAX_REQUEST_CHARS = 500
+
+def synthesize_line(api_url, line, voice_params, cache=None):
+    """
+    合成单行文本, 提供缓存 (SynthesisCache 或 DedupCache) 时优先复用已有音频, 未命中再调用API并写回缓存
+    """
+    if cache is None:
+        return text_to_speech(api_url, line, voice_params)
+
+    key = make_cache_key(api_url, line, voice_params)
+    return cache.fetch(key, lambda: text_to_speech(api_url, line, voice_params))
+
+
+def group_lines_into_batches(lines, batch_chars=0):
+    """
+    将连续的短行合并为批次, 每个批次的总字符数不超过 batch_chars
+    - batch_chars 为 0 时每行单独成批
+    - 含 [[PAUSE:n]] 标记的行总是作为所在批次的最后一行, 保证停顿位于批次末尾
+    :param lines: 可迭代的 (行号, 文本)
+    :return: 生成器, 每次产出一个批次 [(行号, 文本), ...]
+    """
+    batch = []
+    batch_len = 0
+    for item in lines:
+        line_len = len(item[1])
+        if batch and (batch_chars <= 0 or batch_len + line_len > batch_chars):
+            yield batch
+            batch = []
+            batch_len = 0
+        batch.append(item)
+        batch_len += line_len
+        # 不合并时每行立即成批, 不等待下一行 (流式输入时避免延迟一行)
+        if batch_chars <= 0 or PAUSE_PATTERN.search(item[1]):
+            yield batch
+            batch = []
+            batch_len = 0
+    if batch:
+        yield batch
+
+
+def split_batch_audio(audio_data, batch_lines):
+    """
+    将一个批次的合成音频切分为每行各自的WAV数据
+    按各行可朗读字符数估算分界点, 再吸附到附近的静音处 (行与行之间的停顿)
+    :raises: WavFormatError 如果音频无法解析
+    """
+    chunk = parse_wav(audio_data)
+    offsets = compute_chunk_offsets(batch_lines, chunk.duration_ms, find_silent_spans(chunk))
+    boundaries = [min(chunk.frame_count, round(ms * chunk.sample_rate / 1000)) for ms in offsets]
+    boundaries.append(chunk.frame_count)
+
+    pieces = []
+    for start, end in zip(boundaries, boundaries[1:]):
+        frames = chunk.frames[start * chunk.block_align:max(start, end) * chunk.block_align]
+        pieces.append(build_wav_header(chunk.fmt_body, len(frames)) + frames)
+    return pieces
+
+
+def split_long_lines(lines, max_chars):
+    """
+    将过长的行按句拆分为多个请求单元
+    :param lines: 可迭代的 (行号, 文本)
+    :return: 生成器, 产出 ((行号, 该行的段数), 文本段)
+    """
+    for i, line in lines:
+        pieces = split_text_for_synthesis(line, max_chars)
+        for piece in pieces:
+            yield (i, len(pieces)), piece
+
+
+def join_wav_pieces(audio_list, line_number):
+    """
+    将同一行各段的合成音频按顺序拼接为一个WAV, 时长为各段实际帧数之和
+    - 无法解析或格式与第一段不一致的段会被跳过并给出警告; 所有段都无法解析时原样返回第一段 (由调用方报告错误)
+    """
+    fmt_body = None
+    frames = []
+    for k, audio_data in enumerate(audio_list):
+        try:
+            chunk = parse_wav(audio_data)
+        except WavFormatError as e:
+            print(f"警告: 第 {line_number} 行第 {k + 1} 段音频无法解析 ({e}), 已跳过该段。")
+            continue
+        if fmt_body is None:
+            fmt_body = chunk.fmt_body
+        elif chunk.fmt_body != fmt_body:
+            print(f"警告: 第 {line_number} 行第 {k + 1} 段音频格式与第一段不一致, 已跳过该段。")
+            continue
+        frames.append(chunk.frames)
+    if fmt_body is None:
+        return audio_list[0]
+    data = b''.join(frames)
+    return build_wav_header(fmt_body, len(data)) + data
+
+
+def join_split_lines(results):
+    """
+    将 split_long_lines 拆分后的合成结果按行重新拼接, 产出 (行号, 原文本, WAV二进制数据)
+    """
+    pieces = []
+    for (i, count), text, audio_data in results:
+        if count == 1:
+            yield i, text, audio_data
+            continue
+        pieces.append((text, audio_data))
+        if len(pieces) == count:
+            line = ''.join(piece_text for piece_text, _ in pieces)
+            yield i, line, join_wav_pieces([piece_audio for _, piece_audio in pieces], i + 1)
+            pieces = []
+
+
+def synthesize_batch(api_url, batch_lines, voice_params, cache=None):
+    """
+    合成一个批次, 返回与 batch_lines 一一对应的WAV数据列表
+    - 多行批次以换行拼接后一次请求, 再按行切分音频; 返回的音频无法解析时退回逐行合成
+    """
+    if len(batch_lines) == 1:
+        return [synthesize_line(api_url, batch_lines[0], voice_params, cache)]
+
+    audio_data = synthesize_line(api_url, BATCH_SEPARATOR.join(batch_lines), voice_params, cache)
+    try:
+        return split_batch_audio(audio_data, batch_lines)
+    except WavFormatError:
+        print(f"警告: 合并请求的音频无法解析, 改为逐行合成 {len(batch_lines)} 行。")
+        return [synthesize_line(api_url, line, voice_params, cache) for line in batch_lines]
+
+
+def synthesize_lines_in_order(api_url, lines, voice_params, workers=1, cache=None, executor=None, batch_chars=0, max_request_chars=DEFAULT_MAX_REQUEST_CHARS):
+    """
+    按原始行顺序逐个产出合成结果 (行号, 文本, WAV二进制数据)。
+    - workers 为 1 时保持逐行串行调用。
+    - workers 大于 1 时使用线程池并发合成, 但同一时刻最多只有 workers * 2 个请求在途,
+      未被消费的结果不会无限堆积, 内存占用保持平稳。
+    - 提供 executor 时使用该共享线程池 (多个文件共用同一并发额度), 不再单独创建。
+    - 提供 cache 时, 已缓存的行直接读取本地音频, 不再调用API。
+    - batch_chars 大于 0 时, 连续的短行合并为一次请求 (总字符数不超过 batch_chars), 再按行切分音频。
+    - max_request_chars 大于 0 时, 超过该长度的行按句拆分为多个请求 (可以并发), 音频再按顺序拼接回该行;
+      合并短行时每个请求同样不超过该长度。
+    """
+    if max_request_chars > 0:
+        if batch_chars > 0:
+            batch_chars = min(batch_chars, max_request_chars)
+        items = split_long_lines(enumerate(lines), max_request_chars)
+    else:
+        items = (((i, 1), line) for i, line in enumerate(lines))
+    batches = group_lines_into_batches(items, batch_chars)
+    yield from join_split_lines(_synthesize_batches(api_url, batches, voice_params, workers, cache, executor))
+
+
+def _synthesize_batches(api_url, batches, voice_params, workers, cache, executor):
+    if executor is not None:
+        yield from _synthesize_with_executor(executor, api_url, batches, voice_params, workers * 2, cache)
+        return
+
+    if workers <= 1:
+        for batch in batches:
+            audio_list = synthesize_batch(api_url, [line for _, line in batch], voice_params, cache)
+            for (i, line), audio_data in zip(batch, audio_list):
+                yield i, line, audio_data
+        return
+
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="tts_worker") as own_executor:
+        yield from _synthesize_with_executor(own_executor, api_url, batches, voice_params, workers * 2, cache)
+
+
+def _synthesize_with_executor(executor, api_url, batches, voice_params, max_in_flight, cache):
+    """
+    读取批次与提交请求在单独的线程中进行, 当前生成器按提交顺序取回结果
+    - 同一时刻最多 max_in_flight 个批次在途 (背压), 未被消费的结果不会无限堆积
+    - 输入暂时没有新行时 (如交互式的流式输入), 已完成的结果也能立即交出, 不必等到下一行读入
+    """
+    submitted = queue.Queue()
+    slots = threading.Semaphore(max_in_flight)
+    stopped = threading.Event()
+
+    def feed():
+        try:
+            for batch in batches:
+                slots.acquire()
+                if stopped.is_set():
+                    return
+                future = executor.submit(synthesize_batch, api_url, [line for _, line in batch], voice_params, cache)
+                submitted.put((batch, future))
+                if stopped.is_set():
+                    future.cancel()
+                    return
+        except BaseException as e:
+            submitted.put((None, e))
+            return
+        submitted.put(None)
+
+    threading.Thread(target=feed, name="tts_feeder", daemon=True).start()
+    try:
+        while True:
+            item = submitted.get()
+            if item is None:
+                return
+            batch, future = item
+            if batch is None:
+                # 读取输入时出错, item[1] 为异常对象
+                raise item[1]
+            try:
+                audio_list = future.result()
+            finally:
+                slots.release()
+            for (i, line), audio_data in zip(batch, audio_list):
+                yield i, line, audio_data
+    finally:
+        # 出错或提前退出时停止读取输入, 并取消尚未开始的任务
+        stopped.set()
+        slots.release()
+        while True:
+            try:
+                item = submitted.get_nowait()
+            except queue.Empty:
+                break
+            if item is not None and item[0] is not None:
+                item[1].cancel()
+
+
+def _append_lrc_entries(line, line_start_ms, line_duration_ms, lrc_max_len, lrc_writer, silent_spans=None):
+    """
+    将一行文本分割成LRC短句, 并按可朗读字符数 (及可选的静音检测结果) 为每个短句分配时间戳后写出
+    """
+    with metrics.timed('lrc_split'):
+        lrc_chunks = split_text_for_lrc(line, lrc_max_len)
+        for lrc_chunk, offset in zip(lrc_chunks, compute_chunk_offsets(lrc_chunks, line_duration_ms, silent_spans)):
+            lrc_writer.add(line_start_ms + offset, lrc_chunk.strip())
+
+
+def convert_text_to_audio_file(api_url, lines, voice_params, output_wav_path, output_lrc_path=None, lrc_max_len=None, workers=1, cache=None, resume=False, executor=None, lrc_timing=LRC_TIMING_WEIGHTED, batch_chars=0, output_format=OUTPUT_FORMAT_WAV, line_map=None, max_request_chars=DEFAULT_MAX_REQUEST_CHARS, postprocessor=None):
     """
-    将文本行列表转换为单个WAV文件, 并可选择生成LRC文件。
+    将文本行转换为单个音频文件, 并可选择生成LRC文件。
+    - lines 可以是列表, 也可以是可重复迭代的行来源 (如 TextFileLines); 计算任务指纹与合成各需完整迭代一遍,
+      合成过程中音频、LRC、断点记录与映射表都逐行写出, 内存占用与文本长度无关。
     - 如果不生成LRC，则每行文本调用一次API合成音频。
     - 如果生成LRC，则每行文本也只调用一次API合成音频，然后根据音频总时长为分割后的短句分配时间戳。
+      lrc_timing 为 'weighted' 时按各短句的可朗读字符数加权分配, 为 'silence' 时再用该行音频的静音检测结果校正分界点。
+    - workers 大于 1 时并发合成, 结果仍按原始行顺序写入, 音频与LRC时间轴不受影响。
+    - 提供 cache (SynthesisCache) 时, 合成前先查询磁盘缓存。
+    - 提供 executor 时, API请求提交到该共享线程池。
+    - batch_chars 大于 0 时将连续短行合并请求, 再按行切分音频, 每行的音频与LRC仍单独计算。
+    - max_request_chars 大于 0 时超长的行按句拆分为多个请求, 音频拼接回该行后再写入, LRC仍按整行计算。
+    - 提供 postprocessor (PcmPostProcessor) 时每行音频先经过后处理再写入, 时长与LRC时间轴按处理后的音频计算。
+    - 合成过程中持续写入断点记录, 中途失败时保留已完成的部分; resume 为 True 时只合成缺失的行。
+    - output_format 为 flac/mp3/opus 时边合成边编码, 这些格式不支持断点续写, 失败后需重新合成。
+    - 提供 line_map (LineMap) 时, 完成后写出行级映射表, 供之后增量更新使用 (仅WAV格式)。
     """
-    temp_dir = tempfile.mkdtemp(prefix="tts_cli_")
-    print(f"创建临时缓存目录: {temp_dir}")
-    
-    main_audio_paths = []
-    
-    try:
-        if not output_lrc_path:
-            # --- 逻辑分支1: 不生成LRC ---
-            print("模式: 仅合成音频")
-            for i, line in enumerate(lines):
-                audio_data = text_to_speech(api_url, line, voice_params)
-                chunk_path = os.path.join(temp_dir, f"main_audio_{i}.wav")
-                with open(chunk_path, 'wb') as f:
-                    f.write(audio_data)
-                main_audio_paths.append(chunk_path)
+    if output_lrc_path:
+        print(f"模式: 合成音频并生成LRC字幕 (每句最大 {lrc_max_len} 字符)")
+    else:
+        print("模式: 仅合成音频")
+
+    writer = create_stream_writer(output_format, output_wav_path, keep_partial=True)
+    checkpoint = None
+    if writer.supports_resume:
+        fingerprint = compute_job_fingerprint(api_url, lines, voice_params, lrc_max_len if output_lrc_path else None,
+                                              postprocessor)
+        checkpoint = JobCheckpoint(output_wav_path, fingerprint)
+
+    start_line = 0
+    if resume and checkpoint is None:
+        print(f"提示: {output_format} 格式不支持断点续写, 将从头开始合成。")
+    elif resume:
+        if checkpoint.load() and writer.resume(checkpoint.data_size):
+            start_line = checkpoint.completed_lines
+            print(f"检测到断点记录, 已完成 {start_line}/{len(lines)} 行, 从第 {start_line + 1} 行继续。")
         else:
-            # --- 逻辑分支2: 生成LRC ---
-            print(f"模式: 合成音频并生成LRC字幕 (每句最大 {lrc_max_len} 字符)")
-            lrc_timestamps = []
-            lrc_texts = []
-            total_duration_ms = 0
-
-            for i, line in enumerate(lines):
-                # 步骤1: 合成完整的单行音频，用于最终的WAV文件和时长计算
-                print(f"合成主音频 (第 {i+1}/{len(lines)} 行)...")
-                main_audio_data = text_to_speech(api_url, line, voice_params)
-                main_chunk_path = os.path.join(temp_dir, f"main_audio_{i}.wav")
-                with open(main_chunk_path, 'wb') as f:
-                    f.write(main_audio_data)
-                main_audio_paths.append(main_chunk_path)
-
-                # 步骤2: 计算该完整音频行的总时长
+            checkpoint.reset()
+            print("未找到与当前任务匹配的断点记录, 从头开始合成。")
+    if checkpoint is not None:
+        checkpoint.start()
+
+    lrc_writer = LrcWriter(output_lrc_path) if output_lrc_path else None
+    if line_map is not None:
+        line_map.start()
+    if start_line and (lrc_writer is not None or line_map is not None):
+        # 按断点记录重建已完成部分的LRC与映射表, 记录与文本行都逐条读取
+        previous_end = 0
+        for record, line in zip(checkpoint.iter_records(), lines):
+            if lrc_writer is not None:
+                _append_lrc_entries(line, record['start'], record['ms'], lrc_max_len, lrc_writer, record.get('sil'))
+            if line_map is not None:
+                line_map.record(line, record['end'] - previous_end, record['ms'], record.get('sil'))
+            previous_end = record['end']
+
+    # 各行音频按顺序直接追加到输出文件, 不再为每行写入临时文件
+    progress.add_total(len(lines) - start_line)
+    try:
+        with writer:
+            remaining = itertools.islice(lines, start_line, None)
+            for i, line, audio_data in synthesize_lines_in_order(api_url, remaining, voice_params, workers, cache, executor, batch_chars, max_request_chars):
+                i += start_line
+                line_start_ms = writer.duration_ms
+                line_start_size = writer.data_size
+
+                # 步骤1: 解析音频块并写入输出文件, 时长以实际写入的帧数计算
                 line_duration_ms = 0
-                try:
-                    with wave.open(io.BytesIO(main_audio_data), 'rb') as wf:
-                        frames = wf.getnframes()
-                        rate = wf.getframerate()
-                        line_duration_ms = int((frames / float(rate)) * 1000)
-                except wave.Error:
-                    print(f"警告: 无法读取主音频行 '{line[:20]}...' 的时长, 该行LRC时间轴可能不准。")
-
-                # 步骤3: 将该行文本分割成LRC短句
-                lrc_chunks = split_text_for_lrc(line, lrc_max_len)
-                
-                print(f"为第 {i+1} 行的 {len(lrc_chunks)} 个LRC短句分配时间戳...")
-                
-                # 步骤4: 将总时长均分给每个短句
-                if lrc_chunks:
-                    # 防止除以零错误
-                    duration_per_chunk = line_duration_ms / len(lrc_chunks) if len(lrc_chunks) > 0 else 0
-                    for chunk_index, lrc_chunk in enumerate(lrc_chunks):
-                        # 计算当前短句的开始时间
-                        chunk_start_time = total_duration_ms + int(chunk_index * duration_per_chunk)
-                        
-                        # 记录LRC数据
-                        lrc_timestamps.append(chunk_start_time)
-                        lrc_texts.append(lrc_chunk.strip())
-                
-                # 累加总时长，为下一行做准备
-                total_duration_ms += line_duration_ms
-
-            # 步骤5: 生成LRC文件内容
-            lrc_content = generate_lrc_content(lrc_timestamps, lrc_texts)
-            with open(output_lrc_path, 'w', encoding='utf-8') as f:
-                f.write(lrc_content)
-            print(f"LRC歌词文件已保存: {output_lrc_path}")
-
-        # --- 通用逻辑: 合并主音频文件 ---
-        if not main_audio_paths:
-             print("警告: 没有生成任何音频数据, 跳过文件合成。")
-             return
-
-        print(f"正在合并 {len(main_audio_paths)} 个主音频块到 {os.path.basename(output_wav_path)}...")
-        combine_wav_files(main_audio_paths, output_wav_path)
-        print(f"音频文件已保存: {output_wav_path}")
+                silent_spans = None
+                with metrics.timed('audio_write'):
+                    try:
+                        chunk = parse_wav(audio_data)
+                        if postprocessor is not None:
+                            chunk = postprocessor.process(chunk, line)
+                        if writer.append(chunk):
+                            line_duration_ms = writer.duration_ms - line_start_ms
+                            if output_lrc_path and lrc_timing == LRC_TIMING_SILENCE:
+                                silent_spans = find_silent_spans(chunk)
+                        else:
+                            print(f"警告: 第 {i+1} 行音频格式与首个音频块不一致, 已跳过。")
+                    except WavFormatError as e:
+                        print(f"警告: 无法解析第 {i+1} 行 '{line[:20]}...' 的音频 ({e}), 已跳过。")
 
-    finally:
-        print(f"清理临时缓存目录: {temp_dir}")
-        shutil.rmtree(temp_dir)
+                # 步骤2: 音频落盘后再记录断点
+                if checkpoint is not None:
+                    writer.flush()
+                    checkpoint.record(i, writer.data_size, line_start_ms, line_duration_ms, silent_spans)
+                if line_map is not None:
+                    line_map.record(line, writer.data_size - line_start_size, line_duration_ms, silent_spans)
+
+                if lrc_writer is not None:
+                    _append_lrc_entries(line, line_start_ms, line_duration_ms, lrc_max_len, lrc_writer, silent_spans)
+                progress.advance()
+
+            if writer.data_size == 0:
+                print("警告: 没有生成任何音频数据, 跳过文件合成。")
+                writer.abort()
+                if checkpoint is not None:
+                    checkpoint.remove()
+                if lrc_writer is not None:
+                    lrc_writer.abort()
+                if line_map is not None:
+                    line_map.discard()
+                return
+
+            if lrc_writer is not None:
+                with metrics.timed('lrc_write'):
+                    lrc_writer.close()
+                print(f"LRC歌词文件已保存: {output_lrc_path}")
+    except BaseException:
+        if lrc_writer is not None:
+            lrc_writer.abort()
+        if line_map is not None:
+            line_map.discard()
+        if checkpoint is not None:
+            checkpoint.close()
+            if checkpoint.completed_lines:
+                print(f"已保存断点: 完成 {checkpoint.completed_lines}/{len(lines)} 行, 使用 --resume 重新运行可继续合成。")
+        raise
+
+    if line_map is not None:
+        line_map.commit()
+    if checkpoint is not None:
+        checkpoint.remove()
+    print(f"音频文件已保存: {output_wav_path}")
+    metrics.inc('audio_pcm_bytes_written', writer.data_size)
+    if output_format != OUTPUT_FORMAT_WAV and writer.encode_seconds > 0:
+        pcm_mb = writer.data_size / 1024 / 1024
+        print(f"{output_format.upper()} 编码耗时 {writer.encode_seconds:.2f} 秒 "
+              f"({pcm_mb / writer.encode_seconds:.1f} MB/s PCM, {writer.duration_ms / 1000 / writer.encode_seconds:.1f} 倍实时)")
+
+
+def update_audio_file_incrementally(api_url, lines, voice_params, output_wav_path, line_map, output_lrc_path=None, lrc_max_len=None, workers=1, cache=None, executor=None, lrc_timing=LRC_TIMING_WEIGHTED, batch_chars=0, max_request_chars=DEFAULT_MAX_REQUEST_CHARS, postprocessor=None):
+    """
+    根据行级映射表增量更新已有的WAV文件。
+    - 将新文本与映射表中的行哈希逐行比对, 未变化的行直接从旧文件复制音频, 只合成新增或修改的行。
+    - 新文件写完后替换旧文件, LRC按新的时间轴完整重新生成, 映射表同步更新。
+    :return: True 表示已完成更新, False 表示旧输出文件缺失或与映射表不一致 (需要完整合成)
+    """
+    try:
+        old_file = open(output_wav_path, 'rb')
+    except OSError:
+        return False
+    with old_file:
+        try:
+            old_chunk = parse_wav(old_file.read(4096))
+        except WavFormatError:
+            return False
+        header_size = len(build_wav_header(old_chunk.fmt_body, 0))
+        if os.fstat(old_file.fileno()).st_size - header_size not in (line_map.data_size, line_map.data_size + 1):
+            return False
+
+        old_offsets = []
+        offset = header_size
+        for entry in line_map.entries:
+            old_offsets.append(offset)
+            offset += entry['len']
+
+        # 以行哈希为单位比对新旧文本, 得到每个新行可复用的旧行序号
+        new_hashes = [hash_line(line) for line in lines]
+        old_hashes = [entry['h'] for entry in line_map.entries]
+        reuse = [None] * len(new_hashes)
+        matcher = difflib.SequenceMatcher(None, old_hashes, new_hashes, autojunk=False)
+        for tag, old_start, old_end, new_start, new_end in matcher.get_opcodes():
+            if tag == 'equal':
+                for k in range(new_end - new_start):
+                    if old_hashes[old_start + k] is not None:
+                        reuse[new_start + k] = old_start + k
+        changed = [i for i, old_index in enumerate(reuse) if old_index is None]
+        print(f"增量更新: 共 {len(new_hashes)} 行, 复用 {len(new_hashes) - len(changed)} 行, 需要合成 {len(changed)} 行。")
+
+        changed_lines = (line for i, line in enumerate(lines) if reuse[i] is None)
+        synthesized = synthesize_lines_in_order(api_url, changed_lines, voice_params,
+                                                workers, cache, executor, batch_chars, max_request_chars)
+        progress.add_total(len(new_hashes))
+        lrc_writer = LrcWriter(output_lrc_path) if output_lrc_path else None
+        line_map.start()
+        try:
+            with WavStreamWriter(output_wav_path) as writer:
+                for i, line in enumerate(lines):
+                    line_start_ms = writer.duration_ms
+                    line_start_size = writer.data_size
+                    line_duration_ms = 0
+                    silent_spans = None
+                    old_index = reuse[i]
+                    if old_index is not None:
+                        with metrics.timed('audio_write'):
+                            entry = line_map.entries[old_index]
+                            old_file.seek(old_offsets[old_index])
+                            chunk = WavChunk(old_chunk.fmt_body, old_file.read(entry['len']))
+                            if writer.append(chunk):
+                                line_duration_ms = writer.duration_ms - line_start_ms
+                                silent_spans = entry.get('sil')
+                                if silent_spans is None and output_lrc_path and lrc_timing == LRC_TIMING_SILENCE:
+                                    silent_spans = find_silent_spans(chunk)
+                    else:
+                        _, _, audio_data = next(synthesized)
+                        with metrics.timed('audio_write'):
+                            try:
+                                chunk = parse_wav(audio_data)
+                                if postprocessor is not None:
+                                    chunk = postprocessor.process(chunk, line)
+                                if writer.append(chunk):
+                                    line_duration_ms = writer.duration_ms - line_start_ms
+                                    if output_lrc_path and lrc_timing == LRC_TIMING_SILENCE:
+                                        silent_spans = find_silent_spans(chunk)
+                                else:
+                                    print(f"警告: 第 {i+1} 行音频格式与首个音频块不一致, 已跳过。")
+                            except WavFormatError as e:
+                                print(f"警告: 无法解析第 {i+1} 行 '{line[:20]}...' 的音频 ({e}), 已跳过。")
+
+                    line_map.record(line, writer.data_size - line_start_size, line_duration_ms, silent_spans)
+                    if lrc_writer is not None:
+                        _append_lrc_entries(line, line_start_ms, line_duration_ms, lrc_max_len, lrc_writer, silent_spans)
+                    progress.advance()
+
+                if writer.data_size == 0:
+                    print("警告: 没有生成任何音频数据, 跳过文件合成。")
+                    writer.abort()
+                    if lrc_writer is not None:
+                        lrc_writer.abort()
+                    line_map.discard()
+                    return True
+                # 旧文件需要在新文件替换它之前关闭
+                old_file.close()
+        except BaseException:
+            if lrc_writer is not None:
+                lrc_writer.abort()
+            line_map.discard()
+            raise
+
+    if lrc_writer is not None:
+        with metrics.timed('lrc_write'):
+            lrc_writer.close()
+        print(f"LRC歌词文件已保存: {output_lrc_path}")
+    line_map.commit()
+    print(f"音频文件已更新: {output_wav_path}")
+    metrics.inc('audio_pcm_bytes_written', writer.data_size)
+    return True
+
+
+def convert_text_to_segmented_files(api_url, lines, voice_params, output_dir, base_name, policy, lrc_max_len=None, workers=1, cache=None, executor=None, lrc_timing=LRC_TIMING_WEIGHTED, batch_chars=0, output_format=OUTPUT_FORMAT_WAV, max_request_chars=DEFAULT_MAX_REQUEST_CHARS, postprocessor=None):
+    """
+    将文本行转换为多个分段音频文件, 并生成 <base_name>.m3u 播放列表。
+    - 按 policy (SegmentPolicy) 在章节标题行之前、或分段达到时长/大小上限时开始新的分段。
+    - lrc_max_len 不为 None 时为每个分段生成单独的LRC文件, 时间戳相对于该分段的开头。
+    - 分段输出不使用断点记录, 中断后需重新合成。
+    :return: 生成的分段数
+    """
+    output = SegmentedOutput(output_dir, base_name, policy, output_format, with_lrc=lrc_max_len is not None)
+    print(f"模式: 分段输出{'并生成LRC字幕' if lrc_max_len is not None else ''}")
+    progress.add_total(len(lines))
+    try:
+        for i, line, audio_data in synthesize_lines_in_order(api_url, lines, voice_params, workers, cache, executor, batch_chars, max_request_chars):
+            try:
+                chunk = parse_wav(audio_data)
+                if postprocessor is not None:
+                    chunk = postprocessor.process(chunk, line)
+            except WavFormatError as e:
+                print(f"警告: 无法解析第 {i+1} 行 '{line[:20]}...' 的音频 ({e}), 已跳过。")
+                chunk = None
+            output.prepare_line(line, chunk)
+            line_start_ms = output.duration_ms
+
+            line_duration_ms = 0
+            silent_spans = None
+            if chunk is not None:
+                with metrics.timed('audio_write'):
+                    appended = output.append(chunk)
+                if appended:
+                    line_duration_ms = output.duration_ms - line_start_ms
+                    metrics.inc('audio_pcm_bytes_written', len(chunk.frames))
+                    if lrc_max_len is not None and lrc_timing == LRC_TIMING_SILENCE:
+                        silent_spans = find_silent_spans(chunk)
+                else:
+                    print(f"警告: 第 {i+1} 行音频格式与首个音频块不一致, 已跳过。")
+
+            if lrc_max_len is not None:
+                _append_lrc_entries(line, line_start_ms, line_duration_ms, lrc_max_len, output.lrc_writer, silent_spans)
+            progress.advance()
+        count = output.close()
+    except BaseException:
+        output.abort()
+        raise
+
+    if count == 0:
+        print("警告: 没有生成任何音频数据, 跳过文件合成。")
+        return count
+    print(f"共生成 {count} 个分段, 播放列表已保存: {output.index_path}")
+    if output.encode_seconds > 0 and output_format != OUTPUT_FORMAT_WAV:
+        print(f"{output_format.upper()} 编码共耗时 {output.encode_seconds:.2f} 秒")
+    return count
 
 
 def combine_wav_files(input_files, output_file):
@@ -101,30 +547,19 @@ def combine_wav_files(input_files, output_file):
     """
     if not input_files:
         return
-        
-    outfile = None
+
     try:
-        # 使用第一个有效的WAV文件作为输出文件的参数模板
-        params = None
-        for file_path in input_files:
-            try:
-                with wave.open(file_path, 'rb') as infile:
-                    params = infile.getparams()
-                    break
-            except (wave.Error, EOFError):
-                print(f"警告: 读取音频块 {os.path.basename(file_path)} 参数失败, 已跳过。")
-                continue # 如果文件损坏，尝试下一个
-        
-        if params is None:
-            raise RuntimeError("所有音频块均无效，无法合并。")
-
-        with wave.open(output_file, 'wb') as outfile:
-            outfile.setparams(params)
+        with WavStreamWriter(output_file) as writer:
             for file_path in input_files:
                 try:
-                    with wave.open(file_path, 'rb') as infile:
-                        outfile.writeframes(infile.readframes(infile.getnframes()))
-                except (wave.Error, EOFError):
-                     print(f"警告: 读取音频块 {os.path.basename(file_path)} 数据失败, 已跳过。")
+                    with open(file_path, 'rb') as infile:
+                        chunk = parse_wav(infile.read())
+                except (OSError, WavFormatError):
+                    print(f"警告: 读取音频块 {os.path.basename(file_path)} 数据失败, 已跳过。")
+                    continue
+                if not writer.append(chunk):
+                    print(f"警告: 音频块 {os.path.basename(file_path)} 格式不一致, 已跳过。")
+            if writer.data_size == 0:
+                raise RuntimeError("所有音频块均无效，无法合并。")
     except Exception as e:
         raise RuntimeError(f"合并WAV文件失败: {e}")
@@ -1,62 +1,175 @@
 import re
-import requests
 import os
 import string
-import locale
+from api import get_session
+from charset import detect_file_encoding, convert_file_encoding
 
-def convert_file_to_utf8(file_path):
+def convert_file_to_utf8(file_path, encoding=None):
     """
-    尝试用常见编码读取文件，然后用UTF-8编码覆盖保存。
+    用检测到的 (或指定的) 编码读取文件，然后用UTF-8编码覆盖保存。
     :param file_path: 文件路径
+    :param encoding: 原文件编码, 为 None 时自动检测
     :return: True表示转换成功, False表示失败
     """
-    # 备选编码列表，优先使用系统默认编码，然后是中文场景常用编码
-    encodings_to_try = [locale.getpreferredencoding(False), 'gbk', 'big5','utf16']
-    
-    content = None
-    original_encoding = None
-
-    # 尝试用备选编码读取文件内容
-    for encoding in encodings_to_try:
-        try:
-            with open(file_path, 'r', encoding=encoding) as f:
-                content = f.read()
-            original_encoding = encoding
-            print(f"成功使用 '{encoding}' 编码读取文件: {os.path.basename(file_path)}")
-            break # 读取成功，跳出循环
-        except (UnicodeDecodeError, TypeError):
-            continue # 编码不匹配，尝试下一个
-    
-    # 如果所有备选编码都失败
-    if content is None:
-        print(f"错误: 无法使用任何备选编码 ({', '.join(encodings_to_try)}) 解码文件 {os.path.basename(file_path)}。")
-        return False
-        
-    # 用UTF-8编码写回文件
+    if encoding is None:
+        encoding, confidence = detect_file_encoding(file_path)
+        # 所有候选编码都无法完整解码
+        if encoding is None:
+            print(f"错误: 无法使用任何备选编码解码文件 {os.path.basename(file_path)}。")
+            return False
+        print(f"检测到文件 {os.path.basename(file_path)} 的编码为 '{encoding}' (可信度 {confidence:.0%})")
+
+    # 流式转换, 写入临时文件后替换原文件
     try:
-        with open(file_path, 'w', encoding='utf-8') as f:
-            f.write(content)
-        print(f"文件已成功从 '{original_encoding}' 转换为 UTF-8。")
+        convert_file_encoding(file_path, encoding)
+        print(f"文件已成功从 '{encoding}' 转换为 UTF-8。")
         return True
     except Exception as e:
-        print(f"错误: 写入UTF-8文件时失败: {e}")
+        print(f"错误: 转换为UTF-8文件时失败: {e}")
         return False
 
 
+# 标点符号集, LRC分句与计时时不计入字符数
+PUNCTUATION = string.punctuation + "，。！？；：、…—·《》“”‘’"
+
+REGEX_METACHARACTERS = set('.^$*+?{}[]\\|()')
+
+
+def _is_literal(pattern):
+    return not any(ch in REGEX_METACHARACTERS for ch in pattern)
+
+
+class BlacklistMatcher:
+    """
+    预编译的黑名单匹配器, 在加载黑名单时构建一次, 之后每行直接复用
+    - 纯文本 (不含正则元字符) 的规则放入字典树, 按最左最长原则匹配, 耗时与规则数量无关
+    - 其余规则合并为一个预编译的正则表达式 (规则之间冲突无法合并时, 如重复的分组名, 改为逐条预编译)
+    - 无效的正则规则在构建时剔除并给出一次警告; 规则以合并时的 (?:...) 形式检查,
+      如 (?i)word 这类单独有效、但全局标志不在表达式开头就无效的规则同样被剔除
+    """
+
+    def __init__(self, patterns):
+        self.literal_count = 0
+        self.invalid_patterns = []
+        self._trie = {}
+        self._regexes = []
+
+        regex_patterns = []
+        for pattern in patterns:
+            # "词1|词2" 这类仅由纯文本组成的多选结构同样拆分为纯文本规则
+            alternatives = pattern.split('|')
+            if all(alt and _is_literal(alt) for alt in alternatives):
+                for alt in alternatives:
+                    self._add_literal(alt)
+                continue
+            try:
+                re.compile(f"(?:{pattern})")
+            except re.error as e:
+                print(f"警告: 黑名单正则表达式 '{pattern}' 无效: {e}。该规则将被忽略。")
+                self.invalid_patterns.append(pattern)
+                continue
+            regex_patterns.append(pattern)
+
+        if regex_patterns:
+            try:
+                self._regexes = [re.compile("|".join(f"(?:{p})" for p in regex_patterns))]
+            except re.error:
+                self._regexes = [re.compile(f"(?:{p})") for p in regex_patterns]
+        self.regex_count = len(regex_patterns)
+
+    def __len__(self):
+        return self.literal_count + self.regex_count
+
+    def _add_literal(self, word):
+        node = self._trie
+        for ch in word:
+            node = node.setdefault(ch, {})
+        if None not in node:
+            node[None] = True
+            self.literal_count += 1
+
+    def _literal_spans(self, text):
+        trie = self._trie
+        spans = []
+        i = 0
+        n = len(text)
+        while i < n:
+            node = trie.get(text[i])
+            if node is None:
+                i += 1
+                continue
+            end = i + 1 if None in node else -1
+            j = i + 1
+            while j < n:
+                node = node.get(text[j])
+                if node is None:
+                    break
+                j += 1
+                if None in node:
+                    end = j
+            if end > 0:
+                spans.append((i, end))
+                i = end
+            else:
+                i += 1
+        return spans
+
+    def find_spans(self, text):
+        """
+        返回文本中所有互不重叠的匹配区间 [(start, end), ...], 按位置排序
+        """
+        spans = self._literal_spans(text) if self.literal_count else []
+        for regex in self._regexes:
+            regex_spans = [m.span() for m in regex.finditer(text) if m.end() > m.start()]
+            if spans:
+                spans = self._merge_spans(spans, regex_spans)
+            else:
+                spans = regex_spans
+        return spans
+
+    @staticmethod
+    def _merge_spans(a, b):
+        merged = []
+        last_end = 0
+        for start, end in sorted(a + b, key=lambda span: (span[0], span[0] - span[1])):
+            if start >= last_end:
+                merged.append((start, end))
+                last_end = end
+        return merged
+
+    def apply(self, text):
+        """
+        将匹配的部分用 `[[...]]` 包裹
+        """
+        spans = self.find_spans(text)
+        if not spans:
+            return text
+        parts = []
+        pos = 0
+        for start, end in spans:
+            parts.append(text[pos:start])
+            parts.append("[[")
+            parts.append(text[start:end])
+            parts.append("]]")
+            pos = end
+        parts.append(text[pos:])
+        return "".join(parts)
+
+
 def load_blacklist_patterns(source):
     """
-    从文件、URL或字符串加载黑名单规则
+    从文件、URL或字符串加载黑名单规则, 并编译为匹配器
     :param source: 来源 (None, 文件路径, URL, 或带'|'的字符串)
-    :return: 正则表达式模式列表
+    :return: BlacklistMatcher, 没有可用规则时返回 None
     """
     if not source:
-        return []
+        return None
 
     patterns = []
     try:
         if source.startswith(('http://', 'https://')):
             print(f"正在从URL加载黑名单: {source}")
-            response = requests.get(source)
+            response = get_session().get(source, timeout=60)
             response.raise_for_status()
             lines = response.text.splitlines()
             patterns = [line.strip() for line in lines if line.strip()]
@@ -71,39 +184,25 @@ def load_blacklist_patterns(source):
             patterns = [source]
     except UnicodeDecodeError:
         print(f"警告: 黑名单文件 {source} 不是UTF-8编码，请转换后重试。将不使用黑名单。")
-        return []
+        return None
     except Exception as e:
         print(f"警告: 加载黑名单失败: {e}。将不使用黑名单。")
-        return []
-    
-    print(f"成功加载 {len(patterns)} 条黑名单规则。")
-    return patterns
+        return None
 
-def apply_blacklist(text, patterns):
+    matcher = BlacklistMatcher(patterns)
+    print(f"成功加载 {len(matcher)} 条黑名单规则 (纯文本 {matcher.literal_count} 条, 正则 {matcher.regex_count} 条)。")
+    return matcher if len(matcher) else None
+
+def apply_blacklist(text, matcher):
     """
     将文本中匹配黑名单模式的部分用 `[[...]]` 包裹
     :param text: 原始文本
-    :param patterns: 正则表达式模式列表
+    :param matcher: load_blacklist_patterns 返回的 BlacklistMatcher (或 None)
     :return: 处理后的文本
     """
-    if not patterns:
+    if not matcher:
         return text
-        
-    # 将多个模式合并为一个，提高效率
-    combined_pattern = "|".join(patterns)
-    
-    try:
-        return re.sub(f"({combined_pattern})", r"[[\1]]", text)
-    except re.error as e:
-        print(f"警告: 黑名单正则表达式错误: {e}。该规则将被忽略。")
-        # 如果组合模式出错，可以尝试逐个应用，但这会降低性能
-        processed_text = text
-        for pattern in patterns:
-            try:
-                processed_text = re.sub(f"({pattern})", r"[[\1]]", processed_text)
-            except re.error:
-                continue # 跳过错误的单个模式
-        return processed_text
+    return matcher.apply(text)
 
 
 def split_text_for_lrc(text, max_len):
@@ -111,9 +210,6 @@ def split_text_for_lrc(text, max_len):
     为生成LRC将长文本切分为短句, 同时保持 [[...]] 标记的完整性。
     每行最多 max_len 个非标点符号字符。
     """
-    # 定义标点符号集
-    punctuation = string.punctuation + "，。！？；：、…—·《》“”‘’"
-    
     # 正则表达式，用于分割文本，同时捕获标记作为分隔符
     # 这会将文本分割成一个列表，其中普通文本和标记交替出现
     segments = re.split(r'(\[\[.*?\]\])', text)
@@ -133,7 +229,7 @@ def split_text_for_lrc(text, max_len):
         for char in segment:
             current_chunk += char
             # 仅当字符不是标点或空白时，才增加计数
-            if char not in punctuation and not char.isspace():
+            if char not in PUNCTUATION and not char.isspace():
                 char_count += 1
             
             # 当达到最大长度时，完成当前块的分割
@@ -149,3 +245,65 @@ def split_text_for_lrc(text, max_len):
 
     # 如果处理后没有任何块（例如，输入为空），则返回原始文本以避免错误
     return final_chunks if final_chunks else [text]
+
+
+# 合成请求拆分时的断句位置: 句末标点 (连同其后的引号、括号) 优先, 其次是句内停顿标点
+SENTENCE_END_PATTERN = re.compile(r'.*?(?:[。！？!?；;…\n]+[”’」』）)"\']*|$)', re.S)
+CLAUSE_END_PATTERN = re.compile(r'.*?(?:[，,、：:]+|$)', re.S)
+SYNTHESIS_MARKER_PATTERN = re.compile(r'\[\[.*?\]\]')
+
+
+def _pattern_spans(pattern, text, start, end):
+    spans = []
+    for match in pattern.finditer(text, start, end):
+        if match.end() > match.start():
+            spans.append((match.start(), match.end()))
+    return spans
+
+
+def split_text_for_synthesis(text, max_chars):
+    """
+    将过长的一行拆分为多段分别请求合成, 每段不超过 max_chars 个字符 (含标记与空白)。
+    - 优先在句末标点处断开, 单句过长时在逗号等句内标点处断开, 仍然过长时才按长度硬切
+    - [[...]] 标记不会被拆开; 唯一的例外是单个标记本身超过 max_chars, 此时该标记独占一段
+    - 句末单独的标记 (如 [[PAUSE:n]]) 尽量跟随前一句, 前一段已满时与前一句一起另起一段
+    - 各段首尾相接即为原文, 不丢失任何字符
+    :return: 文本段列表, 不需要拆分时只包含原文
+    """
+    if max_chars <= 0 or len(text) <= max_chars:
+        return [text]
+
+    # 标记内的字符替换为非标点, 断句时不会在标记内部断开
+    marker_spans = [m.span() for m in SYNTHESIS_MARKER_PATTERN.finditer(text)]
+    masked = SYNTHESIS_MARKER_PATTERN.sub(lambda m: '\0' * len(m.group()), text)
+
+    units = []
+    for start, end in _pattern_spans(SENTENCE_END_PATTERN, masked, 0, len(masked)):
+        if end - start <= max_chars:
+            units.append((start, end))
+            continue
+        for clause_start, clause_end in _pattern_spans(CLAUSE_END_PATTERN, masked, start, end):
+            while clause_end - clause_start > max_chars:
+                cut = clause_start + max_chars
+                for marker_start, marker_end in marker_spans:
+                    if marker_start < cut < marker_end:
+                        cut = marker_start if marker_start > clause_start else marker_end
+                        break
+                units.append((clause_start, cut))
+                clause_start = cut
+            if clause_end > clause_start:
+                units.append((clause_start, clause_end))
+
+    # 相邻的句子合并到同一段, 直到再加一句就会超长。只有标记或空白的部分放不进前一段时,
+    # 尽量带上前一段的最后一句另起一段, 避免单独请求一个标记
+    groups = [[units[0]]]
+    for start, end in units[1:]:
+        group = groups[-1]
+        if end - group[0][0] <= max_chars:
+            group.append((start, end))
+        elif (len(group) > 1 and end - group[-1][0] <= max_chars
+              and not masked[start:end].strip('\0').strip()):
+            groups.append([group.pop(), (start, end)])
+        else:
+            groups.append([(start, end)])
+    return [text[group[0][0]:group[-1][1]] for group in groups]
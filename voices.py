@@ -0,0 +1,204 @@
+import os
+import json
+import time
+import difflib
+import hashlib
+import threading
+from api import get_voices
+
+VOICE_CATALOG_VERSION = 1
+DEFAULT_VOICE_CATALOG_TTL = 24 * 3600   # 本地声音列表缓存的有效期 (秒)
+DEFAULT_VOICE_CATALOG_DIR = os.path.join(os.path.expanduser('~'), '.cache', 'baitts')
+
+_catalog_config = {
+    'ttl': DEFAULT_VOICE_CATALOG_TTL,
+    'cache_dir': DEFAULT_VOICE_CATALOG_DIR,
+}
+# 进程内已加载的声音列表 {api_url: (加载时间, VoiceCatalog)}, 同一进程内的多个文件/任务不再重复请求
+_loaded_catalogs = {}
+_loaded_catalogs_lock = threading.Lock()
+
+
+def configure_voice_catalog(ttl=None, cache_dir=None):
+    """
+    配置声音列表缓存
+    :param ttl: 缓存有效期 (秒), 0 表示每次都重新获取
+    :param cache_dir: 缓存文件所在目录
+    """
+    if ttl is not None:
+        _catalog_config['ttl'] = ttl
+    if cache_dir is not None:
+        _catalog_config['cache_dir'] = cache_dir
+    with _loaded_catalogs_lock:
+        _loaded_catalogs.clear()
+
+
+def _index_key(value):
+    return str(value).strip().lower() if value is not None else ''
+
+
+class VoiceCatalog:
+    """
+    声音列表及其索引 (按 ID、语言、性别、类型), 查询时不再遍历整个列表
+    """
+
+    def __init__(self, voices):
+        self.voices = voices
+        self.by_id = {}
+        self.by_locale = {}
+        self.by_gender = {}
+        self.by_type = {}
+        for voice in voices:
+            if voice.get('id') is not None:
+                self.by_id.setdefault(str(voice['id']), voice)
+            self.by_locale.setdefault(_index_key(voice.get('locale')), []).append(voice)
+            self.by_gender.setdefault(_index_key(voice.get('gender')), []).append(voice)
+            self.by_type.setdefault(_index_key(voice.get('type')), []).append(voice)
+
+    @classmethod
+    def from_response(cls, data):
+        """
+        由 /voices 接口返回的JSON构建
+        :raises: ValueError 如果返回格式不正确
+        """
+        if not isinstance(data, dict) or not data.get("success") or 'catalog' not in (data.get('data') or {}):
+            raise ValueError("API返回的声音列表格式不正确")
+        voices = []
+        for key in data['data']['catalog']:
+            voices.extend(data['data']['catalog'][key])
+        return cls(voices)
+
+    def __len__(self):
+        return len(self.voices)
+
+    def get(self, voice_id):
+        return self.by_id.get(str(voice_id))
+
+    def query(self, locale=None, gender=None, voice_type=None):
+        """
+        按条件筛选声音, 条件不区分大小写; locale 也可以只写语言部分 (如 zh 匹配 zh-CN、zh-TW)
+        """
+        candidates = None
+        if locale:
+            key = _index_key(locale)
+            candidates = [voice for index_key, voices in self.by_locale.items()
+                          if index_key == key or index_key.startswith(key + '-') for voice in voices]
+        for index, value in ((self.by_gender, gender), (self.by_type, voice_type)):
+            if not value:
+                continue
+            matched = index.get(_index_key(value), [])
+            if candidates is None:
+                candidates = matched
+            else:
+                matched_ids = set(map(id, matched))
+                candidates = [voice for voice in candidates if id(voice) in matched_ids]
+        return list(self.voices) if candidates is None else candidates
+
+    def suggest(self, voice_id, limit=3):
+        """
+        返回与给定ID最相近的若干声音ID (用于提示拼写错误)
+        """
+        lowered = {key.lower(): key for key in self.by_id}
+        matches = difflib.get_close_matches(str(voice_id).lower(), list(lowered), n=limit, cutoff=0.6)
+        return [lowered[match] for match in matches]
+
+
+def _catalog_cache_path(api_url):
+    digest = hashlib.sha256(api_url.encode('utf-8')).hexdigest()[:16]
+    return os.path.join(_catalog_config['cache_dir'], f"voices_{digest}.json")
+
+
+def _read_cached_catalog(api_url):
+    """
+    读取本地缓存的声音列表
+    :return: (获取时间, 原始JSON), 缓存不存在或无效时返回 (None, None)
+    """
+    try:
+        with open(_catalog_cache_path(api_url), 'r', encoding='utf-8') as f:
+            cached = json.load(f)
+        if cached.get('v') != VOICE_CATALOG_VERSION or cached.get('api') != api_url:
+            return None, None
+        return cached['fetched_at'], cached['data']
+    except (OSError, ValueError, KeyError, AttributeError):
+        return None, None
+
+
+def _write_cached_catalog(api_url, data):
+    path = _catalog_cache_path(api_url)
+    temp_path = path + '.part'
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            json.dump({'v': VOICE_CATALOG_VERSION, 'api': api_url, 'fetched_at': time.time(), 'data': data},
+                      f, ensure_ascii=False)
+        os.replace(temp_path, path)
+    except OSError as e:
+        print(f"警告: 保存声音列表缓存失败: {e}")
+
+
+def load_voice_catalog(api_url, refresh=False):
+    """
+    获取声音列表: 依次使用进程内缓存、未过期的本地缓存文件, 都不可用时才请求 /voices 接口并写回缓存
+    - refresh 为 True 时忽略缓存直接请求
+    - 请求失败但存在过期的本地缓存时, 使用过期缓存并给出警告
+    :return: VoiceCatalog
+    :raises: RuntimeError 如果无法获取声音列表
+    """
+    ttl = _catalog_config['ttl']
+    now = time.time()
+    if not refresh:
+        with _loaded_catalogs_lock:
+            loaded = _loaded_catalogs.get(api_url)
+        if loaded is not None and now - loaded[0] < ttl:
+            return loaded[1]
+
+    fetched_at, data = (None, None) if refresh else _read_cached_catalog(api_url)
+    catalog = None
+    if data is not None and now - fetched_at < ttl:
+        try:
+            catalog = VoiceCatalog.from_response(data)
+        except ValueError:
+            catalog = None
+    if catalog is None:
+        try:
+            fresh = get_voices(api_url)
+            catalog = VoiceCatalog.from_response(fresh)
+            fetched_at = now
+            _write_cached_catalog(api_url, fresh)
+        except Exception as e:
+            stale_at, stale = _read_cached_catalog(api_url)
+            if stale is None:
+                raise RuntimeError(f"获取声音列表失败: {e}")
+            try:
+                catalog = VoiceCatalog.from_response(stale)
+            except ValueError as cache_error:
+                raise RuntimeError(f"获取声音列表失败: {e}, 本地缓存的列表也无法使用: {cache_error}")
+            print(f"警告: 获取声音列表失败 ({e}), 使用 {int((now - stale_at) // 60)} 分钟前缓存的列表。")
+            fetched_at = stale_at
+
+    with _loaded_catalogs_lock:
+        _loaded_catalogs[api_url] = (fetched_at, catalog)
+    return catalog
+
+
+def validate_voice(api_url, voice_id):
+    """
+    合成开始前检查声音ID是否存在于声音列表中
+    - 未指定声音时使用服务端默认声音, 不做检查
+    - 无法获取声音列表时只给出警告, 不阻止任务 (由合成请求本身报告错误)
+    :raises: ValueError 如果声音ID不存在
+    """
+    if not voice_id:
+        return
+    try:
+        catalog = load_voice_catalog(api_url)
+    except RuntimeError as e:
+        print(f"警告: {e}, 跳过声音ID检查。")
+        return
+    if catalog.get(voice_id) is not None:
+        return
+    message = f"声音ID '{voice_id}' 不存在 (共 {len(catalog)} 个可用声音, 使用 --list 查看)"
+    suggestions = catalog.suggest(voice_id)
+    if suggestions:
+        message += f"。您是否想使用: {', '.join(suggestions)}"
+    raise ValueError(message)